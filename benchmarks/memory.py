@@ -0,0 +1,106 @@
+"""
+Memory benchmarks.
+Generates one newsletter from a large link list in a fresh process per mode, the default
+one and the memory-bounded one, against the local stand-ins, and reports the peak RSS and
+duration of each. Every mode gets its own process since peak RSS never goes down.
+
+Usage:
+    python benchmarks/memory.py --links 500 --prerank 0 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+from stand_ins import FakeOpenAIServer, FakeSiteServer
+
+WORKER_SNIPPET = """
+import asyncio, json, resource, sys, time
+from newsletter.core.resources import AppResources
+
+async def main():
+    resources = AppResources.from_env()
+    await resources.start()
+    try:
+        start_time = time.perf_counter()
+        newsletter = await resources.build_agent(json.loads(sys.argv[1])).run_agent()
+        elapsed = time.perf_counter() - start_time
+    finally:
+        await resources.close()
+    print(json.dumps({
+        "seconds": elapsed,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "links": len(newsletter.links)
+    }))
+
+asyncio.run(main())
+"""
+
+
+async def run_mode(env: dict, links: list, workdir: str) -> dict:
+    # Generated images and batch files stay out of the working tree
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", WORKER_SNIPPET, json.dumps(links),
+        env=env, cwd=workdir, stdout=asyncio.subprocess.PIPE
+    )
+    stdout, _ = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"Benchmark worker exited with code {process.returncode}")
+    return json.loads(stdout.decode().strip().splitlines()[-1])
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("Usage:")[0].strip())
+    parser.add_argument("--links", type=int, default=500, help="Links of the newsletter")
+    parser.add_argument("--prerank", type=int, nargs="+", default=[0], help="Pre-ranking candidates, 0 to summarize every page")
+    parser.add_argument("--window", type=int, default=32, help="Pages held in memory in memory-bounded mode")
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="Mean chat completion latency in seconds")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="Mean page latency in seconds")
+    parser.add_argument("--article-paragraphs", type=int, default=1000, help="Paragraphs of each article")
+    args = parser.parse_args()
+
+    site = FakeSiteServer(latency=args.page_latency, article_paragraphs=args.article_paragraphs)
+    await site.start()
+    openai_server = FakeOpenAIServer(site.image_url, chat_latency=args.chat_latency, image_latency=0.1)
+    await openai_server.start()
+
+    workdir = tempfile.mkdtemp(prefix="newsletter_memory_")
+    base_env = dict(os.environ)
+    source_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    base_env.update({
+        "PYTHONPATH": os.pathsep.join(filter(None, [source_dir, base_env.get("PYTHONPATH")])),
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": openai_server.base_url,
+        "FETCH_VALIDATORS_PATH": os.path.join(workdir, "http_validators.sqlite3"),
+        "NEWSLETTER_STATE_DIR": os.path.join(workdir, "newsletters"),
+        "SPILL_DIR": os.path.join(workdir, "spill"),
+        "MEMORY_WINDOW": str(args.window),
+        # The stand-in has no rate limits, and the scheduler's defaults would make the run last minutes
+        "OPENAI_REQUESTS_PER_MINUTE": "100000",
+        "OPENAI_TOKENS_PER_MINUTE": "100000000",
+        "INTEREST_PROFILE": "databases, compilers and inference performance"
+    })
+
+    links = site.links(args.links)
+    print(f"{'mode':<16}{'prerank':>8}{'links':>8}{'seconds':>10}{'peak RSS MB':>13}")
+    try:
+        for candidates in args.prerank:
+            for mode in ("default", "memory-bounded"):
+                env = dict(
+                    base_env,
+                    MEMORY_BOUNDED="true" if mode == "memory-bounded" else "false",
+                    PRERANK_CANDIDATES=str(candidates),
+                    # Cold cache for every run
+                    CACHE_PATH=os.path.join(workdir, f"cache_{mode}_{candidates}", "newsletter_cache.sqlite3")
+                )
+                result = await run_mode(env, links, workdir)
+                print(f"{mode:<16}{candidates:>8}{result['links']:>8}{result['seconds']:>10.2f}{result['peak_rss_kb'] / 1024:>13.1f}")
+    finally:
+        await openai_server.stop()
+        await site.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
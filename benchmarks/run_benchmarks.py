@@ -0,0 +1,240 @@
+"""
+Newsletter pipeline benchmarks.
+Drives NewsletterAgent and the /generate-newsletter endpoint against local stand-ins of
+the OpenAI API and of the linked websites, at varying link counts and concurrency, and
+reports latency percentiles, throughput, peak RSS and the per-stage breakdown.
+
+Usage:
+    python benchmarks/run_benchmarks.py --links 10 50 --concurrency 1 4 --iterations 3
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List
+
+import aiohttp
+
+from stand_ins import FakeOpenAIServer, FakeSiteServer
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def merge_stages(total: Dict[str, Dict[str, float]], stages: Dict[str, Dict[str, float]]) -> None:
+    for stage, timing in stages.items():
+        merged = total.setdefault(stage, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        merged["count"] += timing["count"]
+        merged["total_seconds"] += timing["total_seconds"]
+        merged["max_seconds"] = max(merged["max_seconds"], timing["max_seconds"])
+
+
+def isolate_state(workdir: str, label: str) -> None:
+    """Point the cache, validator store, image reuse index and saved states to a fresh directory."""
+    directory = os.path.join(workdir, label)
+    os.environ.update({
+        "CACHE_PATH": os.path.join(directory, "newsletter_cache.sqlite3"),
+        "FETCH_VALIDATORS_PATH": os.path.join(directory, "http_validators.sqlite3"),
+        "IMAGE_INDEX_PATH": os.path.join(directory, "image_index.sqlite3"),
+        "NEWSLETTER_STATE_DIR": os.path.join(directory, "newsletters")
+    })
+
+
+def summarize(target: str, links: int, concurrency: int, latencies: List[float], elapsed: float, stages: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "target": target,
+        "links": links,
+        "concurrency": concurrency,
+        "newsletters": len(latencies),
+        "p50_seconds": percentile(latencies, 0.50),
+        "p99_seconds": percentile(latencies, 0.99),
+        "mean_seconds": statistics.mean(latencies),
+        "newsletters_per_minute": len(latencies) / elapsed * 60,
+        "links_per_second": len(latencies) * links / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages
+    }
+
+
+async def bench_agent(site: FakeSiteServer, links: int, concurrency: int, iterations: int, prepare: Callable[[int], None]) -> Dict[str, Any]:
+    """
+    Run `iterations` rounds of `concurrency` concurrent newsletters through NewsletterAgent.
+
+    `prepare` is called with the iteration number before each round, whose resources are built afterwards.
+    """
+    from newsletter.core.resources import AppResources
+
+    latencies: List[float] = []
+    stages: Dict[str, Dict[str, float]] = {}
+    elapsed = 0.0
+
+    async def one_newsletter(resources: AppResources) -> None:
+        start_time = time.perf_counter()
+        newsletter = await resources.build_agent(site.links(links)).run_agent()
+        latencies.append(time.perf_counter() - start_time)
+        merge_stages(stages, newsletter.metrics.get("stages", {}))
+
+    for iteration in range(iterations):
+        prepare(iteration)
+        resources = AppResources.from_env()
+        await resources.start()
+        try:
+            start_time = time.perf_counter()
+            await asyncio.gather(*[one_newsletter(resources) for _ in range(concurrency)])
+            elapsed += time.perf_counter() - start_time
+        finally:
+            await resources.close()
+
+    return summarize("agent", links, concurrency, latencies, elapsed, stages)
+
+
+@asynccontextmanager
+async def serve_app(port: int):
+    """Serve the API with uvicorn in this process, its resources built from the current environment."""
+    import uvicorn
+    from newsletter.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            server_task.result()
+        await asyncio.sleep(0.05)
+    try:
+        yield
+    finally:
+        server.should_exit = True
+        await server_task
+
+
+async def bench_endpoint(site: FakeSiteServer, links: int, concurrency: int, iterations: int, port: int, prepare: Callable[[int], None]) -> Dict[str, Any]:
+    """Run the same load against POST /generate-newsletter, the server being restarted for each round after `prepare`."""
+    latencies: List[float] = []
+    stages: Dict[str, Dict[str, float]] = {}
+    url = f"http://127.0.0.1:{port}/generate-newsletter"
+    elapsed = 0.0
+
+    async def one_newsletter(session: aiohttp.ClientSession) -> None:
+        start_time = time.perf_counter()
+        async with session.post(url, json={"links": site.links(links)}) as response:
+            response.raise_for_status()
+            body = await response.json()
+        latencies.append(time.perf_counter() - start_time)
+        merge_stages(stages, body.get("metrics", {}).get("stages", {}))
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        for iteration in range(iterations):
+            prepare(iteration)
+            async with serve_app(port):
+                start_time = time.perf_counter()
+                await asyncio.gather(*[one_newsletter(session) for _ in range(concurrency)])
+                elapsed += time.perf_counter() - start_time
+
+    return summarize("endpoint", links, concurrency, latencies, elapsed, stages)
+
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    header = f"{'target':<9}{'links':>6}{'conc':>6}{'runs':>6}{'p50 s':>9}{'p99 s':>9}{'nl/min':>9}{'links/s':>9}{'rss MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['target']:<9}{result['links']:>6}{result['concurrency']:>6}{result['newsletters']:>6}"
+            f"{result['p50_seconds']:>9.2f}{result['p99_seconds']:>9.2f}{result['newsletters_per_minute']:>9.1f}"
+            f"{result['links_per_second']:>9.1f}{result['peak_rss_mb']:>9.0f}"
+        )
+
+    for result in results:
+        print(f"\nStages of {result['target']}, {result['links']} links, concurrency {result['concurrency']}:")
+        for stage, timing in sorted(result["stages"].items(), key=lambda item: -item[1]["total_seconds"]):
+            mean = timing["total_seconds"] / timing["count"] if timing["count"] else 0.0
+            print(f"  {stage:<16}{timing['count']:>7} calls  mean {mean:7.3f}s  max {timing['max_seconds']:7.3f}s")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("Usage:")[0].strip())
+    parser.add_argument("--links", type=int, nargs="+", default=[10, 50], help="Link counts per newsletter")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4], help="Concurrent newsletters")
+    parser.add_argument("--iterations", type=int, default=3, help="Rounds of concurrent newsletters per configuration")
+    parser.add_argument("--targets", nargs="+", choices=["agent", "endpoint"], default=["agent", "endpoint"])
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="Mean chat completion latency in seconds")
+    parser.add_argument("--image-latency", type=float, default=4.0, help="Mean image generation latency in seconds")
+    parser.add_argument("--page-latency", type=float, default=0.2, help="Mean page latency in seconds")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of OpenAI requests answered with a 429")
+    parser.add_argument(
+        "--use-cache", action="store_true",
+        help="Keep the cache, image index and saved states across all runs (warm after the first) instead of a cold start per iteration"
+    )
+    parser.add_argument("--port", type=int, default=8765, help="Port of the benchmarked endpoint")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    site = FakeSiteServer(latency=args.page_latency)
+    await site.start()
+    openai_server = FakeOpenAIServer(
+        site.image_url,
+        chat_latency=args.chat_latency,
+        image_latency=args.image_latency,
+        rate_limit_rate=args.rate_limit_rate
+    )
+    await openai_server.start()
+
+    # Generated images, the cache and batch files stay out of the working tree
+    workdir = tempfile.mkdtemp(prefix="newsletter_bench_")
+    os.chdir(workdir)
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": openai_server.base_url
+    })
+    isolate_state(workdir, "shared")
+
+    results: List[Dict[str, Any]] = []
+    try:
+        for target in args.targets:
+            for links in args.links:
+                for concurrency in args.concurrency:
+                    def prepare(iteration: int) -> None:
+                        # Every round starts cold, unless runs are meant to share a warm cache
+                        if not args.use_cache:
+                            isolate_state(workdir, f"{target}_{links}_{concurrency}_{iteration}")
+
+                    if target == "agent":
+                        result = await bench_agent(site, links, concurrency, args.iterations, prepare)
+                    else:
+                        result = await bench_endpoint(site, links, concurrency, args.iterations, args.port, prepare)
+                    results.append(result)
+                    print(f"{target}: {links} links x {concurrency} concurrent, p50 {result['p50_seconds']:.2f}s", file=sys.stderr)
+    finally:
+        await openai_server.stop()
+        await site.stop()
+
+    print_report(results)
+    print(f"\nOpenAI requests: {openai_server.requests}, rate limited: {openai_server.rate_limited}. Page requests: {site.requests}")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
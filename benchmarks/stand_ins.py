@@ -0,0 +1,355 @@
+"""
+Benchmark stand-ins.
+Local servers replacing the OpenAI API and the linked websites, so that the pipeline can
+be benchmarked without spending money or depending on the network.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import random
+import re
+import time
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+from PIL import Image
+
+from newsletter.utils.redis_cache import RELEASE_LEASE_SCRIPT
+
+LINK_PATTERN = re.compile(r"Web page URL: (\S+)")
+
+WORDS = (
+    "model inference latency throughput cache kernel compiler database index query vector "
+    "embedding cluster network protocol release benchmark memory allocator scheduler queue "
+    "runtime security patch framework library container storage replication consensus"
+).split()
+
+
+def stable_int(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class FakeOpenAIServer:
+    """
+    OpenAI-compatible server answering chat completions, image generations and embeddings.
+
+    Every response is delayed by a random latency around the configured one, and a share
+    of requests is rejected with a 429 and a Retry-After header, like a loaded account.
+    """
+
+    def __init__(
+        self,
+        image_url: str,
+        chat_latency: float = 0.8,
+        image_latency: float = 4.0,
+        embedding_latency: float = 0.1,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0.5,
+        port: int = 0
+    ):
+        """
+        Args:
+            image_url (str): URL returned for generated images, served by the site stand-in
+            chat_latency (float): Mean latency of chat completions in seconds
+            image_latency (float): Mean latency of image generations in seconds
+            embedding_latency (float): Mean latency of embedding requests in seconds
+            rate_limit_rate (float): Share of requests answered with a 429, between 0 and 1
+            retry_after (float): Retry-After delay of the 429s in seconds
+            port (int): Port to listen on, a free one by default
+        """
+        self.image_url = image_url
+        self.chat_latency = chat_latency
+        self.image_latency = image_latency
+        self.embedding_latency = embedding_latency
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.port = port
+        self.requests: Dict[str, int] = {}
+        self.rate_limited = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/images/generations", self.image_generations)
+        app.router.add_post("/v1/embeddings", self.embeddings)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _delay(self, endpoint: str, latency: float) -> Optional[web.Response]:
+        """Count the request, wait for its latency and return a 429 response if it is rate limited."""
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        if random.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            await asyncio.sleep(0.01)
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"retry-after-ms": str(int(self.retry_after * 1000))}
+            )
+        await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+        return None
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        rejected = await self._delay("chat", self.chat_latency)
+        if rejected is not None:
+            return rejected
+
+        prompt = body["messages"][-1]["content"]
+        schema_name = body.get("response_format", {}).get("json_schema", {}).get("name")
+        if schema_name == "PageSummary":
+            match = LINK_PATTERN.search(prompt)
+            link = match.group(1) if match else "unknown"
+            content: Dict[str, Any] = {
+                "link": link,
+                "title": f"Article {stable_int(link) % 10_000}",
+                "content_summary": " ".join(random.choices(WORDS, k=80)),
+                "interest_score": stable_int(link) % 10 + 1,
+                "image": None
+            }
+        else:
+            content = {"abstract": " ".join(random.choices(WORDS, k=200))}
+
+        prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+        completion_tokens = len(json.dumps(content)) // 4
+        return web.json_response({
+            "id": f"chatcmpl-{random.getrandbits(64):x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(content), "refusal": None},
+                "logprobs": None,
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+    async def image_generations(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        rejected = await self._delay("images", self.image_latency)
+        if rejected is not None:
+            return rejected
+        # One distinct image per prompt, like the real API
+        return web.json_response({
+            "created": int(time.time()),
+            "data": [{"url": f"{self.image_url}?prompt={stable_int(body['prompt']):x}", "revised_prompt": body["prompt"]}]
+        })
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        rejected = await self._delay("embeddings", self.embedding_latency)
+        if rejected is not None:
+            return rejected
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for index, text in enumerate(texts):
+            generator = random.Random(stable_int(text[:200]))
+            data.append({"object": "embedding", "index": index, "embedding": [generator.uniform(-1, 1) for _ in range(256)]})
+        return web.json_response({
+            "object": "list",
+            "data": data,
+            "model": body["model"],
+            "usage": {"prompt_tokens": sum(len(text) for text in texts) // 4, "total_tokens": sum(len(text) for text in texts) // 4}
+        })
+
+
+class FakeSiteServer:
+    """
+    Static site serving large, realistic article pages and the source image of generated images.
+
+    Pages carry the usual boilerplate of news sites (navigation, scripts, inline styles,
+    cookie banners, related articles, comments) around an article of `article_paragraphs`
+    paragraphs, and are served after a random latency around `latency`.
+    """
+
+    def __init__(self, latency: float = 0.2, article_paragraphs: int = 60, boilerplate_kb: int = 150, port: int = 0):
+        """
+        Args:
+            latency (float): Mean latency of page responses in seconds
+            article_paragraphs (int): Number of paragraphs of each article
+            boilerplate_kb (int): Approximate size of the boilerplate around each article, in KB
+            port (int): Port to listen on, a free one by default
+        """
+        self.latency = latency
+        self.article_paragraphs = article_paragraphs
+        self.boilerplate_kb = boilerplate_kb
+        self.port = port
+        self.requests = 0
+        self._pages: Dict[int, str] = {}
+        self._image: bytes = b""
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def image_url(self) -> str:
+        return f"{self.base_url}/images/generated.png"
+
+    def links(self, count: int) -> list:
+        return [f"{self.base_url}/articles/{index}" for index in range(count)]
+
+    async def start(self) -> None:
+        self._image = await asyncio.to_thread(self._render_image)
+        app = web.Application()
+        app.router.add_get("/articles/{index}", self.article)
+        app.router.add_get("/images/generated.png", self.image)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @staticmethod
+    def _render_image() -> bytes:
+        """A 1024x1024 PNG with noise, about the size of a real generated image."""
+        noise = Image.frombytes("RGB", (256, 256), random.randbytes(256 * 256 * 3)).resize((1024, 1024))
+        buffer = io.BytesIO()
+        noise.save(buffer, "PNG")
+        return buffer.getvalue()
+
+    def _render_page(self, index: int) -> str:
+        generator = random.Random(index)
+
+        def sentence(words: int) -> str:
+            return " ".join(generator.choices(WORDS, k=words)).capitalize() + "."
+
+        boilerplate_item = '<li class="nav-item"><a href="/section/{0}" style="color:#333;padding:4px">Section {0}</a></li>'
+        navigation = "".join(boilerplate_item.format(item) for item in range(self.boilerplate_kb * 4))
+        script = "<script>window.__STATE__ = " + json.dumps({"items": [sentence(12) for _ in range(self.boilerplate_kb)]}) + ";</script>"
+        article = "".join(f"<p>{sentence(generator.randint(30, 60))}</p>" for _ in range(self.article_paragraphs))
+        related = "".join(f'<div class="related-item"><a href="/articles/{generator.randint(0, 10_000)}">{sentence(8)}</a></div>' for _ in range(40))
+        comments = "".join(f'<div class="comment"><p>{sentence(20)}</p></div>' for _ in range(30))
+        return (
+            f"<!DOCTYPE html><html><head><title>Article {index}</title>"
+            f'<link rel="canonical" href="{self.base_url}/articles/{index}">'
+            f"<style>{'.x{color:red}' * 500}</style>{script}</head><body>"
+            f'<header class="site-header"><nav><ul>{navigation}</ul></nav></header>'
+            f'<div class="cookie-banner">We use cookies. <button>Accept</button></div>'
+            f"<main><article><h1>Article {index}: {sentence(6)}</h1>{article}</article></main>"
+            f'<aside class="sidebar">{related}</aside><section class="comments">{comments}</section>'
+            f'<footer class="site-footer">{sentence(30)}</footer></body></html>'
+        )
+
+    async def article(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        index = int(request.match_info["index"])
+        if index not in self._pages:
+            self._pages[index] = self._render_page(index)
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        return web.Response(text=self._pages[index], content_type="text/html")
+
+    async def image(self, request: web.Request) -> web.Response:
+        return web.Response(body=self._image, content_type="image/png")
+
+
+class FakeRedisServer:
+    """
+    In-memory server speaking the subset of the Redis protocol used by RedisCache:
+    PING, AUTH, SELECT, GET, SET with EX/PX/NX, DEL, and EVAL of the lease release script.
+    """
+
+    def __init__(self, port: int = 0):
+        """
+        Args:
+            port (int): Port to listen on, a free one by default
+        """
+        self.port = port
+        self.commands: Dict[str, int] = {}
+        self._data: Dict[bytes, bytes] = {}
+        self._expires_at: Dict[bytes, float] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                args = []
+                for _ in range(int(header[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self._execute(args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _alive(self, key: bytes) -> bool:
+        if key in self._expires_at and self._expires_at[key] <= time.monotonic():
+            del self._data[key], self._expires_at[key]
+        return key in self._data
+
+    def _execute(self, args: list) -> bytes:
+        command = args[0].decode().upper()
+        self.commands[command] = self.commands.get(command, 0) + 1
+        if command in ("PING", "AUTH", "SELECT"):
+            return b"+OK\r\n" if command != "PING" else b"+PONG\r\n"
+        if command == "GET":
+            if not self._alive(args[1]):
+                return b"$-1\r\n"
+            value = self._data[args[1]]
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == "DEL":
+            deleted = sum(1 for key in args[1:] if self._alive(key) and self._data.pop(key) is not None)
+            for key in args[1:]:
+                self._expires_at.pop(key, None)
+            return b":%d\r\n" % deleted
+        if command == "SET":
+            key, value = args[1], args[2]
+            options = [arg.decode().upper() for arg in args[3:]]
+            if "NX" in options and self._alive(key):
+                return b"$-1\r\n"
+            self._data[key] = value
+            self._expires_at.pop(key, None)
+            for unit, scale in (("EX", 1.0), ("PX", 0.001)):
+                if unit in options:
+                    self._expires_at[key] = time.monotonic() + float(options[options.index(unit) + 1]) * scale
+            return b"+OK\r\n"
+        if command == "EVAL" and args[1].decode() == RELEASE_LEASE_SCRIPT:
+            key, owner = args[3], args[4]
+            if self._alive(key) and self._data[key] == owner:
+                del self._data[key]
+                self._expires_at.pop(key, None)
+                return b":1\r\n"
+            return b":0\r\n"
+        return b"-ERR unknown command '%s'\r\n" % command.encode()
@@ -0,0 +1,112 @@
+"""
+Startup benchmarks.
+Measures the cold start of the API: the time to import the app module in a fresh
+interpreter, the slowest imports, and the time from launching a uvicorn worker to its
+first successful /health response, lifespan warm-up included.
+
+Usage:
+    python benchmarks/startup.py --runs 5
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Tuple
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import newsletter.main; print(time.perf_counter() - start)"
+
+
+def benchmark_env(workdir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    source_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [source_dir, env.get("PYTHONPATH")]))
+    # Startup never calls OpenAI, a placeholder key is enough
+    env.setdefault("OPENAI_API_KEY", "startup-benchmark")
+    env.update({
+        "CACHE_PATH": os.path.join(workdir, "cache", "newsletter_cache.sqlite3"),
+        "FETCH_VALIDATORS_PATH": os.path.join(workdir, "cache", "http_validators.sqlite3"),
+        "NEWSLETTER_STATE_DIR": os.path.join(workdir, "newsletters")
+    })
+    return env
+
+
+def import_time(env: Dict[str, str]) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, check=True, capture_output=True, text=True)
+    return float(output.stdout.strip())
+
+
+def slowest_imports(env: Dict[str, str], count: int) -> List[Tuple[int, str]]:
+    """Return the top-level imports of newsletter.main with the highest cumulative time, in microseconds."""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import newsletter.main"],
+        env=env, check=True, capture_output=True, text=True
+    )
+    imports: List[Tuple[int, str]] = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Nested imports are indented by two spaces per level, keep the ones made by the app module itself
+        if len(name) - len(name.lstrip()) == 3:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_ready(env: Dict[str, str], workdir: str, timeout: float = 60.0) -> float:
+    """Launch a uvicorn worker and return the seconds until /health answers."""
+    port = free_port()
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "newsletter.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env, cwd=workdir
+    )
+    try:
+        while time.perf_counter() - start_time < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start_time
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError(f"Worker not ready after {timeout:.0f} seconds")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("Usage:")[0].strip())
+    parser.add_argument("--runs", type=int, default=5, help="Measurements of each kind")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports listed")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="newsletter_startup_")
+    env = benchmark_env(workdir)
+
+    import_times = [import_time(env) for _ in range(args.runs)]
+    ready_times = [time_to_ready(env, workdir) for _ in range(args.runs)]
+
+    print(f"{'':<24}{'median s':>10}{'min s':>10}{'max s':>10}")
+    for name, values in (("import newsletter.main", import_times), ("launch to /health", ready_times)):
+        print(f"{name:<24}{statistics.median(values):>10.3f}{min(values):>10.3f}{max(values):>10.3f}")
+
+    print("\nSlowest imports of newsletter.main (cumulative):")
+    for microseconds, name in slowest_imports(env, args.top):
+        print(f"  {microseconds / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
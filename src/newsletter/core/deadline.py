@@ -0,0 +1,67 @@
+"""
+Newsletter deadline.
+Splits the time a caller allows for a newsletter across the pipeline stages, so that each
+stage knows when to stop waiting and hand over whatever it has. Time a stage doesn't use
+goes to the stages after it.
+"""
+import time
+from typing import Dict, Optional
+
+# Pipeline stages, in the order their budgets are spent
+STAGES = ("fetch", "summarize", "abstract", "images", "render")
+
+# Share of the deadline of each stage; rendering only keeps a margin for the last images to be encoded
+DEFAULT_SHARES: Dict[str, float] = {
+    "fetch": 0.25,
+    "summarize": 0.35,
+    "abstract": 0.1,
+    "images": 0.25,
+    "render": 0.05
+}
+
+
+def parse_stage_shares(spec: str) -> Dict[str, float]:
+    """
+    Parse stage shares written as comma-separated stage:share pairs, e.g. "fetch:0.2,images:0.3".
+    Stages that aren't listed keep their default share.
+    """
+    shares = dict(DEFAULT_SHARES)
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        stage, _, share = item.partition(":")
+        stage = stage.strip()
+        if stage not in STAGES or not share.strip():
+            raise ValueError(f"Invalid deadline share: {item.strip()}. Use stage:share with a stage among {', '.join(STAGES)}.")
+        shares[stage] = float(share)
+    return shares
+
+
+class Deadline:
+    def __init__(self, seconds: float, shares: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            seconds (float): Time allowed for the whole newsletter, from now
+            shares (Dict[str, float]): Relative share of each stage in STAGES, DEFAULT_SHARES by default
+        """
+        if seconds <= 0:
+            raise ValueError(f"The deadline must be positive, got {seconds}")
+        self.seconds = seconds
+        self.shares = {stage: max(0.0, (shares or DEFAULT_SHARES).get(stage, 0.0)) for stage in STAGES}
+        self.expires_at = time.time() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline, 0 once it has passed."""
+        return max(0.0, self.expires_at - time.time())
+
+    def budget(self, stage: str) -> float:
+        """
+        Seconds from now until a stage must be done.
+
+        The time left is split between the stage and the ones after it, in proportion to their shares.
+        """
+        remaining_stages = STAGES[STAGES.index(stage):]
+        total = sum(self.shares[name] for name in remaining_stages)
+        if total <= 0:
+            return self.remaining()
+        return self.remaining() * self.shares[stage] / total
@@ -0,0 +1,123 @@
+"""
+Newsletter fan-out.
+Generates many newsletters from overlapping link pools at once: every unique link is
+fetched and summarized a single time, images are generated once per featured summary,
+and each newsletter is then composed from the shared results.
+"""
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from newsletter.utils.dedup import canonicalize_url
+
+if TYPE_CHECKING:
+    # Only needed for annotations: the API imports this module at startup, before the agent is warmed up
+    from newsletter.core.newsletter_agent import Newsletter, NewsletterAgent, PageSummary
+
+
+class NewsletterSpec(BaseModel):
+    name: str
+    links: List[str]
+    max_summaries: int = 8
+    # Set to save the newsletter's state for incremental regeneration
+    newsletter_id: Optional[str] = None
+
+
+class NewsletterFanOut:
+    def __init__(self, build_agent: Callable[..., "NewsletterAgent"]):
+        """
+        Args:
+            build_agent (Callable): Builds an agent for a list of links, with extra agent
+                arguments as keywords, e.g. AppResources.build_agent
+        """
+        self.build_agent = build_agent
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def union_links(specs: List[NewsletterSpec]) -> List[str]:
+        """Return the links of all newsletters, each URL once, in order of first appearance."""
+        links: Dict[str, str] = {}
+        for spec in specs:
+            for link in spec.links:
+                links.setdefault(canonicalize_url(link), link)
+        return list(links.values())
+
+    @staticmethod
+    def select_summaries(spec: NewsletterSpec, summaries: Dict[str, "PageSummary"], duplicates: Dict[str, str]) -> List["PageSummary"]:
+        """Pick the shared summaries (keyed by canonical URL) of a newsletter's links, following links that were collapsed as duplicates."""
+        selected: Dict[str, "PageSummary"] = {}
+        for link in spec.links:
+            # Duplicates may point to another duplicate, follow the chain
+            for _ in range(3):
+                if canonicalize_url(link) in summaries:
+                    break
+                link = duplicates.get(link, link)
+            canonical = canonicalize_url(link)
+            if canonical in summaries:
+                selected.setdefault(canonical, summaries[canonical])
+        return list(selected.values())
+
+    async def generate(self, specs: List[NewsletterSpec]) -> Dict[str, "Newsletter"]:
+        """
+        Generate several newsletters, sharing the work on their common links.
+
+        Args:
+            specs (List[NewsletterSpec]): Newsletters to generate, with unique names
+
+        Returns:
+            Dict[str, Newsletter]: The newsletters, keyed by name. Their metrics cover the whole
+                fan-out, shared fetches and summaries included
+        """
+        names = [spec.name for spec in specs]
+        if len(set(names)) != len(names):
+            raise ValueError("Newsletter names must be unique")
+
+        start_time = time.time()
+        links = self.union_links(specs)
+        total_links = sum(len(spec.links) for spec in specs)
+        self.logger.info(f"Generating {len(specs)} newsletters from {len(links)} unique links ({total_links} in total)")
+
+        # Pre-ranking is relative to the pages it is given, so it is left to no newsletter here:
+        # a page dropped from the union could be among the best of a smaller newsletter. For the
+        # same reason, every summary is kept in memory rather than only the top ones
+        shared_agent = self.build_agent(links, pre_ranker=None, memory_bounded=False)
+        summaries = {canonicalize_url(summary.link): summary for summary in await shared_agent.summarize_and_score_all_pages()}
+
+        selections = {spec.name: self.select_summaries(spec, summaries, shared_agent.duplicates) for spec in specs}
+
+        # Featured summaries of every newsletter, each illustrated once even when several newsletters feature it,
+        # in the tier of the best slot it gets
+        featured: Dict[str, "PageSummary"] = {}
+        slots: Dict[str, int] = {}
+        for spec in specs:
+            # The same pick as the newsletter's own agent, so that exactly its featured pages are illustrated
+            for slot, summary in enumerate(shared_agent.featured_summaries(selections[spec.name], spec.max_summaries)):
+                featured.setdefault(summary.link, summary)
+                slots[summary.link] = min(slot, slots.get(summary.link, slot))
+        await shared_agent.generate_summaries_images(list(featured.values()), [slots[link] for link in featured])
+
+        async def compose(spec: NewsletterSpec) -> "Newsletter":
+            # Summaries are given, so the agent neither pre-ranks nor spills them
+            agent = self.build_agent(
+                spec.links,
+                pre_ranker=None,
+                memory_bounded=False,
+                max_summaries=spec.max_summaries,
+                newsletter_id=spec.newsletter_id,
+                metrics=shared_agent.metrics
+            )
+            # Copies, so that newsletters don't see each other's changes
+            agent.pages_summaries = [summary.model_copy() for summary in selections[spec.name]]
+            agent.summaries_ready = True
+            return await agent.compose_full_newsletter()
+
+        newsletters = await asyncio.gather(*[compose(spec) for spec in specs])
+
+        execution_time = time.time() - start_time
+        self.logger.info(f"Generated {len(specs)} newsletters in {execution_time:.2f} seconds, summarizing {len(summaries)} pages once instead of {total_links}")
+        shared_agent.metrics.observe_stage("fan_out", execution_time)
+
+        return dict(zip(names, newsletters))
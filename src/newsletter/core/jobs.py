@@ -0,0 +1,224 @@
+"""
+Newsletter jobs.
+Background execution of newsletter generation: jobs are queued, picked up by a bounded
+pool of worker tasks, and their progress can be polled or streamed.
+
+Job records live in the memory of the process that accepted them, so a job can only be run
+and followed by that process; with several server workers, clients must stick to one of them.
+"""
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+# Called by the job runner to publish progress: (stage, data)
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+
+class Job(BaseModel):
+    id: str
+    links: List[str]
+    # Newsletter regenerated incrementally, if any
+    newsletter_id: Optional[str] = None
+    # Seconds allowed once a worker picks the job up; the default deadline if unset
+    deadline_seconds: Optional[float] = None
+    status: str = "queued"  # queued, running, completed or failed
+    stage: Optional[str] = None
+    summaries: List[Dict[str, Any]] = Field(default_factory=list)
+    abstract: Optional[str] = None
+    newsletter: Optional[str] = None
+    # Images referenced by cid in the newsletter
+    attachments: List[Dict[str, str]] = Field(default_factory=list)
+    error: Optional[str] = None
+    metrics: Dict[str, Any] = Field(default_factory=dict)
+    created_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobQueue(ABC):
+    """
+    Queue of job ids waiting for a worker of the JobManager that submitted them.
+
+    The ids refer to records kept by that JobManager, so the queue must not be shared
+    between processes.
+    """
+
+    @abstractmethod
+    async def put(self, job_id: str) -> None:
+        """Queue a job id, raising JobQueueFull when there is no room for it."""
+
+    @abstractmethod
+    async def get(self) -> str:
+        """Wait for the next job id."""
+
+    @abstractmethod
+    def qsize(self) -> int:
+        """Return the number of job ids waiting."""
+
+
+class InMemoryJobQueue(JobQueue):
+    def __init__(self, maxsize: int = 100):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    async def put(self, job_id: str) -> None:
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Job queue is full ({self._queue.maxsize} jobs waiting)")
+
+    async def get(self) -> str:
+        return await self._queue.get()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+
+class JobManager:
+    def __init__(
+        self,
+        run_job: Callable[[Job, ProgressCallback], Awaitable[str]],
+        queue: Optional[JobQueue] = None,
+        workers: int = 2,
+        max_jobs: int = 1000
+    ):
+        """
+        Args:
+            run_job (Callable): Coroutine function producing the newsletter HTML of a job
+            queue (JobQueue): Queue of pending jobs, in-process by default
+            workers (int): Number of jobs processed concurrently
+            max_jobs (int): Number of jobs kept in memory; the oldest finished ones are dropped first
+        """
+        self.run_job = run_job
+        self.queue = queue or InMemoryJobQueue()
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.logger = logging.getLogger(__name__)
+
+        self.jobs: Dict[str, Job] = {}
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._worker_tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """Start the worker tasks. Must be called from a running event loop."""
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(index), name=f"newsletter-job-worker-{index}")
+            for index in range(self.workers)
+        ]
+        self.logger.info(f"Started {self.workers} job workers")
+
+    async def stop(self) -> None:
+        """Cancel the worker tasks."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def submit(
+        self,
+        links: List[str],
+        newsletter_id: Optional[str] = None,
+        deadline_seconds: Optional[float] = None
+    ) -> Job:
+        """
+        Queue a newsletter job and return it immediately.
+
+        Args:
+            links (List[str]): Links of the newsletter
+            newsletter_id (str): Newsletter to regenerate incrementally, if any
+            deadline_seconds (float): Seconds allowed once the job starts running
+        """
+        job = Job(id=uuid.uuid4().hex, links=links, newsletter_id=newsletter_id, deadline_seconds=deadline_seconds)
+        self.jobs[job.id] = job
+        self._changed[job.id] = asyncio.Event()
+        try:
+            await self.queue.put(job.id)
+        except JobQueueFull:
+            self._forget(job.id)
+            raise
+        self._evict()
+        self.logger.info(f"Queued job {job.id} with {len(links)} links")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def events(self, job_id: str) -> AsyncIterator[Job]:
+        """Yield a snapshot of the job each time it changes, until it is finished."""
+        while True:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            changed = self._changed[job_id]
+            yield job.model_copy(deep=True)
+            if job.finished:
+                return
+            await changed.wait()
+
+    def _update(self, job: Job, **fields) -> None:
+        """Update a job and wake up the listeners waiting for its next change."""
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.updated_at = time.time()
+        changed = self._changed.get(job.id)
+        if changed is not None:
+            self._changed[job.id] = asyncio.Event()
+            changed.set()
+
+    def _report(self, job: Job, stage: str, data: Dict[str, Any]) -> None:
+        """Record the partial results published by a running job."""
+        if stage == "summary":
+            job.summaries.append(data)
+        elif stage == "abstract":
+            job.abstract = data.get("abstract")
+        elif stage == "attachments":
+            job.attachments = data["attachments"]
+        elif stage == "metrics":
+            job.metrics = data
+        self._update(job, stage=stage)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self.queue.get()
+            job = self.jobs.get(job_id)
+            if job is None:
+                self.logger.warning(f"Worker {index} dropping unknown job {job_id}")
+                continue
+
+            start_time = time.time()
+            self.logger.info(f"Worker {index} starting job {job_id}")
+            self._update(job, status="running")
+            try:
+                newsletter = await self.run_job(job, lambda stage, data: self._report(job, stage, data))
+                self._update(job, status="completed", stage="completed", newsletter=newsletter)
+                self.logger.info(f"Job {job_id} completed in {time.time() - start_time:.2f} seconds")
+            except asyncio.CancelledError:
+                self._update(job, status="failed", error="Job cancelled")
+                raise
+            except Exception as e:
+                self.logger.error(f"Error running job {job_id}: {str(e)}")
+                self._update(job, status="failed", error=str(e))
+
+    def _evict(self) -> None:
+        """Drop the oldest finished jobs once more than max_jobs are stored."""
+        excess = len(self.jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        finished = sorted((job for job in self.jobs.values() if job.finished), key=lambda job: job.updated_at)
+        for job in finished[:excess]:
+            self._forget(job.id)
+
+    def _forget(self, job_id: str) -> None:
+        self.jobs.pop(job_id, None)
+        self._changed.pop(job_id, None)
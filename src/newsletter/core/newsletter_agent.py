@@ -1,13 +1,31 @@
 import time
 import asyncio
-from typing import List, Dict, Tuple, Optional
+import heapq
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Callable, List, Dict, Tuple, Optional
 import logging
 import os
 from datetime import datetime
-from dotenv import load_dotenv
+from pathlib import Path
+from uuid import uuid4
+import aiohttp
+from concurrent.futures import Executor
 from openai import AsyncOpenAI
+from newsletter.core.deadline import Deadline
+from newsletter.core.speculation import SpeculativeStart
+from newsletter.templates import renderer
 from newsletter.utils.image_gen import ImageGenerator
 from newsletter.utils.link_fetcher import LinkFetcher
+from newsletter.utils.batch import BatchBackend, result_content, write_batch_file
+from newsletter.utils.cache import Cache, content_hash
+from newsletter.utils.single_flight import SingleFlight
+from newsletter.utils.spill import SpillStore, TopK
+from newsletter.utils.content_extractor import count_tokens, extract_title, truncate_to_token_budget
+from newsletter.utils.dedup import canonicalize_url
+from newsletter.utils.embeddings import PreRanker
+from newsletter.utils.llm_scheduler import LLMScheduler
+from newsletter.utils.metrics import PipelineMetrics
+from newsletter.utils.state_store import StateStore
 from newsletter.config.newsletter_prompts import (
     SUMMARIZE_AND_SCORE_PAGE_SYS_MSG,
     SUMMARIZE_AND_SCORE_PAGE_USR_MSG,
@@ -15,37 +33,196 @@ from newsletter.config.newsletter_prompts import (
     ARTICLE_ABSTRACT_USR_MSG
 )
 
-from rich import print
 from pydantic import BaseModel
 
+# Placeholders of failed LLM calls start with these, and are never saved in the newsletter state
+SUMMARY_ERROR_PREFIX = "Error summarizing page"
+ABSTRACT_ERROR_PREFIX = "Error generating article abstract"
+
+# Number of pages featured in a newsletter when the caller doesn't choose
+DEFAULT_MAX_SUMMARIES = 8
+
 
 class PageSummary(BaseModel):
     link: str
     title: str
     content_summary: str
     interest_score: float
-    image: Optional[str] = None
+    # Generated image, as returned by ImageGenerator.generate_image: url, local_path, mime_type, ...
+    image: Optional[Dict[str, Any]] = None
+
+    @property
+    def featurable(self) -> bool:
+        """Whether the page can be featured: it has a summary text, and not the placeholder of a failure."""
+        return bool(self.content_summary) and not self.content_summary.startswith(SUMMARY_ERROR_PREFIX)
 
 class Newsletter(BaseModel):
     full_newsletter: str
     links: List[str]
+    # Images to attach to the email when they are referenced by cid
+    attachments: List[Dict[str, str]] = []
+    metrics: Dict[str, Any] = {}
+    # What was skipped or replaced by a placeholder to meet the deadline
+    degradations: List[Dict[str, Any]] = []
 
 class ArticleAbstract(BaseModel):
     abstract: str
 
+class NewsletterState(BaseModel):
+    """Stage outputs of a newsletter, saved to regenerate it incrementally."""
+    summary_version: str
+    abstract_version: str
+    # Page summaries and generated images, keyed by canonical link
+    summaries: Dict[str, PageSummary] = {}
+    images: Dict[str, Dict[str, Any]] = {}
+    # Links of the top summaries the abstract was written from
+    top_links: List[str] = []
+    abstract: Optional[str] = None
+    # Links collapsed as duplicates, mapped to the link kept in their place, both canonical
+    duplicates: Dict[str, str] = {}
+
 class NewsletterAgent:
-    def __init__(self, client: AsyncOpenAI, links: List[str], max_summaries: int = 8):
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        links: List[str],
+        max_summaries: int = DEFAULT_MAX_SUMMARIES,
+        max_concurrent_images: int = 4,
+        image_timeout: float = 90.0,
+        model: str = "gpt-4o-mini",
+        cache: Optional[Cache] = None,
+        max_concurrent_fetches: int = 10,
+        max_concurrent_summaries: int = 8,
+        session: Optional[aiohttp.ClientSession] = None,
+        image_generator: Optional[ImageGenerator] = None,
+        html_executor: Optional[Executor] = None,
+        html_offload_threshold: int = 50_000,
+        page_token_budget: int = 4000,
+        progress_callback: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        metrics: Optional[PipelineMetrics] = None,
+        batch_backend: Optional[BatchBackend] = None,
+        batch_dir: str = "batches",
+        batch_poll_interval: float = 60.0,
+        llm_scheduler: Optional[LLMScheduler] = None,
+        image_embed_mode: str = "data",
+        image_base_url: str = "/images",
+        state_store: Optional[StateStore] = None,
+        newsletter_id: Optional[str] = None,
+        pre_ranker: Optional[PreRanker] = None,
+        fetch_options: Optional[Dict[str, Any]] = None,
+        speculative: bool = True,
+        speculation_window: int = 2,
+        single_flight: Optional[SingleFlight] = None,
+        memory_bounded: bool = False,
+        memory_window: int = 32,
+        spill_dir: Optional[str] = None,
+        deadline: Optional[Deadline] = None
+    ):
         self.client = client
         self.links = links
         self.logger = logging.getLogger(__name__)
         self.pages_summaries: List[PageSummary] = []
+        # Set when pages_summaries is final even if empty, e.g. when every link failed, so that
+        # composing the newsletter doesn't summarize the links again
+        self.summaries_ready = False
         self.max_summaries = max_summaries
+        self.max_concurrent_images = max_concurrent_images
+        self.image_timeout = image_timeout
+        self.model = model
+        self.cache = cache
+        self.max_concurrent_fetches = max_concurrent_fetches
+        self.max_concurrent_summaries = max_concurrent_summaries
+        self.session = session
+        self.image_generator = image_generator
+        self.html_executor = html_executor
+        self.html_offload_threshold = html_offload_threshold
+        self.page_token_budget = page_token_budget
+        self.progress_callback = progress_callback
+        self.metrics = metrics or PipelineMetrics()
+        # When set, pages are summarized offline through the batch backend
+        self.batch_backend = batch_backend
+        self.batch_dir = batch_dir
+        self.batch_poll_interval = batch_poll_interval
+        # Rate limits and retries of LLM calls, shared with other agents when given
+        self.llm_scheduler = llm_scheduler or LLMScheduler()
+        if image_embed_mode not in renderer.IMAGE_EMBED_MODES:
+            raise ValueError(f"Unknown image embed mode: {image_embed_mode}. Use one of {', '.join(renderer.IMAGE_EMBED_MODES)}.")
+        self.image_embed_mode = image_embed_mode
+        self.image_base_url = image_base_url
+        self.attachments: List[Dict[str, str]] = []
+        # Where the newsletter's stage outputs are saved, to regenerate it incrementally
+        self.state_store = state_store
+        self.newsletter_id = newsletter_id
+        self.article_abstract: Optional[ArticleAbstract] = None
+        # When set, only the pages closest to the interest profile are summarized by the LLM
+        if pre_ranker is not None and pre_ranker.candidates < max_summaries:
+            raise ValueError(f"The pre-ranker must keep at least max_summaries ({max_summaries}) candidates, got {pre_ranker.candidates}")
+        self.pre_ranker = pre_ranker
+        # Extra LinkFetcher arguments (timeouts, size limit, per-host limit, validator store, ...)
+        self.fetch_options = fetch_options or {}
+        # Start images and the abstract before every page is summarized
+        self.speculative = speculative
+        self.speculation_window = speculation_window
+        # Coalesces fetches, summaries and abstracts computed concurrently by other agents or workers
+        self.single_flight = single_flight
+        # Memory-bounded mode: at most memory_window pages in memory at once, page contents held
+        # for pre-ranking and summaries out of the top spilled to disk under spill_dir
+        self.memory_bounded = memory_bounded
+        self.memory_window = memory_window
+        self.spill_dir = spill_dir
+        self.spill: Optional[SpillStore] = None
+        self.top_summaries: Optional[TopK[PageSummary]] = None
+        # When set, stages that run out of their share of the deadline are cut short and the
+        # newsletter is rendered with what is ready, each cut recorded in degradations
+        self.deadline = deadline
+        self.degradations: List[Dict[str, Any]] = []
+        # Links of all summaries, best first, set when the newsletter is rendered
+        self.ranked_links: List[str] = []
+        # Shared by every image generation of the agent, including the ones started early
+        self.image_semaphore = asyncio.Semaphore(max_concurrent_images)
+        # Links skipped as duplicates during the last fetch, mapped to the link kept in their place
+        self.duplicates: Dict[str, str] = {}
+        # Tokens removed from each page by the token budget, keyed by link
+        self.tokens_saved: Dict[str, int] = {}
+        # Cached LLM outputs are only reused for the same model and prompts
+        self.summary_version = content_hash(model, SUMMARIZE_AND_SCORE_PAGE_SYS_MSG, SUMMARIZE_AND_SCORE_PAGE_USR_MSG)
+        self.abstract_version = content_hash(model, ARTICLE_ABSTRACT_SYS_MSG, ARTICLE_ABSTRACT_USR_MSG)
 
-    async def fetch_related_web_pages(self) -> List[str]:
+    def report_progress(self, stage: str, data: Dict[str, Any]) -> None:
+        """Publish partial results to the progress callback, if any."""
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(stage, data)
+        except Exception as e:
+            self.logger.error(f"Error reporting {stage} progress: {str(e)}")
+
+    def degrade(self, stage: str, detail: str, links: Optional[List[str]] = None) -> None:
+        """Record a stage cut short by the deadline."""
+        self.logger.warning(f"Deadline reached during {stage}: {detail}")
+        self.metrics.count("deadline", stage=stage)
+        self.degradations.append({"stage": stage, "detail": detail, "links": links or []})
+
+    def link_fetcher(self, links: Optional[List[str]] = None) -> LinkFetcher:
+        """Build a LinkFetcher for the given links (the agent's by default), sharing the agent's session, cache and executor."""
+        return LinkFetcher(
+            self.links if links is None else links,
+            cache=self.cache,
+            session=self.session,
+            executor=self.html_executor,
+            offload_threshold=self.html_offload_threshold,
+            metrics=self.metrics,
+            single_flight=self.single_flight,
+            **self.fetch_options
+        )
+
+    async def fetch_related_web_pages(self, links: Optional[List[str]] = None) -> List[str]:
         start_time = time.time()
         self.logger.info("Starting web page fetching")
 
-        web_pages = await LinkFetcher(self.links).fetch_all_pages()
+        fetcher = self.link_fetcher(links)
+        web_pages = await fetcher.fetch_all_pages()
+        self.duplicates = fetcher.duplicates
         
         execution_time = time.time() - start_time
         self.logger.info(f"Web page fetching completed in {execution_time:.2f} seconds. Found {len(web_pages)} pages")
@@ -56,162 +233,696 @@ class NewsletterAgent:
         """Summarize a single page asynchronously."""
         start_time = time.time()
         self.logger.info(f"Starting page summarization for link: {link}")
+
+        page_content, cache_key = self.prepare_page_content(link, page_content)
+        cached = await self.cached_summary(link, cache_key)
+        if cached is not None:
+            return cached
         
-        try:
-            completion = await self.client.beta.chat.completions.parse(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": SUMMARIZE_AND_SCORE_PAGE_SYS_MSG},
-                    {"role": "user", "content": SUMMARIZE_AND_SCORE_PAGE_USR_MSG
-                                                                            .replace("$WEB_PAGE", page_content)
-                                                                            .replace("$LINK", link)}
-                ],
-                response_format=PageSummary
-            )
+        async def summarize() -> str:
+            completion = await self.parse_completion("summarize", self.summary_messages(link, page_content), PageSummary)
             execution_time = time.time() - start_time
             self.logger.info(f"Page summarization completed in {execution_time:.2f} seconds for link: {link}")
+            self.metrics.observe_stage("summarize", execution_time)
+            self.metrics.add_tokens("summarize", completion.usage)
+            return completion.choices[0].message.parsed.model_dump_json()
+
+        try:
+            if self.single_flight is not None:
+                summary_json = await self.single_flight.run("summary", cache_key, summarize)
+            else:
+                summary_json = await summarize()
+                if self.cache is not None:
+                    await self.cache.aset("summary", cache_key, summary_json)
 
-            return completion.choices[0].message.parsed
+            page_summary = PageSummary.model_validate_json(summary_json)
+            # The model may rewrite the link; keep the fetched one so that summaries can be matched to links
+            page_summary.link = link
+            return page_summary
         except Exception as e:
             self.logger.error(f"Error summarizing page {link}: {str(e)}")
-            return PageSummary(link=link, title=f"Error summarizing page: {str(e)}", content_summary=f"Error summarizing page: {str(e)}", interest_score=4)
+            self.metrics.count("error", stage="summarize")
+            return self.summary_error(link, e)
+
+    async def parse_completion(self, stage: str, messages: List[Dict[str, str]], response_format: type):
+        """Run a structured completion through the LLM scheduler, which handles rate limits and retries."""
+        # Prompt tokens plus a rough allowance for the structured answer
+        estimated_tokens = sum(count_tokens(message["content"], self.model) for message in messages) + 500
+        # The scheduler owns the retries, so the client must not retry on its own
+        client = self.client.with_options(max_retries=0)
+        return await self.llm_scheduler.call(
+            lambda: client.beta.chat.completions.parse(
+                model=self.model,
+                messages=messages,
+                response_format=response_format
+            ),
+            estimated_tokens=estimated_tokens,
+            stage=stage,
+            metrics=self.metrics
+        )
+
+    def prepare_page_content(self, link: str, page_content: str) -> Tuple[str, str]:
+        """Apply the token budget to a page, returning the content to summarize and its summary cache key."""
+        page_content, kept_tokens, page_tokens = truncate_to_token_budget(page_content, self.page_token_budget, self.model)
+        self.tokens_saved[link] = page_tokens - kept_tokens
+        if kept_tokens < page_tokens:
+            self.logger.info(f"Page truncated from {page_tokens} to {kept_tokens} tokens ({page_tokens - kept_tokens} saved) for link: {link}")
+
+        return page_content, content_hash(link, content_hash(page_content), self.summary_version)
+
+    async def cached_summary(self, link: str, cache_key: str) -> Optional[PageSummary]:
+        """Return the cached summary of a page, if any."""
+        if self.cache is None:
+            return None
+        cached = await self.cache.aget("summary", cache_key)
+        self.metrics.count("cache", namespace="summary", result="miss" if cached is None else "hit")
+        if cached is None:
+            return None
+        self.logger.info(f"Page summary cache hit for link: {link}")
+        summary = PageSummary.model_validate_json(cached)
+        summary.link = link
+        return summary
+
+    def summary_messages(self, link: str, page_content: str) -> List[Dict[str, str]]:
+        """Build the chat messages asking to summarize and score a page."""
+        return [
+            {"role": "system", "content": SUMMARIZE_AND_SCORE_PAGE_SYS_MSG},
+            {"role": "user", "content": SUMMARIZE_AND_SCORE_PAGE_USR_MSG
+                                                                    .replace("$WEB_PAGE", page_content)
+                                                                    .replace("$LINK", link)}
+        ]
+
+    @staticmethod
+    def summary_error(link: str, error: Any) -> PageSummary:
+        """Build the placeholder summary of a page that couldn't be summarized."""
+        return PageSummary(link=link, title=f"{SUMMARY_ERROR_PREFIX}: {str(error)}", content_summary=f"{SUMMARY_ERROR_PREFIX}: {str(error)}", interest_score=4)
+
+    async def pre_rank_pages(self, pages: Dict[str, str]) -> Tuple[Dict[str, str], List[PageSummary]]:
+        """
+        Pre-rank pages against the interest profile, keeping the best candidates for summarization.
+
+        Returns:
+            Tuple: The pages to summarize, and title-only summaries of the other ones, which
+                score below every summarized page and end up under "Other news"
+        """
+        if self.pre_ranker is None:
+            return pages, []
 
-    async def summarize_and_score_all_pages(self) -> List[PageSummary]:
-        """Process all pages in parallel using asyncio.gather."""
         start_time = time.time()
-        self.logger.info("Starting summarization of all pages")
-        
-        pages = await self.fetch_related_web_pages()
-        # Create tasks for all pages
-        tasks = [
-            self.summarize_and_score_page(link, content)
-            for link, content in pages.items()
+        try:
+            candidates, tail, similarities = await self.pre_ranker.rank(pages)
+        except Exception as e:
+            self.logger.error(f"Error pre-ranking pages, summarizing all of them: {str(e)}")
+            self.metrics.count("error", stage="pre_rank")
+            return pages, []
+        self.metrics.observe_stage("pre_rank", time.time() - start_time)
+
+        tail_summaries = [
+            # Similarities are at most 1, below the LLM's scores which start at 1
+            PageSummary(link=link, title=extract_title(pages[link]) or link, content_summary="", interest_score=min(similarities[link], 0.99))
+            for link in tail
         ]
-        
-        # Execute all tasks concurrently
-        results = await asyncio.gather(*tasks)
+        for _ in tail:
+            self.metrics.count("pre_rank", result="skipped")
+        return {link: pages[link] for link in candidates}, tail_summaries
+
+    async def summarize_and_score_all_pages_in_batch(self, links: Optional[List[str]] = None) -> List[PageSummary]:
+        """Summarize all pages with a single request file sent to the batch backend, trading latency for cost."""
+        start_time = time.time()
+        self.logger.info("Starting batch summarization of all pages")
+
+        pages = await self.fetch_related_web_pages(links)
+        pages, tail_summaries = await self.pre_rank_pages(pages)
+        summaries: Dict[str, PageSummary] = {}
+        requests: Dict[str, Dict[str, Any]] = {}
+        request_pages: Dict[str, Tuple[str, str]] = {}
+
+        for index, (link, content) in enumerate(pages.items()):
+            content, cache_key = self.prepare_page_content(link, content)
+            cached = await self.cached_summary(link, cache_key)
+            if cached is not None:
+                summaries[link] = cached
+                continue
+
+            custom_id = f"page-{index}"
+            requests[custom_id] = {
+                "model": self.model,
+                "messages": self.summary_messages(link, content),
+                "response_format": {
+                    "type": "json_schema",
+                    "json_schema": {"name": "PageSummary", "schema": PageSummary.model_json_schema()}
+                }
+            }
+            request_pages[custom_id] = (link, cache_key)
+
+        if requests:
+            path = Path(self.batch_dir) / f"page_summaries_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid4().hex[:8]}.jsonl"
+            write_batch_file(path, requests)
+            batch_id = await self.batch_backend.submit(path)
+            self.logger.info(f"Submitted batch {batch_id} with {len(requests)} page summaries from {path}")
+
+            status = await self.batch_backend.wait(batch_id, poll_interval=self.batch_poll_interval)
+            lines = await self.batch_backend.results(batch_id) if status == "completed" else []
+
+            for line in lines:
+                if line.get("custom_id") not in request_pages:
+                    continue
+                link, cache_key = request_pages[line["custom_id"]]
+                try:
+                    summary = PageSummary.model_validate_json(result_content(line))
+                    # Results are matched by custom id, so the link is known for sure
+                    summary.link = link
+                    self.metrics.add_tokens("summarize", line["response"]["body"].get("usage"))
+                    if self.cache is not None:
+                        await self.cache.aset("summary", cache_key, summary.model_dump_json())
+                except Exception as e:
+                    self.logger.error(f"Error summarizing page {link} in batch {batch_id}: {str(e)}")
+                    self.metrics.count("error", stage="summarize")
+                    summary = self.summary_error(link, e)
+                summaries[link] = summary
+
+            for link, _ in request_pages.values():
+                if link not in summaries:
+                    summaries[link] = self.summary_error(link, f"batch {batch_id} {status}")
+
+        results = [summaries[link] for link in pages if link in summaries] + tail_summaries
+        for summary in results:
+            self.report_progress("summary", summary.model_dump(exclude={"image"}))
+
+        execution_time = time.time() - start_time
+        self.logger.info(f"Batch summarization completed in {execution_time:.2f} seconds. Processed {len(results)} pages")
+        self.metrics.observe_stage("summarize_all", execution_time)
+
+        return results
+
+    async def summarize_and_score_all_pages(
+        self,
+        links: Optional[List[str]] = None,
+        speculation: Optional[SpeculativeStart] = None
+    ) -> List[PageSummary]:
+        """
+        Fetch and summarize all pages, starting each summary as soon as its page is fetched.
+
+        Args:
+            links (List[str]): Links to summarize, the agent's by default
+            speculation (SpeculativeStart): Notified of each summary, to start the next stages early
+        """
+        if self.batch_backend is not None:
+            return await self.summarize_and_score_all_pages_in_batch(links)
+
+        start_time = time.time()
+        self.logger.info("Starting summarization of all pages")
+
+        semaphore = asyncio.Semaphore(self.max_concurrent_summaries)
+        if self.memory_bounded:
+            if self.spill is None:
+                self.spill = SpillStore(self.spill_dir)
+            self.top_summaries = TopK(self.max_summaries, lambda x: x.interest_score)
+
+        async def bounded_summarize(link: str, content: str) -> PageSummary:
+            async with semaphore:
+                summary = await self.summarize_and_score_page(link, content)
+            self.report_progress("summary", summary.model_dump(exclude={"image"}))
+            if speculation is not None:
+                speculation.add(summary)
+            self.keep_summary(summary)
+            return summary
+
+        tasks = []
+        pending = set()
+        # Titles of the pages being summarized, for the placeholders of the ones the deadline cuts
+        titles: Dict[asyncio.Task, Tuple[str, str]] = {}
+
+        async def schedule(link: str, content: str) -> None:
+            # Pending tasks hold their page content: in memory-bounded mode, wait for room first
+            while self.memory_bounded and len(pending) >= self.memory_window:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            task = asyncio.create_task(bounded_summarize(link, content))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            tasks.append(task)
+            if self.deadline is not None:
+                titles[task] = (link, extract_title(content) or link)
+
+        # Create a summarization task for each page as soon as it is fetched, or once they are
+        # all fetched and pre-ranked when only the best candidates are summarized
+        pages: Dict[str, str] = self.spill.pages if self.memory_bounded else {}
+        fetcher = self.link_fetcher(links)
+        if speculation is not None:
+            speculation.set_total(len(fetcher.fetch_links))
+        window = self.memory_window if self.memory_bounded else None
+        # Page fetched but still waiting for room in the memory window when the deadline hits
+        waiting: Optional[Tuple[str, str]] = None
+        try:
+            async with asyncio.timeout(self.deadline.budget("fetch") if self.deadline is not None else None):
+                # Closed right away on timeout, so that the fetches still running are known and cancelled
+                async with aclosing(fetcher.iter_pages(max_concurrent=self.max_concurrent_fetches, window=window)) as fetched:
+                    async for link, content in fetched:
+                        if self.pre_ranker is None:
+                            waiting = (link, content)
+                            await schedule(link, content)
+                            waiting = None
+                        else:
+                            pages[link] = content
+        except TimeoutError:
+            self.degrade("fetch", f"skipped {len(fetcher.unfinished_links)} pages still loading", fetcher.unfinished_links)
+        self.logger.info(f"Web page fetching completed in {time.time() - start_time:.2f} seconds. Found {len(tasks) + len(pages)} pages, skipped {len(fetcher.duplicates)} duplicates")
+        self.duplicates = fetcher.duplicates
+        self.metrics.observe_stage("fetch_all", time.time() - start_time)
+
+        tail_summaries: List[PageSummary] = []
+        if waiting is not None:
+            link, content = waiting
+            self.degrade("summarize", "listed 1 page by title only, it was waiting for room in the memory window", [link])
+            tail_summaries.append(PageSummary(link=link, title=extract_title(content) or link, content_summary="", interest_score=0))
+        if pages:
+            pages, ranked_out = await self.pre_rank_pages(pages)
+            tail_summaries += ranked_out
+        for summary in tail_summaries:
+            self.report_progress("summary", summary.model_dump(exclude={"image"}))
+            if speculation is not None:
+                speculation.add(summary)
+            self.keep_summary(summary)
+        if speculation is not None:
+            # Failed fetches and duplicates are known now, the number of summaries is exact
+            speculation.set_total(len(tasks) + len(pages) + len(tail_summaries))
+        for link, content in pages.items():
+            await schedule(link, content)
+
+        # Wait for the remaining summaries
+        if self.deadline is not None and tasks:
+            await asyncio.wait(tasks, timeout=self.deadline.budget("summarize"))
+            late = [link for task, (link, _) in titles.items() if not task.done()]
+            results = [self.summary_result(task, *titles[task], speculation) for task in tasks] + tail_summaries
+            if late:
+                self.degrade("summarize", f"listed {len(late)} pages by title only", late)
+        else:
+            results = await asyncio.gather(*tasks) + tail_summaries
 
         execution_time = time.time() - start_time
         self.logger.info(f"All pages summarization completed in {execution_time:.2f} seconds. Processed {len(results)} pages")
+        self.metrics.observe_stage("summarize_all", execution_time)
+        self.logger.info(f"Token budget saved {sum(self.tokens_saved.values())} page tokens in total")
         
         return results
 
-    async def generate_article_abstract(self) -> ArticleAbstract:
-        """Generate article abstract based on top N summaries and rankings."""
+    def summary_result(self, task: asyncio.Task, link: str, title: str, speculation: Optional[SpeculativeStart]) -> PageSummary:
+        """Return the summary of a finished task, or cancel it and return a title-only summary ranked last."""
+        if task.done():
+            return task.result()
+        task.cancel()
+        summary = PageSummary(link=link, title=title, content_summary="", interest_score=0)
+        if speculation is not None:
+            speculation.add(summary)
+        self.keep_summary(summary)
+        return summary
+
+    def keep_summary(self, summary: PageSummary) -> None:
+        """In memory-bounded mode, spill the summary that falls out of the top to disk, keeping its link, title and score."""
+        if self.top_summaries is None or not summary.featurable:
+            return
+        dropped = self.top_summaries.push(summary)
+        if dropped is not None and dropped.content_summary:
+            self.spill.append(dropped.model_dump_json(exclude={"image"}))
+            dropped.content_summary = ""
+
+    def featured_summaries(self, summaries: List[PageSummary], limit: Optional[int] = None) -> List[PageSummary]:
+        """
+        Pick the summaries featured in the newsletter, best first: the top max_summaries (or `limit`)
+        of the featurable ones. Title-only summaries (pre-ranked out, cut by the deadline or spilled)
+        and failed ones only go to "Other news".
+        """
+        return heapq.nlargest(self.max_summaries if limit is None else limit, (summary for summary in summaries if summary.featurable), key=lambda x: x.interest_score)
+
+    def close_spill(self) -> None:
+        """Delete what the memory-bounded mode spilled to disk."""
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+        self.top_summaries = None
+
+    async def generate_article_abstract(self, top_summaries: Optional[List[PageSummary]] = None) -> ArticleAbstract:
+        """Generate article abstract based on the given top summaries, the top N of the page summaries by default."""
         start_time = time.time()
 
-        # Sort summaries by interest score
-        sorted_summaries = sorted(self.pages_summaries, key=lambda x: x.interest_score, reverse=True)
-        top_summaries = sorted_summaries[:self.max_summaries]
+        if top_summaries is None:
+            top_summaries = self.featured_summaries(self.pages_summaries)
         
         # Combine selected summaries into one context, including rankings
         combined_summaries = "\n".join(
             f"Summary from {summary.link}:\n{summary.content_summary}"
             for summary in top_summaries
         )
+
+        cache_key = content_hash(combined_summaries, self.abstract_version)
+        if self.cache is not None:
+            cached = await self.cache.aget("abstract", cache_key)
+            self.metrics.count("cache", namespace="abstract", result="miss" if cached is None else "hit")
+            if cached is not None:
+                self.logger.info("Article abstract cache hit")
+                return ArticleAbstract.model_validate_json(cached)
         
-        try:
-            completion = await self.client.beta.chat.completions.parse(
-                model="gpt-4o-mini",
-                messages=[
+        async def write_abstract() -> str:
+            completion = await self.parse_completion(
+                "abstract",
+                [
                     {"role": "system", "content": ARTICLE_ABSTRACT_SYS_MSG},
                     {"role": "user", "content": ARTICLE_ABSTRACT_USR_MSG.replace("$SUMMARIES", combined_summaries)}
                 ],
-                response_format=ArticleAbstract
+                ArticleAbstract
             )
-            
-            article_abstract = completion.choices[0].message.parsed
             execution_time = time.time() - start_time
             self.logger.info(f"Article abstract generation completed in {execution_time:.2f} seconds")
-            
-            return article_abstract
+            self.metrics.observe_stage("abstract", execution_time)
+            self.metrics.add_tokens("abstract", completion.usage)
+            return completion.choices[0].message.parsed.model_dump_json()
+
+        try:
+            if self.single_flight is not None:
+                abstract_json = await self.single_flight.run("abstract", cache_key, write_abstract)
+            else:
+                abstract_json = await write_abstract()
+                if self.cache is not None:
+                    await self.cache.aset("abstract", cache_key, abstract_json)
+
+            return ArticleAbstract.model_validate_json(abstract_json)
         
         except Exception as e:
             self.logger.error(f"Error generating article abstract: {str(e)}")
+            self.metrics.count("error", stage="abstract")
             return ArticleAbstract(
-                abstract=f"Error generating article abstract: {str(e)}"
+                abstract=f"{ABSTRACT_ERROR_PREFIX}: {str(e)}"
             )
 
-    async def compose_full_newsletter(self) -> Newsletter:
-        """Compose the full newsletter in HTML format with abstract, summaries, and other links."""
-        try:
+    async def generate_summary_image(
+        self,
+        image_generator: ImageGenerator,
+        summary: PageSummary,
+        semaphore: asyncio.Semaphore,
+        slot: int = 0
+    ) -> None:
+        """Generate the image of a single summary, in the tier of its featured slot, keeping the placeholder if it fails."""
+        async with semaphore:
             start_time = time.time()
-            self.logger.info("Starting newsletter composition")
-            
-            # Import the HTML templates
-            from newsletter.templates.newsletter_templates import (
-                HTML_HEAD, 
-                ABSTRACT_SECTION, 
-                SUMMARY_SECTION, 
-                OTHER_NEWS_START, 
-                OTHER_NEWS_LINK, 
-                OTHER_NEWS_END, 
-                HTML_FOOTER
-            )
-            
+            try:
+                summary.image = await asyncio.wait_for(
+                    image_generator.generate_image(summary.content_summary, slot=slot),
+                    timeout=self.image_timeout
+                )
+                execution_time = time.time() - start_time
+                reused = summary.image.get("reused")
+                if reused:
+                    self.logger.info(f"Reused a previous image ({reused} match) for link: {summary.link}")
+                    self.metrics.count("image_reuse", result=reused)
+                else:
+                    self.logger.info(f"Image generation completed in {execution_time:.2f} seconds for link: {summary.link}")
+                    self.metrics.observe_stage("image", execution_time)
+                    self.metrics.count("image_reuse", result="generated")
+            except asyncio.TimeoutError:
+                self.logger.error(f"Image generation timed out after {self.image_timeout:.0f} seconds for link: {summary.link}")
+                self.metrics.count("timeout", stage="image")
+                summary.image = None
+            except Exception as e:
+                self.logger.error(f"Error generating image for {summary.link}: {str(e)}")
+                self.metrics.count("error", stage="image")
+                summary.image = None
+
+    async def generate_summaries_images(self, summaries: List[PageSummary], slots: Optional[List[int]] = None) -> None:
+        """
+        Generate the images of all summaries concurrently, at most max_concurrent_images at a time.
+
+        Args:
+            summaries (List[PageSummary]): Summaries to illustrate
+            slots (List[int]): Featured slot of each summary, which picks its image tier. Defaults to
+                the order of the summaries
+        """
+        start_time = time.time()
+        self.logger.info(f"Starting image generation for {len(summaries)} summaries")
+
+        image_generator = self.image_generator
+        if image_generator is None:
+            try:
+                image_generator = ImageGenerator(client=self.client, session=self.session)
+            except Exception as e:
+                self.logger.error(f"Error initializing image generator: {str(e)}")
+                return
+
+        if slots is None:
+            slots = list(range(len(summaries)))
+        await asyncio.gather(*[
+            self.generate_summary_image(image_generator, summary, self.image_semaphore, slot)
+            for summary, slot in zip(summaries, slots)
+        ])
+
+        execution_time = time.time() - start_time
+        generated = sum(1 for summary in summaries if summary.image is not None)
+        self.logger.info(f"Image generation completed in {execution_time:.2f} seconds. Generated {generated}/{len(summaries)} images")
+        self.metrics.observe_stage("images_all", execution_time)
+
+    async def stream_full_newsletter(self) -> AsyncIterator[str]:
+        """Generate the newsletter, yielding its HTML chunk by chunk as each part becomes ready."""
+        # Sent right away so that clients start receiving the page while the pipeline runs
+        yield renderer.render_head()
+
+        # Images and the abstract are started while the last pages are being summarized
+        speculation = None
+        needs_summaries = not self.pages_summaries and not self.summaries_ready
+        if self.speculative and self.batch_backend is None and needs_summaries and self.article_abstract is None:
+            speculation = SpeculativeStart(self, window=self.speculation_window)
+
+        try:
             # If page summaries are not already populated, generate them
-            if not self.pages_summaries:
-                self.pages_summaries = await self.summarize_and_score_all_pages()
+            if needs_summaries:
+                self.pages_summaries = await self.summarize_and_score_all_pages(speculation=speculation)
 
-            # Generate article abstract if not already generated
-            article_abstract = await self.generate_article_abstract()
-            
-            # Sort summaries by interest score
+            # Rank summaries by interest score, once for the whole newsletter
             sorted_summaries = sorted(self.pages_summaries, key=lambda x: x.interest_score, reverse=True)
-            
+            self.ranked_links = [summary.link for summary in sorted_summaries]
+
             # Get top summaries for detailed inclusion
-            top_summaries = sorted_summaries[:self.max_summaries]
+            top_summaries = self.featured_summaries(sorted_summaries)
+            featured_links = {summary.link for summary in top_summaries}
 
-            # Gennerate summaries images
-            for summary in top_summaries:
-                summary.image = await ImageGenerator().generate_image(summary.content_summary)
-            
-            # Get remaining links for the "Other news" section
-            other_links = [summary.link for summary in sorted_summaries[self.max_summaries:]]
-            
-            # Start building HTML content
-            html_content = HTML_HEAD
-            
-            # Add abstract section
-            html_content += ABSTRACT_SECTION.format(abstract=article_abstract.abstract)
-            
-            # Add each summary
-            for summary in top_summaries:
-                html_content += SUMMARY_SECTION.format(
-                    title=summary.title,
-                    content=summary.content_summary,
-                    link=summary.link
-                )
-            
-            # Add "Other news" section
-            if other_links:
-                html_content += OTHER_NEWS_START
-                
-                for link in other_links:
-                    html_content += OTHER_NEWS_LINK.format(link=link)
-                
-                html_content += OTHER_NEWS_END
-            
-            # Add HTML footer
-            html_content += HTML_FOOTER
+            # Generate the missing summaries images while the abstract is being written
+            started = speculation.image_tasks if speculation is not None else {}
+            missing = [
+                (slot, summary) for slot, summary in enumerate(top_summaries)
+                if summary.image is None and summary.link not in started
+            ]
+            images_task = asyncio.gather(
+                speculation.images() if speculation is not None else asyncio.sleep(0),
+                self.generate_summaries_images([summary for _, summary in missing], [slot for slot, _ in missing])
+            )
+            try:
+                # Already set when regenerating a newsletter whose top summaries didn't change
+                if self.article_abstract is None:
+                    abstract_task = speculation.take_abstract(top_summaries) if speculation is not None else None
+                    if abstract_task is None:
+                        abstract_task = self.generate_article_abstract(top_summaries)
+                    try:
+                        self.article_abstract = await asyncio.wait_for(
+                            abstract_task,
+                            timeout=self.deadline.budget("abstract") if self.deadline is not None else None
+                        )
+                    except asyncio.TimeoutError:
+                        self.degrade("abstract", "replaced by the list of featured titles")
+                        self.article_abstract = ArticleAbstract(
+                            abstract="In this issue: " + "; ".join(summary.title for summary in top_summaries) + "."
+                        )
+                article_abstract = self.article_abstract
+                self.report_progress("abstract", {"abstract": article_abstract.abstract})
+                yield renderer.render_abstract(article_abstract.abstract)
+
+                try:
+                    await asyncio.wait_for(
+                        images_task,
+                        timeout=self.deadline.budget("images") if self.deadline is not None else None
+                    )
+                except asyncio.TimeoutError:
+                    late = [summary.link for summary in top_summaries if summary.image is None]
+                    self.degrade("images", f"kept placeholders for {len(late)} images", late)
+                self.report_progress("images", {"generated": sum(1 for summary in top_summaries if summary.image is not None)})
+            finally:
+                images_task.cancel()
+        finally:
+            if speculation is not None:
+                speculation.cancel()
+
+        # Add each summary
+        self.attachments = []
+        for summary in top_summaries:
+            image, attachment = await asyncio.to_thread(
+                renderer.render_image, summary.image, summary.title, self.image_embed_mode, self.image_base_url
+            )
+            if attachment is not None:
+                self.attachments.append(attachment)
+            yield renderer.render_summary(summary.title, summary.content_summary, summary.link, image)
+
+        # Add "Other news" section with the remaining links
+        # Pages that failed to summarize are listed by link rather than by their error message
+        yield renderer.render_other_news(
+            ("" if summary.title.startswith(SUMMARY_ERROR_PREFIX) else summary.title, summary.link)
+            for summary in sorted_summaries if summary.link not in featured_links
+        )
+
+        # Add HTML footer
+        yield renderer.render_footer()
+
+    async def compose_full_newsletter(self) -> Newsletter:
+        """Compose the full newsletter in HTML format with abstract, summaries, and other links."""
+        try:
+            start_time = time.time()
+            self.logger.info("Starting newsletter composition")
+
+            html_content = "".join([chunk async for chunk in self.stream_full_newsletter()])
             
             # Get all links for the Newsletter object
-            all_links = [summary.link for summary in sorted_summaries]
+            all_links = self.ranked_links
             
             execution_time = time.time() - start_time
             self.logger.info(f"Newsletter composition completed in {execution_time:.2f} seconds")
+            self.metrics.observe_stage("compose", execution_time)
+            if self.cache is not None:
+                self.logger.info(f"Cache stats: {self.cache.stats()}")
+            self.save_state()
             
             return Newsletter(
                 full_newsletter=html_content,
-                links=all_links
+                links=all_links,
+                attachments=self.attachments,
+                metrics=self.metrics.to_dict(),
+                degradations=self.degradations
             )
         
         except Exception as e:
             self.logger.error(f"Error composing newsletter: {str(e)}")
+            self.metrics.count("error", stage="compose")
             return Newsletter(
                 full_newsletter=f"<p>Error composing newsletter: {str(e)}</p>",
-                links=self.links
+                links=self.links,
+                metrics=self.metrics.to_dict(),
+                degradations=self.degradations
             )
+        finally:
+            self.close_spill()
+
+    def load_state(self) -> NewsletterState:
+        """Load the saved state of the newsletter, dropping outputs made with other models or prompts."""
+        state = NewsletterState(summary_version=self.summary_version, abstract_version=self.abstract_version)
+        if self.state_store is None or self.newsletter_id is None:
+            return state
+        try:
+            saved = self.state_store.load(self.newsletter_id)
+            if saved is None:
+                return state
+            saved_state = NewsletterState.model_validate_json(saved)
+        except Exception as e:
+            self.logger.error(f"Error loading state of newsletter {self.newsletter_id}: {str(e)}")
+            return state
+
+        if saved_state.summary_version != self.summary_version:
+            self.logger.info(f"Summary model or prompts changed, regenerating newsletter {self.newsletter_id} from scratch")
+            return state
+        state.summaries = saved_state.summaries
+        state.duplicates = saved_state.duplicates
+        # Images removed by the retention policy since are generated again
+        state.images = {
+            link: image for link, image in saved_state.images.items()
+            if image.get("local_path") and os.path.exists(image["local_path"])
+        }
+        if saved_state.abstract_version == self.abstract_version:
+            state.top_links = saved_state.top_links
+            state.abstract = saved_state.abstract
+        return state
+
+    def save_state(self) -> None:
+        """Save the newsletter's summaries, images and abstract, if it has an id and a state store."""
+        if self.state_store is None or self.newsletter_id is None:
+            return
+        abstract = self.article_abstract.abstract if self.article_abstract is not None else None
+        if any(degradation["stage"] == "abstract" for degradation in self.degradations):
+            # The titles placeholder is written again next time, within a new deadline
+            abstract = None
+        # Summaries spilled to disk by the memory-bounded mode are read back to be saved
+        spilled = [PageSummary.model_validate_json(record) for record in self.spill.records()] if self.spill is not None else []
+        state = NewsletterState(
+            summary_version=self.summary_version,
+            abstract_version=self.abstract_version,
+            summaries={
+                canonicalize_url(summary.link): summary.model_copy(update={"image": None})
+                # Pre-ranked out pages have no summary and are ranked again with the next links
+                for summary in self.pages_summaries + spilled
+                if summary.featurable
+            },
+            images={
+                # Base64 copies can be rebuilt from the file
+                canonicalize_url(summary.link): {key: value for key, value in summary.image.items() if key != "base64"}
+                for summary in self.pages_summaries if summary.image is not None
+            },
+            top_links=[summary.link for summary in self.featured_summaries(self.pages_summaries)],
+            duplicates={canonicalize_url(link): canonicalize_url(kept) for link, kept in self.duplicates.items()},
+            abstract=None if abstract is None or abstract.startswith(ABSTRACT_ERROR_PREFIX) else abstract
+        )
+        try:
+            self.state_store.save(self.newsletter_id, state.model_dump_json())
+        except Exception as e:
+            self.logger.error(f"Error saving state of newsletter {self.newsletter_id}: {str(e)}")
+
+    async def regenerate_newsletter(self) -> Newsletter:
+        """
+        Regenerate a saved newsletter after its links were edited, redoing only what changed.
+
+        Links that were already summarized are neither fetched nor summarized again, the abstract
+        is only rewritten when the set of top summaries changes, and images are only generated
+        for summaries entering the top. Without a saved state, the newsletter is generated from scratch.
+        """
+        start_time = time.time()
+        state = self.load_state()
+
+        reused: Dict[str, PageSummary] = {}
+        new_links: List[str] = []
+        # Submitted link of each canonical URL, to tell whether the article a duplicate was collapsed into is still there
+        submitted: Dict[str, str] = {}
+        for link in self.links:
+            submitted.setdefault(canonicalize_url(link), link)
+        duplicates: Dict[str, str] = {}
+        for link in self.links:
+            canonical = canonicalize_url(link)
+            if canonical in reused:
+                continue
+            kept = state.duplicates.get(canonical)
+            if kept is not None and kept in submitted and kept != canonical:
+                duplicates[link] = submitted[kept]
+                continue
+            if canonical in state.summaries:
+                summary = state.summaries[canonical]
+                summary.image = state.images.get(canonical)
+                reused[canonical] = summary
+            else:
+                new_links.append(link)
+        self.logger.info(f"Regenerating newsletter {self.newsletter_id}: reusing {len(reused)} summaries, skipping {len(duplicates)} known duplicates, summarizing {len(new_links)} new links")
+        for _ in reused:
+            self.metrics.count("incremental", result="reused")
+        for _ in new_links:
+            self.metrics.count("incremental", result="new")
+
+        new_summaries = await self.summarize_and_score_all_pages(new_links) if new_links else []
+        self.duplicates = {**duplicates, **self.duplicates}
+        self.pages_summaries = list(reused.values()) + new_summaries
+        self.summaries_ready = True
+
+        top_links = {summary.link for summary in self.featured_summaries(self.pages_summaries)}
+        if state.abstract is not None and top_links == set(state.top_links):
+            self.logger.info("Top summaries unchanged, reusing the article abstract")
+            self.article_abstract = ArticleAbstract(abstract=state.abstract)
+        else:
+            self.article_abstract = None
+
+        newsletter = await self.compose_full_newsletter()
+
+        execution_time = time.time() - start_time
+        self.logger.info(f"Newsletter regeneration completed in {execution_time:.2f} seconds")
+        return newsletter
 
     async def run_agent(self):
         """Execute the full newsletter generation pipeline."""
@@ -219,10 +930,13 @@ class NewsletterAgent:
             start_time = time.time()
             self.logger.info("Starting newsletter agent execution")
             
-            # Step 1: Generate page summaries
-            self.pages_summaries = await self.summarize_and_score_all_pages()
-            
-            # Step 2: Compose the full newsletter
+            # Saved newsletters only redo the stages affected by link changes
+            if self.state_store is not None and self.newsletter_id is not None:
+                return await self.regenerate_newsletter()
+
+            # Generate page summaries and compose the full newsletter; composing summarizes the
+            # pages itself so that images and the abstract can start before the last summary
+            self.pages_summaries = []
             full_newsletter = await self.compose_full_newsletter()
             
             execution_time = time.time() - start_time
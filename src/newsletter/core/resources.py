@@ -0,0 +1,356 @@
+"""
+Application resources.
+Long-lived clients shared by every newsletter request: one pooled aiohttp session,
+one OpenAI client, one image generator, the HTML conversion pool and the persistent cache,
+which several workers can share.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+
+import aiohttp
+from openai import AsyncOpenAI
+
+from newsletter.core.deadline import DEFAULT_SHARES, Deadline, parse_stage_shares
+from newsletter.core.newsletter_agent import DEFAULT_MAX_SUMMARIES, NewsletterAgent
+from newsletter.utils.cache import Cache
+from newsletter.utils.embeddings import EmbeddingModel, HashingEmbeddingModel, OpenAIEmbeddingModel, PreRanker
+from newsletter.utils.content_extractor import count_tokens
+from newsletter.utils.image_gen import ImageGenerator, parse_image_tiers
+from newsletter.utils.image_index import ImageReuseIndex
+from newsletter.utils.link_fetcher import timed_html_to_markdown
+from newsletter.utils.llm_scheduler import LLMScheduler
+from newsletter.utils.redis_cache import RedisCache
+from newsletter.utils.single_flight import SingleFlight
+from newsletter.utils.state_store import StateStore
+
+
+class AppResources:
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_connections: int = 100,
+        max_connections_per_host: int = 10,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30.0,
+        cache: Optional[Union[Cache, RedisCache]] = None,
+        html_executor: str = "process",
+        html_workers: Optional[int] = None,
+        html_offload_threshold: int = 50_000,
+        llm_scheduler: Optional[LLMScheduler] = None,
+        image_options: Optional[Dict[str, Any]] = None,
+        image_embed_mode: str = "data",
+        image_base_url: str = "/images",
+        state_store: Optional[StateStore] = None,
+        pre_rank_candidates: int = 0,
+        interest_profile: str = "",
+        embedding_model: str = "local",
+        fetch_options: Optional[Dict[str, Any]] = None,
+        speculative: bool = True,
+        speculation_window: int = 2,
+        single_flight: bool = True,
+        single_flight_lease_seconds: float = 120.0,
+        single_flight_poll_interval: float = 0.2,
+        memory_bounded: bool = False,
+        memory_window: int = 32,
+        spill_dir: Optional[str] = None,
+        image_reuse: bool = True,
+        image_reuse_threshold: float = 0.9,
+        image_index_path: str = "cache/image_index.sqlite3",
+        default_deadline_seconds: Optional[float] = None,
+        deadline_shares: Optional[Dict[str, float]] = None
+    ):
+        """
+        Args:
+            api_key (str): OpenAI API key, read from OPENAI_API_KEY if not given
+            max_connections (int): Size of the aiohttp connection pool
+            max_connections_per_host (int): Concurrent connections to a single host
+            dns_cache_ttl (int): Seconds DNS lookups are cached by the aiohttp connector
+            keepalive_timeout (float): Seconds idle connections are kept alive
+            cache (Cache | RedisCache): Persistent cache shared by all requests, and by the workers using the same file or server
+            html_executor (str): Pool used for HTML conversion: "process", "thread" or "none" to convert inline
+            html_workers (int): Number of HTML conversion workers, defaults to the executor's own default
+            html_offload_threshold (int): HTML size in characters from which conversion is offloaded
+            llm_scheduler (LLMScheduler): Rate limiter shared by the LLM calls of all requests
+            image_options (Dict): Extra ImageGenerator arguments (format, quality, retention, ...)
+            image_embed_mode (str): How images are referenced in the newsletter: "data", "cid" or "url"
+            image_base_url (str): URL the generated images are served at, for the "url" mode
+            state_store (StateStore): Saved newsletter states, for incremental regeneration
+            pre_rank_candidates (int): Pages kept for LLM summarization by the embedding pre-ranking, 0 to disable it
+            interest_profile (str): Topics the readers care about, pages are pre-ranked by similarity to it
+            embedding_model (str): OpenAI embedding model, or "local" for offline hashing embeddings
+            fetch_options (Dict): Extra LinkFetcher arguments (timeouts, size limit, per-host limit, validator store, ...)
+            speculative (bool): Start images and the abstract before every page is summarized
+            speculation_window (int): Pages left to summarize below which the abstract is started on the likely top set
+            single_flight (bool): Coalesce concurrent fetches and LLM calls for the same input through the cache
+            single_flight_lease_seconds (float): How long a worker owns an input it computes before others take over
+            single_flight_poll_interval (float): Seconds between two checks of an input computed by another worker
+            memory_bounded (bool): Bound the memory of newsletters with many links, spilling to disk what isn't needed
+            memory_window (int): Pages held in memory at once in memory-bounded mode
+            spill_dir (str): Where the memory-bounded mode spills, the system temporary directory by default
+            image_reuse (bool): Reuse previous images for summaries on the same topic instead of generating new ones
+            image_reuse_threshold (float): Embedding similarity from which a previous image is reused, above 1 for identical summaries only
+            image_index_path (str): SQLite file of the image reuse index, shared by the workers using it
+            default_deadline_seconds (float): Deadline of the newsletters whose request sets none, None for no deadline
+            deadline_shares (Dict[str, float]): Share of the deadline of each pipeline stage
+        """
+        self.logger = logging.getLogger(__name__)
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.cache = cache
+        self.html_executor_kind = html_executor
+        self.html_workers = html_workers
+        self.html_offload_threshold = html_offload_threshold
+        self.llm_scheduler = llm_scheduler or LLMScheduler()
+        self.image_options = image_options or {}
+        self.image_embed_mode = image_embed_mode
+        self.image_base_url = image_base_url
+        self.state_store = state_store
+        self.pre_rank_candidates = pre_rank_candidates
+        self.interest_profile = interest_profile
+        self.embedding_model = embedding_model
+        self.fetch_options = fetch_options or {}
+        self.speculative = speculative
+        self.speculation_window = speculation_window
+        self.single_flight_enabled = single_flight
+        self.single_flight_lease_seconds = single_flight_lease_seconds
+        self.single_flight_poll_interval = single_flight_poll_interval
+        self.memory_bounded = memory_bounded
+        self.memory_window = memory_window
+        self.spill_dir = spill_dir
+        self.image_reuse = image_reuse
+        self.image_reuse_threshold = image_reuse_threshold
+        self.image_index_path = image_index_path
+        self.default_deadline_seconds = default_deadline_seconds
+        self.deadline_shares = deadline_shares or dict(DEFAULT_SHARES)
+
+        self.html_executor: Optional[Executor] = None
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.openai_client: Optional[AsyncOpenAI] = None
+        self.image_generator: Optional[ImageGenerator] = None
+        self.pre_ranker: Optional[PreRanker] = None
+        self.single_flight: Optional[SingleFlight] = None
+        self.image_index: Optional[ImageReuseIndex] = None
+
+    @classmethod
+    def from_env(cls) -> "AppResources":
+        """Build the resources from environment variables."""
+        return cls(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+            max_connections_per_host=int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 10)),
+            dns_cache_ttl=int(os.getenv("HTTP_DNS_CACHE_TTL", 300)),
+            keepalive_timeout=float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30)),
+            cache=cls.cache_from_env(),
+            html_executor=os.getenv("HTML2TEXT_EXECUTOR", "process"),
+            html_workers=int(os.environ["HTML2TEXT_WORKERS"]) if os.getenv("HTML2TEXT_WORKERS") else None,
+            html_offload_threshold=int(os.getenv("HTML2TEXT_OFFLOAD_THRESHOLD", 50_000)),
+            llm_scheduler=LLMScheduler(
+                requests_per_minute=float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 500)),
+                tokens_per_minute=float(os.getenv("OPENAI_TOKENS_PER_MINUTE", 200_000)),
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 64))
+            ),
+            image_options={
+                "display_width": int(os.getenv("IMAGE_DISPLAY_WIDTH", 800)),
+                "image_format": os.getenv("IMAGE_FORMAT", "webp"),
+                "image_quality": int(os.getenv("IMAGE_QUALITY", 80)),
+                "max_files": int(os.getenv("IMAGE_RETENTION_MAX_FILES", 500)),
+                "max_bytes": int(os.getenv("IMAGE_RETENTION_MAX_MB", 200)) * 1024 * 1024,
+                "max_age_days": float(os.getenv("IMAGE_RETENTION_DAYS", 30)),
+                "embed_base64": os.getenv("IMAGE_EMBED_BASE64", "false").lower() == "true",
+                "tiers": parse_image_tiers(os.getenv("IMAGE_TIERS", "dall-e-3:1024x1024:standard"))
+            },
+            image_embed_mode=os.getenv("IMAGE_EMBED_MODE", "data"),
+            image_base_url=os.getenv("IMAGE_BASE_URL", "/images"),
+            state_store=StateStore(os.getenv("NEWSLETTER_STATE_DIR", "newsletters")),
+            pre_rank_candidates=cls.pre_rank_candidates_from_env(),
+            interest_profile=os.getenv("INTEREST_PROFILE", ""),
+            embedding_model=os.getenv("EMBEDDING_MODEL", "local"),
+            fetch_options={
+                "total_timeout": float(os.getenv("FETCH_TIMEOUT_SECONDS", 30)),
+                "connect_timeout": float(os.getenv("FETCH_CONNECT_TIMEOUT_SECONDS", 10)),
+                "read_timeout": float(os.getenv("FETCH_READ_TIMEOUT_SECONDS", 15)),
+                "max_bytes": int(os.getenv("FETCH_MAX_MB", 5)) * 1024 * 1024,
+                "max_per_host": int(os.getenv("FETCH_MAX_PER_HOST", 4)),
+                # Validators outlive the page cache so that expired pages can be revalidated
+                "validator_store": Cache(
+                    path=os.getenv("FETCH_VALIDATORS_PATH", "cache/http_validators.sqlite3"),
+                    ttl=float(os.getenv("FETCH_VALIDATORS_TTL_DAYS", 30)) * 24 * 3600,
+                    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", 10_000))
+                )
+            },
+            speculative=os.getenv("SPECULATIVE_START", "true").lower() == "true",
+            speculation_window=int(os.getenv("SPECULATION_WINDOW", 2)),
+            single_flight=os.getenv("SINGLE_FLIGHT", "true").lower() == "true",
+            single_flight_lease_seconds=float(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", 120)),
+            single_flight_poll_interval=float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", 0.2)),
+            memory_bounded=os.getenv("MEMORY_BOUNDED", "false").lower() == "true",
+            memory_window=int(os.getenv("MEMORY_WINDOW", 32)),
+            spill_dir=os.getenv("SPILL_DIR") or None,
+            image_reuse=os.getenv("IMAGE_REUSE", "true").lower() == "true",
+            image_reuse_threshold=float(os.getenv("IMAGE_REUSE_THRESHOLD", 0.9)),
+            image_index_path=os.getenv("IMAGE_INDEX_PATH", "cache/image_index.sqlite3"),
+            default_deadline_seconds=float(os.environ["DEFAULT_DEADLINE_SECONDS"]) if os.getenv("DEFAULT_DEADLINE_SECONDS") else None,
+            deadline_shares=parse_stage_shares(os.getenv("DEADLINE_SHARES", ""))
+        )
+
+    @staticmethod
+    def cache_from_env() -> Union[Cache, RedisCache]:
+        """Build the cache of the configured backend: a local SQLite file, or a Redis-compatible server."""
+        backend = os.getenv("CACHE_BACKEND", "sqlite")
+        ttl = float(os.getenv("CACHE_TTL_SECONDS", 24 * 3600))
+        if backend == "redis":
+            return RedisCache(
+                url=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+                ttl=ttl,
+                prefix=os.getenv("REDIS_KEY_PREFIX", "newsletter")
+            )
+        if backend != "sqlite":
+            raise ValueError(f"Unknown cache backend: {backend}. Use 'sqlite' or 'redis'.")
+        return Cache(
+            path=os.getenv("CACHE_PATH", "cache/newsletter_cache.sqlite3"),
+            ttl=ttl,
+            max_entries=int(os.getenv("CACHE_MAX_ENTRIES", 10_000))
+        )
+
+    @staticmethod
+    def pre_rank_candidates_from_env() -> int:
+        """
+        Read the number of pages kept by the pre-ranking. Agents featuring more pages than that
+        would refuse to start, so the setting is checked once here rather than on every request.
+        """
+        candidates = int(os.getenv("PRERANK_CANDIDATES", 0))
+        if 0 < candidates < DEFAULT_MAX_SUMMARIES:
+            raise ValueError(
+                f"PRERANK_CANDIDATES must be 0 (disabled) or at least the {DEFAULT_MAX_SUMMARIES} pages featured in a newsletter, got {candidates}"
+            )
+        return candidates
+
+    async def start(self) -> None:
+        """Open the pooled clients. Must be called from a running event loop."""
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
+
+        # The OpenAI client keeps its own keep-alive connection pool, so a
+        # single instance is enough to reuse connections across requests
+        self.openai_client = AsyncOpenAI(api_key=self.api_key)
+        if self.image_reuse:
+            self.image_index = ImageReuseIndex(
+                self.build_embedding_model(),
+                path=self.image_index_path,
+                threshold=self.image_reuse_threshold
+            )
+        self.image_generator = ImageGenerator(
+            client=self.openai_client,
+            session=self.session,
+            reuse_index=self.image_index,
+            **self.image_options
+        )
+
+        if self.pre_rank_candidates > 0:
+            if not self.interest_profile:
+                raise ValueError("INTEREST_PROFILE must be set to pre-rank pages")
+            self.pre_ranker = PreRanker(self.build_embedding_model(), self.interest_profile, candidates=self.pre_rank_candidates)
+
+        if self.single_flight_enabled and self.cache is not None:
+            self.single_flight = SingleFlight(
+                self.cache,
+                lease_seconds=self.single_flight_lease_seconds,
+                poll_interval=self.single_flight_poll_interval
+            )
+
+        if self.html_executor_kind == "process":
+            # Resolved here rather than left to the pool, as warm_up needs the count
+            self.html_workers = self.html_workers or os.cpu_count() or 1
+            self.html_executor = ProcessPoolExecutor(max_workers=self.html_workers)
+        elif self.html_executor_kind == "thread":
+            self.html_executor = ThreadPoolExecutor(max_workers=self.html_workers, thread_name_prefix="html2text")
+        elif self.html_executor_kind != "none":
+            raise ValueError(f"Unknown HTML executor: {self.html_executor_kind}. Use 'process', 'thread' or 'none'.")
+
+        self.logger.info("Application resources started")
+
+    def build_embedding_model(self) -> EmbeddingModel:
+        if self.embedding_model == "local":
+            return HashingEmbeddingModel()
+        return OpenAIEmbeddingModel(self.openai_client, model=self.embedding_model)
+
+    async def warm_up(self) -> None:
+        """
+        Do the one-time work that would otherwise slow down the first request: start every
+        HTML conversion worker and load the tokenizer and the image codecs.
+        """
+        start_time = time.time()
+        warm_up_html = "<html><body><article><p>Warm-up</p></article></body></html>"
+
+        if isinstance(self.html_executor, ProcessPoolExecutor):
+            # One task per worker so that every process is forked and imports the converter now
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[
+                loop.run_in_executor(self.html_executor, timed_html_to_markdown, warm_up_html)
+                for _ in range(self.html_workers)
+            ])
+        await asyncio.to_thread(count_tokens, warm_up_html)
+        if self.image_generator is not None:
+            # Also checks that Pillow can encode the configured image format
+            await asyncio.to_thread(self.image_generator.warm_up)
+
+        self.logger.info(f"Warm-up completed in {time.time() - start_time:.2f} seconds")
+
+    def build_deadline(self, seconds: Optional[float] = None) -> Optional[Deadline]:
+        """Start the deadline of a newsletter, the default one if `seconds` isn't given."""
+        seconds = seconds if seconds is not None else self.default_deadline_seconds
+        if seconds is None:
+            return None
+        return Deadline(seconds, self.deadline_shares)
+
+    def build_agent(self, links: List[str], **kwargs) -> NewsletterAgent:
+        """Build a NewsletterAgent wired to the shared resources. Extra arguments are passed to the agent and override the shared ones."""
+        options: Dict[str, Any] = {
+            "cache": self.cache,
+            "session": self.session,
+            "image_generator": self.image_generator,
+            "html_executor": self.html_executor,
+            "html_offload_threshold": self.html_offload_threshold,
+            "llm_scheduler": self.llm_scheduler,
+            "image_embed_mode": self.image_embed_mode,
+            "image_base_url": self.image_base_url,
+            "state_store": self.state_store,
+            "pre_ranker": self.pre_ranker,
+            "fetch_options": self.fetch_options,
+            "speculative": self.speculative,
+            "speculation_window": self.speculation_window,
+            "single_flight": self.single_flight,
+            "memory_bounded": self.memory_bounded,
+            "memory_window": self.memory_window,
+            "spill_dir": self.spill_dir
+        }
+        options.update(kwargs)
+        return NewsletterAgent(self.openai_client, links, **options)
+
+    async def close(self) -> None:
+        """Close the pooled clients and the cache."""
+        if self.session is not None:
+            await self.session.close()
+        if self.openai_client is not None:
+            await self.openai_client.close()
+        if self.html_executor is not None:
+            self.html_executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache is not None:
+            self.cache.close()
+        if self.fetch_options.get("validator_store") is not None:
+            self.fetch_options["validator_store"].close()
+        if self.image_index is not None:
+            self.image_index.close()
+        self.logger.info("Application resources closed")
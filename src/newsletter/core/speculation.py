@@ -0,0 +1,111 @@
+"""
+Speculative start.
+Starts image generation and the article abstract while pages are still being summarized:
+images as soon as a summary is certain to be in the top set, and the abstract once the
+top set is certain, or likely when only a few pages remain, redoing it if the set changes.
+"""
+import asyncio
+import logging
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+if TYPE_CHECKING:
+    from newsletter.core.newsletter_agent import NewsletterAgent, PageSummary
+
+
+class SpeculativeStart:
+    def __init__(self, agent: "NewsletterAgent", window: int = 2):
+        """
+        Args:
+            agent (NewsletterAgent): Agent whose images and abstract are started early
+            window (int): Number of pages still to summarize below which the abstract is
+                started on the current top set, before it is certain
+        """
+        self.agent = agent
+        self.max_summaries = agent.max_summaries
+        self.window = window
+        self.logger = logging.getLogger(__name__)
+
+        # Summaries that can be featured, title-only and failed ones are only counted as finished
+        self.summaries: List["PageSummary"] = []
+        self.finished = 0
+        # Upper bound of the number of summaries, exact once every page is fetched
+        self.total: Optional[int] = None
+        self.image_tasks: Dict[str, asyncio.Task] = {}
+        self.abstract_task: Optional[asyncio.Task] = None
+        self.abstract_links: Set[str] = set()
+
+    @property
+    def pending(self) -> int:
+        if self.total is None:
+            return self.max_summaries
+        return max(0, self.total - self.finished)
+
+    def set_total(self, total: int) -> None:
+        """Record the number of pages to summarize, or an upper bound of it."""
+        self.total = total
+        self._update()
+
+    def add(self, summary: "PageSummary") -> None:
+        """Record a finished summary and start whatever it made certain."""
+        self.finished += 1
+        if summary.featurable:
+            self.summaries.append(summary)
+        self._update()
+
+    def guaranteed(self) -> List["PageSummary"]:
+        """Summaries that stay in the top set even if every pending page scores higher."""
+        limit = self.max_summaries - self.pending
+        if limit <= 0:
+            return []
+        scores = sorted(summary.interest_score for summary in self.summaries)
+        return [
+            summary for summary in self.summaries
+            # Summaries ranked ahead, ties included since their final order isn't known yet
+            if len(scores) - bisect_left(scores, summary.interest_score) - 1 < limit
+        ]
+
+    def _update(self) -> None:
+        guaranteed = self.guaranteed()
+        for summary in guaranteed:
+            if summary.link not in self.image_tasks and summary.image is None:
+                # Its final slot isn't known yet, only that it can't be better than its rank so far
+                slot = sum(1 for other in self.summaries if other.interest_score > summary.interest_score)
+                self.image_tasks[summary.link] = asyncio.create_task(self.agent.generate_summaries_images([summary], [slot]))
+                self.agent.metrics.count("speculation", kind="image")
+
+        top = sorted(self.summaries, key=lambda x: x.interest_score, reverse=True)[:self.max_summaries]
+        top_links = {summary.link for summary in top}
+        if self.abstract_task is not None and top_links != self.abstract_links:
+            self.logger.info("Top summaries changed, restarting the speculative article abstract")
+            self.agent.metrics.count("speculation", kind="abstract", result="miss")
+            self.abstract_task.cancel()
+            self.abstract_task = None
+
+        if self.abstract_task is None and top:
+            certain = len(guaranteed) >= self.max_summaries or (self.total is not None and self.pending == 0)
+            likely = self.total is not None and len(top) == self.max_summaries and self.pending <= self.window
+            if certain or likely:
+                self.abstract_links = top_links
+                self.abstract_task = asyncio.create_task(self.agent.generate_article_abstract(top))
+
+    def take_abstract(self, top_summaries: List["PageSummary"]) -> Optional[asyncio.Task]:
+        """Return the abstract started early if it was written from the final top set, cancelling it otherwise."""
+        if self.abstract_task is None:
+            return None
+        if {summary.link for summary in top_summaries} != self.abstract_links:
+            self.agent.metrics.count("speculation", kind="abstract", result="miss")
+            self.abstract_task.cancel()
+            return None
+        self.agent.metrics.count("speculation", kind="abstract", result="hit")
+        task, self.abstract_task = self.abstract_task, None
+        return task
+
+    def images(self) -> "asyncio.Future":
+        """Wait for the images started early."""
+        return asyncio.gather(*self.image_tasks.values())
+
+    def cancel(self) -> None:
+        for task in list(self.image_tasks.values()) + [self.abstract_task]:
+            if task is not None:
+                task.cancel()
@@ -1,28 +1,179 @@
 import os
-import uvicorn
-from fastapi import FastAPI
-from openai import AsyncOpenAI
-from newsletter.core.newsletter_agent import NewsletterAgent
-from pydantic import BaseModel
-from typing import List
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
+from newsletter.core.fan_out import NewsletterFanOut, NewsletterSpec
+from newsletter.core.jobs import Job, JobManager, JobQueueFull, InMemoryJobQueue, ProgressCallback
+from newsletter.utils.metrics import REGISTRY
+from pydantic import BaseModel, Field
+from typing import TYPE_CHECKING, List, Optional
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+if TYPE_CHECKING:
+    from newsletter.core.resources import AppResources
 
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_time = time.time()
+    # The pipeline's heavy dependencies (OpenAI, aiohttp, html2text, Pillow, NumPy, ...) are
+    # imported here, once per worker, so that importing the app stays fast
+    from dotenv import load_dotenv
+    from newsletter.core.resources import AppResources
+
+    load_dotenv()
+    resources = AppResources.from_env()
+    await resources.start()
+    await resources.warm_up()
+    logger.info(f"Application startup completed in {time.time() - start_time:.2f} seconds")
+
+    async def run_newsletter_job(job: Job, report: ProgressCallback) -> str:
+        # The deadline starts when a worker picks the job up, not when it was queued
+        agent = resources.build_agent(
+            job.links,
+            progress_callback=report,
+            newsletter_id=job.newsletter_id,
+            deadline=resources.build_deadline(job.deadline_seconds)
+        )
+        if job.newsletter_id is not None:
+            newsletter = await agent.regenerate_newsletter()
+        else:
+            newsletter = await agent.compose_full_newsletter()
+        report("attachments", {"attachments": newsletter.attachments})
+        report("metrics", newsletter.metrics)
+        return newsletter.full_newsletter
+
+    jobs = JobManager(
+        run_newsletter_job,
+        queue=InMemoryJobQueue(maxsize=int(os.getenv("JOB_QUEUE_SIZE", 100))),
+        workers=int(os.getenv("JOB_WORKERS", 2))
+    )
+    await jobs.start()
+
+    app.state.resources = resources
+    app.state.jobs = jobs
+    yield
+    await jobs.stop()
+    await resources.close()
+
+
+app = FastAPI(lifespan=lifespan)
+# Generated images, for newsletters rendered with IMAGE_EMBED_MODE=url
+app.mount("/images", StaticFiles(directory="generated_images", check_dir=False), name="images")
 
 class NewsletterRequest(BaseModel):
     links: List[str]
+    # Set to regenerate a newsletter incrementally after editing its links
+    newsletter_id: Optional[str] = None
+    # Seconds within which the newsletter must be returned, degraded if needed; DEFAULT_DEADLINE_SECONDS if unset
+    deadline_seconds: Optional[float] = Field(default=None, gt=0)
 
 @app.post("/generate-newsletter")
-async def generate_newsletter(request: NewsletterRequest):
-    data = request.model_dump_json()
-    print(data)
+async def generate_newsletter(request: NewsletterRequest, http_request: Request):
+    logger.info(f"Generating newsletter for {len(request.links)} links")
+
+    resources: AppResources = http_request.app.state.resources
+    agent = resources.build_agent(
+        request.links,
+        newsletter_id=request.newsletter_id,
+        deadline=resources.build_deadline(request.deadline_seconds)
+    )
+    if request.newsletter_id is not None:
+        newsletter = await agent.regenerate_newsletter()
+    else:
+        newsletter = await agent.compose_full_newsletter()
+
+    return {
+        "newsletter": newsletter.full_newsletter,
+        "attachments": newsletter.attachments,
+        "metrics": newsletter.metrics,
+        "degradations": newsletter.degradations
+    }
+
+class NewslettersRequest(BaseModel):
+    newsletters: List[NewsletterSpec]
+
+@app.post("/generate-newsletters")
+async def generate_newsletters(request: NewslettersRequest, http_request: Request):
+    logger.info(f"Generating {len(request.newsletters)} newsletters")
 
-    agent = NewsletterAgent(client, request.links)
-    newsletter = await agent.compose_full_newsletter()
+    resources: AppResources = http_request.app.state.resources
+    try:
+        newsletters = await NewsletterFanOut(resources.build_agent).generate(request.newsletters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    return {"newsletter": newsletter.full_newsletter}
+    return {
+        "newsletters": {
+            name: {"newsletter": newsletter.full_newsletter, "attachments": newsletter.attachments}
+            for name, newsletter in newsletters.items()
+        },
+        "metrics": next(iter(newsletters.values())).metrics if newsletters else {}
+    }
+
+@app.post("/generate-newsletter/stream")
+async def stream_newsletter(request: NewsletterRequest, http_request: Request):
+    logger.info(f"Streaming newsletter for {len(request.links)} links")
+
+    resources: AppResources = http_request.app.state.resources
+    # A stream can't carry attachments, so images are inlined rather than referenced by cid
+    options = {"image_embed_mode": "data"} if resources.image_embed_mode == "cid" else {}
+    agent = resources.build_agent(request.links, deadline=resources.build_deadline(request.deadline_seconds), **options)
+    # Whatever the memory-bounded mode spilled to disk is deleted once the response is sent
+    return StreamingResponse(agent.stream_full_newsletter(), media_type="text/html", background=BackgroundTask(agent.close_spill))
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: NewsletterRequest, http_request: Request):
+    jobs: JobManager = http_request.app.state.jobs
+    try:
+        job = await jobs.submit(request.links, request.newsletter_id, request.deadline_seconds)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, http_request: Request):
+    job = http_request.app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str, http_request: Request):
+    jobs: JobManager = http_request.app.state.jobs
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    async def event_stream():
+        async for job in jobs.events(job_id):
+            yield f"event: {job.status}\ndata: {json.dumps(job.model_dump())}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/health")
+async def health():
+    # Only served once the lifespan startup, warm-up included, has completed
+    return {"status": "ok"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats(http_request: Request):
+    resources = http_request.app.state.resources
+    stats = resources.cache.stats()
+    if resources.single_flight is not None:
+        stats["single_flight"] = resources.single_flight.stats()
+    return stats
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
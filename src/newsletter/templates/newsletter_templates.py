@@ -52,6 +52,11 @@ HTML_HEAD = """
             padding: 30px 0;
             color: #666;
         }
+        img.summary-image {
+            width: 100%;
+            padding: 0;
+            background-color: transparent;
+        }
         .summary-content {
             margin-bottom: 10px;
         }
@@ -102,7 +107,7 @@ ABSTRACT_SECTION = """
 SUMMARY_SECTION = """
         <div class="summary">
             <h2 class="summary-title">{title}</h2>
-            <div class="summary-image">[Image Placeholder]</div>
+            {image}
             <div class="summary-content">
                 <p>{content}</p>
             </div>
@@ -110,6 +115,12 @@ SUMMARY_SECTION = """
         </div>
 """
 
+# Image of a summary
+SUMMARY_IMAGE = """<img class="summary-image" src="{src}" alt="{alt}">"""
+
+# Shown instead of the image when it couldn't be generated
+SUMMARY_IMAGE_PLACEHOLDER = """<div class="summary-image">[Image Placeholder]</div>"""
+
 # Other news section start template
 OTHER_NEWS_START = """
         <div class="other-news">
@@ -119,7 +130,7 @@ OTHER_NEWS_START = """
 
 # Other news link item template
 OTHER_NEWS_LINK = """
-                <li><a href="{link}" target="_blank">{link}</a></li>
+                <li><a href="{link}" target="_blank">{title}</a></li>
 """
 
 # Other news section end template
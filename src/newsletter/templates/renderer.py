@@ -0,0 +1,135 @@
+"""
+Newsletter renderer.
+The HTML templates compiled once at import into literal parts and fields, rendered with
+every field HTML-escaped unless it is already Markup.
+"""
+import html
+from string import Formatter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from newsletter.templates.newsletter_templates import (
+    HTML_HEAD,
+    ABSTRACT_SECTION,
+    SUMMARY_SECTION,
+    SUMMARY_IMAGE,
+    SUMMARY_IMAGE_PLACEHOLDER,
+    OTHER_NEWS_START,
+    OTHER_NEWS_LINK,
+    OTHER_NEWS_END,
+    HTML_FOOTER
+)
+from newsletter.utils.image_gen import image_base64, image_data_uri
+
+# How generated images are referenced in the HTML
+IMAGE_EMBED_MODES = ("data", "cid", "url")
+
+
+class Markup(str):
+    """HTML that is already safe and is inserted into templates as is."""
+
+
+def escape(value: Any) -> str:
+    if isinstance(value, Markup):
+        return value
+    return html.escape(str(value), quote=True)
+
+
+def safe_url(url: str) -> str:
+    """Only let http(s) links through, so LLM output can't inject javascript: URLs."""
+    return url if urlsplit(url).scheme in ("http", "https") else "#"
+
+
+class CompiledTemplate:
+    def __init__(self, source: str):
+        # (literal, field) pairs, field being None after the last literal
+        self.parts: List[Tuple[str, Optional[str]]] = [
+            (literal, field) for literal, field, _, _ in Formatter().parse(source)
+        ]
+
+    def render_to(self, out: List[str], **values: Any) -> None:
+        """Append the rendered template to a list of chunks."""
+        for literal, field in self.parts:
+            out.append(literal)
+            if field is not None:
+                out.append(escape(values[field]))
+
+    def render(self, **values: Any) -> str:
+        out: List[str] = []
+        self.render_to(out, **values)
+        return "".join(out)
+
+
+ABSTRACT = CompiledTemplate(ABSTRACT_SECTION)
+SUMMARY = CompiledTemplate(SUMMARY_SECTION)
+IMAGE = CompiledTemplate(SUMMARY_IMAGE)
+OTHER_NEWS_LINK_ITEM = CompiledTemplate(OTHER_NEWS_LINK)
+
+
+def render_head() -> str:
+    return HTML_HEAD
+
+
+def render_abstract(abstract: str) -> str:
+    return ABSTRACT.render(abstract=abstract)
+
+
+def render_image(
+    image: Optional[Dict[str, Any]],
+    alt: str,
+    mode: str = "data",
+    base_url: str = "/images"
+) -> Tuple[Markup, Optional[Dict[str, str]]]:
+    """
+    Render the image of a summary.
+
+    Args:
+        image (Dict): Image returned by ImageGenerator.generate_image, None if there is none
+        alt (str): Alternative text of the image
+        mode (str): "data" to inline a data URI, "cid" to reference an email attachment,
+            "url" to link to the image served under base_url
+        base_url (str): URL the generated images directory is served at, for the "url" mode
+
+    Returns:
+        Tuple[Markup, Dict]: The image HTML, and the attachment to send with the email in "cid" mode:
+            its content id, file name, MIME type and base64 content
+    """
+    if not image or not image.get("local_path"):
+        return Markup(SUMMARY_IMAGE_PLACEHOLDER), None
+
+    filename = image["local_path"].replace("\\", "/").rsplit("/", 1)[-1]
+    attachment = None
+    if mode == "url":
+        src = f"{base_url.rstrip('/')}/{filename}"
+    else:
+        try:
+            if mode == "cid":
+                content_id = f"{image.get('sha256', filename)[:32]}@newsletter"
+                src = f"cid:{content_id}"
+                # The content itself, since API clients have no access to the server's files
+                attachment = {"content_id": content_id, "filename": filename, "mime_type": image["mime_type"], "base64": image_base64(image)}
+            else:
+                src = image_data_uri(image)
+        except OSError:
+            # Removed by the retention policy since it was generated
+            return Markup(SUMMARY_IMAGE_PLACEHOLDER), None
+
+    return Markup(IMAGE.render(src=src, alt=alt)), attachment
+
+
+def render_summary(title: str, content: str, link: str, image: Markup) -> str:
+    return SUMMARY.render(title=title, content=content, link=safe_url(link), image=image)
+
+
+def render_other_news(items: Iterable[Tuple[str, str]]) -> str:
+    """Render the "Other news" list from (title, link) pairs, showing the link itself when a page has no title."""
+    out: List[str] = []
+    for title, link in items:
+        OTHER_NEWS_LINK_ITEM.render_to(out, title=title or link, link=safe_url(link))
+    if not out:
+        return ""
+    return OTHER_NEWS_START + "".join(out) + OTHER_NEWS_END
+
+
+def render_footer() -> str:
+    return HTML_FOOTER
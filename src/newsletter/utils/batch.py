@@ -0,0 +1,138 @@
+"""
+Batch backends.
+Submit JSONL files of chat completion requests for offline processing and collect their
+results, either through the OpenAI Batch API or a local stand-in.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# Batch statuses after which polling stops
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchBackend(ABC):
+    """Interface of the services able to run a JSONL batch of chat completion requests."""
+
+    @abstractmethod
+    async def submit(self, path: Path) -> str:
+        """Submit the batch file and return the batch id."""
+
+    @abstractmethod
+    async def status(self, batch_id: str) -> str:
+        """Return the batch status, one of FINAL_STATUSES once it is over."""
+
+    @abstractmethod
+    async def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        """Return the output lines of a completed batch."""
+
+    async def wait(self, batch_id: str, poll_interval: float = 60.0, timeout: float = 24 * 3600) -> str:
+        """Poll the batch until it is over and return its final status."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            status = await self.status(batch_id)
+            if status in FINAL_STATUSES:
+                return status
+            if loop.time() + poll_interval > deadline:
+                raise TimeoutError(f"Batch {batch_id} still {status} after {timeout:.0f} seconds")
+            logger.info(f"Batch {batch_id} is {status}, polling again in {poll_interval:.0f} seconds")
+            await asyncio.sleep(poll_interval)
+
+
+class OpenAIBatchBackend(BatchBackend):
+    def __init__(self, client: AsyncOpenAI, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    async def submit(self, path: Path) -> str:
+        with open(path, "rb") as f:
+            batch_file = await self.client.files.create(file=f, purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window
+        )
+        return batch.id
+
+    async def status(self, batch_id: str) -> str:
+        batch = await self.client.batches.retrieve(batch_id)
+        return batch.status
+
+    async def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        batch = await self.client.batches.retrieve(batch_id)
+        lines: List[Dict[str, Any]] = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await self.client.files.content(file_id)
+                lines.extend(json.loads(line) for line in content.text.splitlines() if line.strip())
+        return lines
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Offline stand-in for the Batch API, for tests and local runs.
+
+    Each request body is answered by the responder, which returns the message content the
+    model would have produced. Batches complete after `polls_until_complete` status checks.
+    """
+
+    def __init__(self, responder: Callable[[Dict[str, Any]], str], polls_until_complete: int = 0):
+        self.responder = responder
+        self.polls_until_complete = polls_until_complete
+        self._batches: Dict[str, Dict[str, Any]] = {}
+
+    async def submit(self, path: Path) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        with open(path) as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        self._batches[batch_id] = {"requests": requests, "polls": 0}
+        return batch_id
+
+    async def status(self, batch_id: str) -> str:
+        batch = self._batches[batch_id]
+        batch["polls"] += 1
+        return "completed" if batch["polls"] > self.polls_until_complete else "in_progress"
+
+    async def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        lines: List[Dict[str, Any]] = []
+        for request in self._batches.pop(batch_id)["requests"]:
+            try:
+                content = self.responder(request["body"])
+                response: Optional[Dict[str, Any]] = {
+                    "status_code": 200,
+                    "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+                }
+                error = None
+            except Exception as e:
+                response = None
+                error = {"message": str(e)}
+            lines.append({"custom_id": request["custom_id"], "response": response, "error": error})
+        return lines
+
+
+def write_batch_file(path: Path, requests: Dict[str, Dict[str, Any]]) -> Path:
+    """Write chat completion request bodies, keyed by custom id, as a Batch API JSONL file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        for custom_id, body in requests.items():
+            f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}) + "\n")
+    return path
+
+
+def result_content(line: Dict[str, Any]) -> str:
+    """Return the message content of a batch output line, raising if the request failed."""
+    if line.get("error"):
+        raise ValueError(line["error"].get("message", "Unknown batch error"))
+    response = line.get("response") or {}
+    if response.get("status_code") != 200:
+        raise ValueError(f"Batch request failed with status {response.get('status_code')}")
+    return response["body"]["choices"][0]["message"]["content"]
@@ -0,0 +1,281 @@
+"""
+Persistent cache.
+SQLite-backed key/value store used to avoid re-fetching pages and re-running LLM calls
+for links that were already processed. The database file can be shared by several
+worker processes, which also coordinate through its leases.
+
+The async methods used by the pipeline never fail because of the database: a read that
+fails is a miss, a write that fails is skipped, and a lease that can't be taken is granted
+so that the caller computes the value itself.
+"""
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# LRU touches are written in batches, once this many are pending or after this many seconds
+TOUCH_BATCH_SIZE = 256
+TOUCH_FLUSH_INTERVAL = 5.0
+
+# Seconds between two purges of expired entries, which get() already treats as missing
+PURGE_INTERVAL = 60.0
+
+
+def content_hash(*parts: str) -> str:
+    """Return a stable SHA-256 hex digest of the given string parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        # Separator so that ("ab", "c") and ("a", "bc") hash differently
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class Cache:
+    def __init__(
+        self,
+        path: str = "cache/newsletter_cache.sqlite3",
+        ttl: float = 24 * 3600,
+        max_entries: int = 10_000,
+        max_bytes: int = 256 * 1024 * 1024
+    ):
+        """
+        Args:
+            path (str): SQLite database file, created if it doesn't exist
+            ttl (float): Seconds after which an entry is considered stale
+            max_entries (int): Maximum number of entries before least recently used ones are evicted
+            max_bytes (int): Maximum total size of the stored values before eviction
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_created_at ON cache (created_at)")
+        # Running entry count and size, kept by triggers so that every process sharing the file
+        # sees the same totals without scanning the table
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_totals (id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL, bytes INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO cache_totals SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM cache"
+            )
+            self._conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS cache_totals_insert AFTER INSERT ON cache BEGIN
+                    UPDATE cache_totals SET entries = entries + 1, bytes = bytes + new.size;
+                END
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS cache_totals_update AFTER UPDATE OF size ON cache BEGIN
+                    UPDATE cache_totals SET bytes = bytes + new.size - old.size;
+                END
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS cache_totals_delete AFTER DELETE ON cache BEGIN
+                    UPDATE cache_totals SET entries = entries - 1, bytes = bytes - old.size;
+                END
+                """
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        # Access times not written yet, by namespace and key
+        self._touches: Dict[Tuple[str, str], float] = {}
+        self._last_flush = time.time()
+        self._last_purge = 0.0
+
+    def get(self, namespace: str, key: str, record_stats: bool = True) -> Optional[str]:
+        """Return the cached value, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+                if record_stats:
+                    self.misses[namespace] = self.misses.get(namespace, 0) + 1
+                return None
+
+            self._touches[(namespace, key)] = now
+            if len(self._touches) >= TOUCH_BATCH_SIZE or now - self._last_flush >= TOUCH_FLUSH_INTERVAL:
+                self._flush_touches(now)
+            if record_stats:
+                self.hits[namespace] = self.hits.get(namespace, 0) + 1
+            return row[0]
+
+    def set(self, namespace: str, key: str, value: str) -> None:
+        """Store a value, evicting least recently used entries if the cache is full."""
+        now = time.time()
+        with self._lock:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete doesn't fire the totals trigger
+            self._conn.execute(
+                """
+                INSERT INTO cache (namespace, key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (namespace, key) DO UPDATE SET
+                    value = excluded.value, size = excluded.size, created_at = excluded.created_at, accessed_at = excluded.accessed_at
+                """,
+                (namespace, key, value, len(value.encode("utf-8")), now, now)
+            )
+            self._touches.pop((namespace, key), None)
+            self._evict(now)
+
+    async def aget(self, namespace: str, key: str, record_stats: bool = True) -> Optional[str]:
+        """Like get, in a worker thread so that waiting on the database doesn't block the event loop."""
+        try:
+            return await asyncio.to_thread(self.get, namespace, key, record_stats)
+        except sqlite3.Error as e:
+            logger.warning(f"Cache read of {namespace} failed, treating it as a miss: {e}")
+            return None
+
+    async def aset(self, namespace: str, key: str, value: str) -> None:
+        """Like set, in a worker thread."""
+        try:
+            await asyncio.to_thread(self.set, namespace, key, value)
+        except sqlite3.Error as e:
+            logger.warning(f"Cache write of {namespace} failed, skipping it: {e}")
+
+    async def atry_lock(self, namespace: str, key: str, owner: str, ttl: float) -> bool:
+        """Like try_lock, in a worker thread since it may wait for another process's write lock."""
+        try:
+            return await asyncio.to_thread(self.try_lock, namespace, key, owner, ttl)
+        except sqlite3.Error as e:
+            logger.warning(f"Lease of {namespace} failed, computing the value without it: {e}")
+            return True
+
+    async def aunlock(self, namespace: str, key: str, owner: str) -> None:
+        """Like unlock, in a worker thread."""
+        try:
+            await asyncio.to_thread(self.unlock, namespace, key, owner)
+        except sqlite3.Error as e:
+            logger.warning(f"Lease release of {namespace} failed, it will expire instead: {e}")
+
+    def try_lock(self, namespace: str, key: str, owner: str, ttl: float) -> bool:
+        """Take the lease of a key for `ttl` seconds, unless another owner holds it."""
+        now = time.time()
+        with self._lock:
+            # The write lock makes the check and the insert atomic across processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "DELETE FROM leases WHERE namespace = ? AND key = ? AND expires_at < ?",
+                    (namespace, key, now)
+                )
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO leases (namespace, key, owner, expires_at) VALUES (?, ?, ?, ?)",
+                    (namespace, key, owner, now + ttl)
+                ).rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return inserted == 1
+
+    def unlock(self, namespace: str, key: str, owner: str) -> None:
+        """Release a lease taken with try_lock, if it is still held by `owner`."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM leases WHERE namespace = ? AND key = ? AND owner = ?",
+                (namespace, key, owner)
+            )
+
+    def _flush_touches(self, now: float) -> None:
+        """Write the pending access times in one transaction."""
+        if self._touches:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    [(accessed_at, namespace, key) for (namespace, key), accessed_at in self._touches.items()]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._touches.clear()
+        self._last_flush = now
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries now and then, and least recently used ones when over the size limits."""
+        if now - self._last_purge >= PURGE_INTERVAL:
+            self._conn.execute("DELETE FROM cache WHERE created_at < ?", (now - self.ttl,))
+            self._last_purge = now
+
+        count, total_size = self._conn.execute("SELECT entries, bytes FROM cache_totals").fetchone()
+        if count <= self.max_entries and total_size <= self.max_bytes:
+            return
+
+        # Least recently used first, including the accesses not written yet
+        self._flush_touches(now)
+        evicted = []
+        rows = self._conn.execute("SELECT namespace, key, size FROM cache ORDER BY accessed_at ASC")
+        for namespace, key, size in rows:
+            if count <= self.max_entries and total_size <= self.max_bytes:
+                break
+            evicted.append((namespace, key))
+            count -= 1
+            total_size -= size
+        rows.close()
+        self._conn.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", evicted)
+        logger.info(f"Evicted {len(evicted)} cache entries")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return the hit and miss counters per namespace."""
+        namespaces = set(self.hits) | set(self.misses)
+        return {
+            namespace: {"hits": self.hits.get(namespace, 0), "misses": self.misses.get(namespace, 0)}
+            for namespace in sorted(namespaces)
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_touches(time.time())
+            self._conn.close()
@@ -0,0 +1,145 @@
+"""
+Content extraction.
+Helpers that strip page boilerplate before conversion and keep page text within
+a token budget before it is sent to the LLM.
+"""
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+from bs4 import BeautifulSoup
+
+# Tags that never hold article content
+BOILERPLATE_TAGS = ["script", "style", "noscript", "iframe", "svg", "canvas", "template", "button", "select"]
+
+# Tags of page chrome, removed unless they hold most of the page's text. Headers are
+# kept inside <article> and <main>, where they hold the headline
+CHROME_TAGS = ["nav", "header", "footer", "aside"]
+
+# Whole id/class tokens of navigation bars, cookie banners, share widgets, ..., optionally
+# qualified, e.g. "site-header" or "cookie-banner" but not "has-header" or "shared-content"
+BOILERPLATE_PATTERN = re.compile(
+    r"((site|page|top|bottom|global|primary|secondary|main|cookie)[-_])?"
+    r"(nav|navbar|navigation|menu|breadcrumbs?|footer|header|sidebar|cookies?|consent|gdpr|banner|"
+    r"popup|modal|subscribe|newsletter|share|sharing|social|advert|ads?|promo|related|comments?)"
+    r"([-_](bar|banner|box|links|menu|widget|wrapper|container|section|area|notice|popup))?",
+    re.IGNORECASE
+)
+
+# Share of the page's text from which an element is kept even if it looks like boilerplate
+MAX_BOILERPLATE_TEXT_SHARE = 0.5
+
+# Rough characters-per-token ratio used when tiktoken isn't installed
+CHARS_PER_TOKEN = 4
+
+
+def _is_boilerplate(tag) -> bool:
+    if tag.attrs is None:
+        return False
+    tokens = tag.get("class", []) + [tag.get("id") or ""]
+    return any(BOILERPLATE_PATTERN.fullmatch(token) for token in tokens if token)
+
+
+def _text_length(tag) -> int:
+    return len(tag.get_text(" ", strip=True))
+
+
+def extract_main_content(html: str) -> str:
+    """
+    Remove boilerplate from an HTML page and return the HTML of its main content.
+
+    The <article> or <main> element is used when the page has one, the whole body otherwise.
+    Returns the page unchanged when nothing but whitespace would be left.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+    total_length = _text_length(soup)
+
+    def remove(tag) -> None:
+        # Never drop the page's main containers, nor a wrapper holding most of the text
+        if tag.decomposed or tag.name in ("html", "body", "main", "article"):
+            return
+        if total_length and _text_length(tag) > MAX_BOILERPLATE_TEXT_SHARE * total_length:
+            return
+        tag.decompose()
+
+    for tag in soup(CHROME_TAGS):
+        if tag.name == "header" and tag.find_parent(["article", "main"]) is not None:
+            continue
+        remove(tag)
+    for tag in soup.find_all(_is_boilerplate):
+        remove(tag)
+
+    main = soup.find("article") or soup.find("main") or soup.find(attrs={"role": "main"}) or soup.body or soup
+    if not main.get_text(strip=True):
+        return html
+    return str(main)
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """Return the tiktoken encoding of the model, or None if tiktoken isn't installed."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Count the tokens of a text, estimating from its length if tiktoken isn't installed."""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_into_chunks(text: str) -> List[str]:
+    """Split a markdown text into paragraphs."""
+    return [chunk for chunk in re.split(r"\n\s*\n", text) if chunk.strip()]
+
+
+def truncate_to_token_budget(text: str, max_tokens: int, model: str = "gpt-4o-mini") -> Tuple[str, int, int]:
+    """
+    Keep the leading paragraphs of a text that fit in the token budget.
+
+    Args:
+        text (str): Page text
+        max_tokens (int): Maximum number of tokens to keep
+        model (str): Model whose tokenizer is used to count tokens
+
+    Returns:
+        Tuple[str, int, int]: The truncated text, its token count and the original token count
+    """
+    total_tokens = count_tokens(text, model)
+    if total_tokens <= max_tokens:
+        return text, total_tokens, total_tokens
+
+    kept: List[str] = []
+    kept_tokens = 0
+    for chunk in split_into_chunks(text):
+        chunk_tokens = count_tokens(chunk, model)
+        if kept_tokens + chunk_tokens > max_tokens:
+            if not kept:
+                # A single oversized first paragraph: cut it by characters
+                kept.append(chunk[:max_tokens * CHARS_PER_TOKEN])
+                kept_tokens = count_tokens(kept[0], model)
+            break
+        kept.append(chunk)
+        kept_tokens += chunk_tokens
+
+    return "\n\n".join(kept), kept_tokens, total_tokens
+
+
+def extract_title(text: str, max_length: int = 120) -> str:
+    """Return the first heading of a markdown text, or its first line if it has none."""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    for line in lines:
+        if line.startswith("#"):
+            return line.lstrip("#").strip()[:max_length]
+    return lines[0][:max_length] if lines else ""
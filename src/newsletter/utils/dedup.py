@@ -0,0 +1,87 @@
+"""
+Link deduplication.
+URL canonicalization and SimHash fingerprints used to collapse tracking-parameter
+variants, redirects and syndicated copies of the same article before summarization.
+"""
+import hashlib
+import re
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+import numpy as np
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "igshid", "mc_cid", "mc_eid", "yclid",
+    "ref", "ref_src", "ref_url", "_hsenc", "_hsmi", "mkt_tok", "spm", "cmpid", "ncid",
+    "sr_share", "s_cid", "guccounter"
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "mtm_", "oly_")
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+HEAD_END_PATTERN = re.compile(r"</head\s*>", re.IGNORECASE)
+CANONICAL_LINK_PATTERN = re.compile(r"<link\b[^>]*>", re.IGNORECASE)
+ATTRIBUTE_PATTERN = re.compile(r"""([a-zA-Z-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""")
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Fingerprints are computed on the beginning of the page only, which is enough to tell articles apart
+SIMHASH_MAX_CHARS = 20_000
+
+SIMHASH_BITS = np.arange(64, dtype=np.uint64)
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize a URL so that variants of the same page compare equal.
+
+    Lowercases the scheme and host, drops default ports, fragments and tracking
+    parameters, sorts the remaining query parameters and removes trailing slashes.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    path = parts.path.rstrip("/") or "/"
+
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def find_canonical_link(html: str, base_url: str) -> Optional[str]:
+    """Return the absolute URL of the page's <link rel="canonical">, if it declares one."""
+    # The canonical link lives in the head, no need to scan the whole page
+    head_end = HEAD_END_PATTERN.search(html)
+    head = html[:head_end.start()] if head_end else html[:50_000]
+    for tag in CANONICAL_LINK_PATTERN.findall(head):
+        attributes = {
+            name.lower(): next(value for value in values if value)
+            for name, *values in ATTRIBUTE_PATTERN.findall(tag) if any(values)
+        }
+        if attributes.get("rel", "").lower() == "canonical" and attributes.get("href"):
+            return urljoin(base_url, attributes["href"])
+    return None
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """Compute the 64-bit SimHash of a text over its word shingles."""
+    words = WORD_PATTERN.findall(text[:SIMHASH_MAX_CHARS].lower())
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+
+    digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles)
+    values = np.frombuffer(digests, dtype=">u8").astype(np.uint64)
+    # Each bit votes +1 for every shingle hash where it is set, -1 where it isn't
+    ones = ((values[:, None] >> SIMHASH_BITS) & np.uint64(1)).sum(axis=0, dtype=np.int64)
+    weights = 2 * ones - len(values)
+
+    return sum(1 << bit for bit in np.flatnonzero(weights > 0).tolist())
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
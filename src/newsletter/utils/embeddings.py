@@ -0,0 +1,126 @@
+"""
+Embedding pre-ranking.
+Scores fetched pages by the cosine similarity of their embeddings to an editor-defined
+interest profile, so that only the most promising pages go through the LLM summarize
+and score call.
+"""
+import hashlib
+import logging
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Pages are embedded from their beginning only, which is enough to tell what they are about
+EMBEDDING_MAX_CHARS = 8000
+
+
+class EmbeddingModel(ABC):
+    """Interface of the models turning texts into embedding vectors."""
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Return one row vector per text."""
+
+
+class OpenAIEmbeddingModel(EmbeddingModel):
+    def __init__(self, client: AsyncOpenAI, model: str = "text-embedding-3-small", batch_size: int = 256):
+        """
+        Args:
+            client (AsyncOpenAI): OpenAI client
+            model (str): Embedding model
+            batch_size (int): Maximum number of texts sent in one request
+        """
+        self.client = client
+        self.model = model
+        self.batch_size = batch_size
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            response = await self.client.embeddings.create(model=self.model, input=texts[start:start + self.batch_size])
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class HashingEmbeddingModel(EmbeddingModel):
+    """
+    Local, deterministic bag-of-words embeddings using the hashing trick.
+
+    Needs no network access, which makes it suitable for offline runs and tests, and is
+    good enough to rank pages by topical overlap with the interest profile.
+    """
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+            # The lowest bit picks the sign, so that collisions tend to cancel out
+            vector[(digest >> 1) % self.dimensions] += 1.0 if digest & 1 else -1.0
+        return vector
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.stack([self._embed_one(text) for text in texts])
+
+
+def cosine_similarities(vectors: np.ndarray, profile: np.ndarray) -> np.ndarray:
+    """Return the cosine similarity of each row of `vectors` to the `profile` vector."""
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(profile)
+    # Empty texts have null vectors, rank them last instead of dividing by zero
+    return np.divide(vectors @ profile, norms, out=np.full(len(vectors), -1.0, dtype=np.float32), where=norms > 0)
+
+
+class PreRanker:
+    def __init__(self, model: EmbeddingModel, interest_profile: str, candidates: int = 16):
+        """
+        Args:
+            model (EmbeddingModel): Model embedding the pages and the profile
+            interest_profile (str): Description of the topics the newsletter's readers care about
+            candidates (int): Number of best ranked pages kept for full summarization
+        """
+        self.model = model
+        self.interest_profile = interest_profile
+        self.candidates = candidates
+        self.logger = logging.getLogger(__name__)
+        self._profile_vector: Optional[np.ndarray] = None
+
+    async def profile_vector(self) -> np.ndarray:
+        # The profile doesn't change between newsletters, embed it once
+        if self._profile_vector is None:
+            self._profile_vector = (await self.model.embed([self.interest_profile]))[0]
+        return self._profile_vector
+
+    async def rank(self, pages: Dict[str, str]) -> Tuple[List[str], List[str], Dict[str, float]]:
+        """
+        Rank pages by similarity to the interest profile.
+
+        Args:
+            pages (Dict): Page contents keyed by link
+
+        Returns:
+            Tuple: The links of the candidates to summarize, the links of the remaining pages,
+                both best first, and the similarity of every page
+        """
+        links = list(pages)
+        if len(links) <= self.candidates:
+            return links, [], {}
+
+        vectors = await self.model.embed([pages[link][:EMBEDDING_MAX_CHARS] for link in links])
+        similarities = cosine_similarities(vectors, await self.profile_vector())
+        order = np.argsort(-similarities, kind="stable")
+
+        ranked = [links[index] for index in order]
+        scores = {links[index]: float(similarities[index]) for index in order}
+        self.logger.info(f"Pre-ranked {len(links)} pages, keeping the top {self.candidates} for summarization")
+        return ranked[:self.candidates], ranked[self.candidates:], scores
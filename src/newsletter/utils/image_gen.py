@@ -9,79 +9,295 @@ import time
 import aiohttp
 import aiofiles
 import base64
+import hashlib
+from contextlib import asynccontextmanager
 from io import BytesIO
-from newsletter_prompts import IMAGE_GENERATION_PROMPT
+from typing import Any, Dict, List, Optional, Union
+from uuid import uuid4
+from PIL import Image
+from pydantic import BaseModel
+from newsletter.config.newsletter_prompts import IMAGE_GENERATION_PROMPT
+from newsletter.utils.image_index import ImageReuseIndex, normalize_prompt
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# Pillow format name, file extension and MIME type of each supported output format
+IMAGE_FORMATS = {
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "avif": ("AVIF", "avif", "image/avif"),
+    "png": ("PNG", "png", "image/png"),
+}
+
+
+# Size of the chunks images are downloaded in
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class ImageTier(BaseModel):
+    """Model, size and quality an image is generated with."""
+    model: str = "dall-e-3"
+    size: str = "1024x1024"
+    quality: str = "standard"
+
+    @property
+    def key(self) -> str:
+        return f"{self.model}:{self.size}:{self.quality}"
+
+
+def parse_image_tiers(spec: str) -> List[ImageTier]:
+    """
+    Parse image tiers written as comma-separated model:size:quality triples, one per featured
+    slot, e.g. "dall-e-3:1792x1024:hd,dall-e-3:1024x1024:standard,dall-e-2:512x512:standard".
+    """
+    tiers = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        parts = [part.strip() for part in item.split(":")]
+        if len(parts) != 3:
+            raise ValueError(f"Invalid image tier: {item.strip()}. Use model:size:quality.")
+        tiers.append(ImageTier(model=parts[0], size=parts[1], quality=parts[2]))
+    return tiers or [ImageTier()]
+
+
+def optimize_image(source: Union[str, Path, BytesIO], output: Union[str, Path, BytesIO], width: int, image_format: str, quality: int) -> str:
+    """
+    Resize an image to the given display width and re-encode it.
+
+    Falls back to WebP when the requested format isn't supported by the installed Pillow
+    (AVIF needs Pillow 11.2+ or the pillow-avif-plugin).
+
+    Args:
+        source: Path or file object of the original image
+        output: Path or file object the encoded image is written to
+
+    Returns:
+        str: The format key in IMAGE_FORMATS the image was encoded with
+    """
+    with Image.open(source) as image:
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        try:
+            image.save(output, format=IMAGE_FORMATS[image_format][0], quality=quality, optimize=True)
+        except (KeyError, OSError) as e:
+            if image_format == "webp":
+                raise
+            logger.warning(f"Cannot encode image as {image_format} ({str(e)}), falling back to webp")
+            image.save(output, format="WEBP", quality=quality, optimize=True)
+            return "webp"
+        return image_format
+
+
+def image_base64(image: Dict[str, Any]) -> str:
+    """Return the base64 encoding of a generated image, reading it from disk only when needed."""
+    if image.get("base64"):
+        return image["base64"]
+    with open(image["local_path"], "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+def image_data_uri(image: Dict[str, Any]) -> str:
+    """Build the base64 data URI of a generated image."""
+    return f"data:{image['mime_type']};base64,{image_base64(image)}"
+
+
 class ImageGenerator:
-    def __init__(self):
-        # Load environment variables
-        load_dotenv()
-        
-        # Initialize OpenAI client
-        self.api_key = os.getenv('OPENAI_API_KEY')
-        if not self.api_key:
-            raise ValueError("OpenAI API key not found. Please set OPENAI_API_KEY environment variable.")
-        
-        self.client = AsyncOpenAI(api_key=self.api_key)
-        
+    def __init__(
+        self,
+        client: Optional[AsyncOpenAI] = None,
+        session: Optional[aiohttp.ClientSession] = None,
+        output_dir: str = 'generated_images',
+        display_width: int = 800,
+        image_format: str = "webp",
+        image_quality: int = 80,
+        max_files: int = 500,
+        max_bytes: int = 200 * 1024 * 1024,
+        max_age_days: float = 30,
+        embed_base64: bool = False,
+        tiers: Optional[List[ImageTier]] = None,
+        reuse_index: Optional[ImageReuseIndex] = None
+    ):
+        """
+        Args:
+            client (AsyncOpenAI): Shared OpenAI client, built from OPENAI_API_KEY if not given
+            session (aiohttp.ClientSession): Shared session used to download the images
+            output_dir (str): Directory where generated images are saved
+            display_width (int): Width images are resized to, the newsletter's content width
+            image_format (str): Output format: "webp", "jpeg", "avif" or "png"
+            image_quality (int): Encoder quality, from 1 to 100
+            max_files (int): Maximum number of images kept in the output directory
+            max_bytes (int): Maximum total size of the images kept in the output directory
+            max_age_days (float): Age after which images are deleted from the output directory
+            embed_base64 (bool): Also return the image base64-encoded; otherwise it is referenced by path and URL
+            tiers (List[ImageTier]): Tier of each featured slot, the first one for the top summary; the last
+                tier is used for the slots after it
+            reuse_index (ImageReuseIndex): Index of previous images, reused for identical or similar summaries
+        """
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}. Use one of {', '.join(IMAGE_FORMATS)}.")
+
+        if client is None:
+            # Load environment variables
+            load_dotenv()
+
+            # Initialize OpenAI client
+            api_key = os.getenv('OPENAI_API_KEY')
+            if not api_key:
+                raise ValueError("OpenAI API key not found. Please set OPENAI_API_KEY environment variable.")
+
+            client = AsyncOpenAI(api_key=api_key)
+
+        self.client = client
+        self.session = session
+        self.display_width = display_width
+        self.image_format = image_format
+        self.image_quality = image_quality
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.embed_base64 = embed_base64
+        self.tiers = tiers or [ImageTier()]
+        self.reuse_index = reuse_index
+        # Generations in progress by normalized summary and tier, joined by identical requests
+        self._inflight: Dict[str, asyncio.Task] = {}
+
         # Create output directory if it doesn't exist
-        self.output_dir = Path('generated_images')
+        self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
 
-    async def generate_image(self, summary: str, size: str = "1024x1024", quality: str = "standard") -> dict:
+    @asynccontextmanager
+    async def _session(self):
+        """Use the shared session if there is one, otherwise a short-lived one"""
+        if self.session is not None:
+            yield self.session
+        else:
+            async with aiohttp.ClientSession() as session:
+                yield session
+
+    def tier(self, slot: int = 0) -> ImageTier:
+        """Return the tier of a featured slot, 0 being the top summary."""
+        return self.tiers[min(max(slot, 0), len(self.tiers) - 1)]
+
+    async def generate_image(
+        self,
+        summary: str,
+        size: Optional[str] = None,
+        quality: Optional[str] = None,
+        slot: int = 0
+    ) -> dict:
         """
-        Generate an image based on the provided summary.
+        Generate an image based on the provided summary, or reuse a previous one for the same topic.
         
         Args:
             summary (str): Text description for image generation
-            size (str): Image size (1024x1024, 1792x1024, or 1024x1792)
-            quality (str): Image quality ("standard" or "hd")
+            size (str): Image size (1024x1024, 1792x1024, or 1024x1792), the slot's tier size by default
+            quality (str): Image quality ("standard" or "hd"), the slot's tier quality by default
+            slot (int): Position of the summary among the featured ones, which picks the tier
             
         Returns:
-            dict: Dictionary containing the image URL, local path, and base64-encoded PNG
+            dict: Dictionary containing the image URL, local path, MIME type, SHA-256 of the original
+                image, and the base64-encoded image when embed_base64 is set. Reused images also have
+                "reused" set to "exact" or "similar"
         """
+        tier = self.tier(slot)
+        tier = tier.model_copy(update={"size": size or tier.size, "quality": quality or tier.quality})
+
+        # Identical summaries requested concurrently, e.g. by the newsletters of a fan-out, share one generation
+        inflight_key = f"{tier.key}:{normalize_prompt(summary)}"
+        task = self._inflight.get(inflight_key)
+        if task is None:
+            task = asyncio.create_task(self._generate_or_reuse(summary, tier))
+            self._inflight[inflight_key] = task
+            task.add_done_callback(lambda done: self._forget(inflight_key, done))
+        image = dict(await asyncio.shield(task))
+
+        if self.embed_base64 and "base64" not in image:
+            image["base64"] = (await asyncio.to_thread(image_data_uri, image)).split(",", 1)[1]
+        return image
+
+    def _forget(self, inflight_key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(inflight_key, None)
+        # Retrieved so that a failure whose callers all timed out isn't reported as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def _generate_or_reuse(self, summary: str, tier: ImageTier) -> dict:
+        if self.reuse_index is not None:
+            try:
+                image = await self.reuse_index.lookup(summary, tier.key)
+                if image is not None:
+                    # Keeps the reused file from being pruned as the oldest one
+                    os.utime(image["local_path"])
+                    return image
+            except Exception as e:
+                logger.error(f"Error looking up the image reuse index: {str(e)}")
+
+        image = await self._generate(summary, tier)
+        if self.reuse_index is not None:
+            try:
+                await self.reuse_index.add(summary, tier.key, image)
+            except Exception as e:
+                logger.error(f"Error indexing image: {str(e)}")
+        return image
+
+    async def _generate(self, summary: str, tier: ImageTier) -> dict:
         try:
             logger.info(f"Generating image for summary: {summary}")
             
             # Create prompt using the template
             image_prompt = IMAGE_GENERATION_PROMPT.replace("$SUMMARY", summary)
             
-            # Generate image using DALL-E 3
+            # Generate image using the tier's model, DALL-E 3 by default
             response = await self.client.images.generate(
-                model="dall-e-3",
+                model=tier.model,
                 prompt=image_prompt,
-                size=size,
-                quality=quality,
+                size=tier.size,
+                quality=tier.quality,
                 n=1
             )
 
             # Get image URL
             image_url = response.data[0].url
             
-            # Generate unique filename based on timestamp
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            image_path = self.output_dir / f"generated_image_{timestamp}.png"
-            
-            # Download the image
+
+            # Stream the image to a temporary file, hashing it on the way, so it is never held in memory
             logger.info(f"Downloading image from {image_url}")
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url) as response:
-                    response.raise_for_status()  # Raise an exception for HTTP errors
-                    image_content = await response.read()
-            
-            # Save the image locally
-            async with aiofiles.open(image_path, 'wb') as f:
-                await f.write(image_content)
-                
-            # Convert the image to base64
-            base64_image = base64.b64encode(image_content).decode('utf-8')
+            download_path = self.output_dir / f".download_{uuid4().hex}.part"
+            encoded_path = self.output_dir / f".encode_{uuid4().hex}.part"
+            digest = hashlib.sha256()
+            download_size = 0
+            try:
+                async with self._session() as session:
+                    async with session.get(image_url) as response:
+                        response.raise_for_status()  # Raise an exception for HTTP errors
+                        async with aiofiles.open(download_path, 'wb') as f:
+                            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                digest.update(chunk)
+                                download_size += len(chunk)
+                                await f.write(chunk)
+
+                # Content-addressed filename: unique without relying on the clock, and an image is
+                # stored once per encoding settings
+                source_hash = digest.hexdigest()
+
+                # Resize and re-encode off the event loop, Pillow is CPU bound
+                image_format = await asyncio.to_thread(
+                    optimize_image, download_path, encoded_path, self.display_width, self.image_format, self.image_quality
+                )
+                _, extension, mime_type = IMAGE_FORMATS[image_format]
+                image_path = self.output_dir / f"{source_hash[:32]}_{self.display_width}w_q{self.image_quality}.{extension}"
+                os.replace(encoded_path, image_path)
+            finally:
+                download_path.unlink(missing_ok=True)
+                encoded_path.unlink(missing_ok=True)
+
+            logger.info(f"Image optimized from {download_size} to {image_path.stat().st_size} bytes")
+            await asyncio.to_thread(self.prune_output_dir)
             
             logger.info(f"Image generated and downloaded successfully.")
             
@@ -89,13 +305,51 @@ class ImageGenerator:
                 "url": image_url,
                 "local_path": str(image_path),
                 "timestamp": timestamp,
-                "base64_png": base64_image
+                "mime_type": mime_type,
+                "sha256": source_hash,
+                "tier": tier.key
             }
             
         except Exception as e:
             logger.error(f"Error generating image: {str(e)}")
             raise
 
+    def warm_up(self) -> None:
+        """Load Pillow's codecs by encoding a tiny image in the configured format."""
+        source = BytesIO()
+        Image.new("RGB", (16, 16)).save(source, format="PNG")
+        source.seek(0)
+        optimize_image(source, BytesIO(), self.display_width, self.image_format, self.image_quality)
+
+    def prune_output_dir(self) -> None:
+        """Apply the retention policy: delete expired images, then the oldest ones until within the limits."""
+        files = []
+        for entry in os.scandir(self.output_dir):
+            # Skip the temporary files of downloads in progress
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+
+        expiry = time.time() - self.max_age_days * 24 * 3600
+        total_size = sum(size for _, size, _ in files)
+        count = len(files)
+        removed = 0
+        for mtime, size, path in files:
+            if mtime >= expiry and count <= self.max_files and total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already removed by a concurrent pruning
+                pass
+            count -= 1
+            total_size -= size
+            removed += 1
+
+        if removed:
+            logger.info(f"Removed {removed} images from {self.output_dir}")
+
 async def main():
     # Example usage
     generator = ImageGenerator()
@@ -108,10 +362,15 @@ async def main():
         print(f"Image generated successfully!")
         print(f"Image URL: {result['url']}")
         print(f"Local path: {result['local_path']}")
-        print(f"Base64 PNG available (length: {len(result['base64_png'])} characters)")
+        print(f"Image type: {result['mime_type']}")
         
     except Exception as e:
         print(f"Failed to generate image: {str(e)}")
 
 if __name__ == "__main__":
+    # Logging is only configured when run as a script, importing the module must not change it
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
     asyncio.run(main())
@@ -0,0 +1,185 @@
+"""
+Image reuse index.
+Remembers the summary every image was generated from, so that a summary on a topic that was
+already illustrated gets the existing image instead of a new generation: when its
+normalized summary was seen before, or when its embedding is close enough to a previous one.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from newsletter.config.newsletter_prompts import IMAGE_GENERATION_PROMPT
+from newsletter.utils.cache import content_hash
+from newsletter.utils.embeddings import EmbeddingModel, cosine_similarities
+
+NON_WORD_PATTERN = re.compile(r"[\W_]+")
+
+# Images are only reused for the prompt template they were generated with
+PROMPT_VERSION = content_hash(IMAGE_GENERATION_PROMPT)
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase a text and reduce its punctuation and whitespace to single spaces."""
+    return NON_WORD_PATTERN.sub(" ", text.lower()).strip()
+
+
+class ImageReuseIndex:
+    def __init__(
+        self,
+        model: EmbeddingModel,
+        path: str = "cache/image_index.sqlite3",
+        threshold: float = 0.9,
+        max_entries: int = 5000
+    ):
+        """
+        Args:
+            model (EmbeddingModel): Model embedding the summaries
+            path (str): SQLite database file, created if it doesn't exist. Workers sharing it share their images
+            threshold (float): Cosine similarity from which a previous image is reused, above 1 to only reuse
+                images of identical summaries
+            max_entries (int): Maximum number of indexed images before the oldest ones are forgotten
+        """
+        self.model = model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.logger = logging.getLogger(__name__)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                tier TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                image TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        # Vectors loaded so far, including the ones indexed by other workers: (id, tier, vector, image)
+        self._entries: List[Tuple[int, str, np.ndarray, Dict[str, Any]]] = []
+        self._last_id = 0
+        # Embeddings of the last looked up summaries, so that adding them doesn't embed them again
+        self._pending_vectors: Dict[str, np.ndarray] = {}
+
+    def _key(self, summary: str, tier: str) -> str:
+        return content_hash(PROMPT_VERSION, tier, normalize_prompt(summary))
+
+    # Database accesses run in worker threads through asyncio.to_thread, so that waiting on
+    # another worker's write lock doesn't block the event loop; the entries are only changed
+    # on the event loop
+
+    def _select(self, query: str, parameters: Tuple) -> List[Tuple]:
+        with self._lock:
+            return self._conn.execute(query, parameters).fetchall()
+
+    def _delete(self, row_ids: List[int]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM images WHERE id = ?", [(row_id,) for row_id in row_ids])
+
+    def _insert(self, key: str, tier: str, vector: bytes, image: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (key, tier, vector, image, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, tier, vector, image, time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM images WHERE id <= (SELECT MAX(id) FROM images) - ?", (self.max_entries,)
+            )
+
+    async def _refresh(self) -> None:
+        """Load the entries added since the last refresh, by this worker or another one."""
+        rows = await asyncio.to_thread(
+            self._select, "SELECT id, tier, vector, image FROM images WHERE id > ? ORDER BY id", (self._last_id,)
+        )
+        for row_id, tier, vector, image in rows:
+            # A concurrent refresh may have loaded it already
+            if row_id > self._last_id:
+                self._entries.append((row_id, tier, np.frombuffer(vector, dtype=np.float32), json.loads(image)))
+                self._last_id = row_id
+        if len(self._entries) > self.max_entries:
+            self._entries = self._entries[-self.max_entries:]
+
+    async def _forget(self, row_ids: List[int]) -> None:
+        """Drop entries whose image file was deleted by the retention policy."""
+        self._entries = [entry for entry in self._entries if entry[0] not in row_ids]
+        await asyncio.to_thread(self._delete, row_ids)
+
+    async def lookup(self, summary: str, tier: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a previous image for a summary.
+
+        Args:
+            summary (str): Summary the image would be generated from, in IMAGE_GENERATION_PROMPT
+            tier (str): Model, size and quality the image would be generated with, only images
+                of the same tier are reused
+
+        Returns:
+            Optional[Dict]: A copy of the previous image, with "reused" set to "exact" or "similar",
+                or None if no indexed image is close enough
+        """
+        key = self._key(summary, tier)
+        rows = await asyncio.to_thread(self._select, "SELECT id, image FROM images WHERE key = ?", (key,))
+        if rows:
+            row_id, image = rows[0][0], json.loads(rows[0][1])
+            if os.path.exists(image["local_path"]):
+                return {**image, "reused": "exact"}
+            await self._forget([row_id])
+        if self.threshold > 1:
+            return None
+
+        vector = (await self.model.embed([normalize_prompt(summary)]))[0]
+        if len(self._pending_vectors) > 256:
+            # Left behind by generations that failed
+            self._pending_vectors.clear()
+        self._pending_vectors[key] = vector
+        await self._refresh()
+        candidates = [entry for entry in self._entries if entry[1] == tier and len(entry[2]) == len(vector)]
+        if not candidates:
+            return None
+
+        similarities = cosine_similarities(np.stack([entry[2] for entry in candidates]), vector)
+        missing: List[int] = []
+        # Best first, skipping images that were deleted since they were indexed
+        for index in np.argsort(-similarities, kind="stable"):
+            if similarities[index] < self.threshold:
+                break
+            row_id, _, _, image = candidates[index]
+            if os.path.exists(image["local_path"]):
+                self._pending_vectors.pop(key, None)
+                if missing:
+                    await self._forget(missing)
+                self.logger.info(f"Reusing image {image['local_path']} (similarity {similarities[index]:.2f})")
+                return {**image, "reused": "similar"}
+            missing.append(row_id)
+        if missing:
+            await self._forget(missing)
+        return None
+
+    async def add(self, summary: str, tier: str, image: Dict[str, Any]) -> None:
+        """Index an image generated from a summary."""
+        key = self._key(summary, tier)
+        vector = self._pending_vectors.pop(key, None)
+        if vector is None:
+            vector = (await self.model.embed([normalize_prompt(summary)]))[0]
+        # Base64 copies are rebuilt from the file
+        stored = {name: value for name, value in image.items() if name not in ("base64", "reused")}
+        await asyncio.to_thread(self._insert, key, tier, np.asarray(vector, dtype=np.float32).tobytes(), json.dumps(stored))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,36 +1,409 @@
 import aiohttp
 import asyncio
-from typing import List 
+import codecs
+import itertools
+import json
+import logging
+import re
+import time
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
 from html2text import HTML2Text
+from newsletter.utils.cache import Cache, content_hash
+from newsletter.utils.content_extractor import extract_main_content
+from newsletter.utils.dedup import canonicalize_url, find_canonical_link, hamming_distance, simhash
+from newsletter.utils.metrics import PipelineMetrics
+from newsletter.utils.single_flight import SingleFlight
+
+# Content types worth converting; PDFs, images, archives and other binaries are skipped
+TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Browsers look for a <meta charset> declaration in the first 1024 bytes of a page
+META_CHARSET_SNIFF_BYTES = 1024
+META_CHARSET_PATTERN = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_:.-]+)""", re.IGNORECASE)
+
+
+class PageTooLarge(Exception):
+    pass
+
+
+class UnsupportedContentType(Exception):
+    pass
+
+
+def _known_codec(charset: Optional[str]) -> Optional[str]:
+    """Return the charset if Python has a codec for it, None otherwise"""
+    if not charset:
+        return None
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return None
+
+
+def detect_charset(body: bytes, declared: Optional[str] = None) -> str:
+    """
+    Pick the charset of a page: the one declared in the Content-Type header, then the one of
+    its <meta> tag, then the one detected by charset_normalizer when it is installed, utf-8 otherwise.
+    """
+    charset = _known_codec(declared)
+    if charset is None:
+        match = META_CHARSET_PATTERN.search(body[:META_CHARSET_SNIFF_BYTES])
+        charset = _known_codec(match.group(1).decode("ascii")) if match else None
+    if charset is None:
+        try:
+            from charset_normalizer import from_bytes
+        except ImportError:
+            return "utf-8"
+        best = from_bytes(body).best()
+        charset = _known_codec(best.encoding) if best is not None else None
+    return charset or "utf-8"
+
+
+def _markdown(html: str) -> str:
+    h2t = HTML2Text()
+    h2t.ignore_links = True
+    h2t.ignore_images = True
+    h2t.ignore_tables = True
+    return h2t.handle(html)
+
+
+def html_to_markdown(html: str) -> str:
+    """Convert the main content of an HTML page to markdown text. Module-level so it can run in a process pool"""
+    content = _markdown(extract_main_content(html))
+    if not content.strip():
+        # Extraction failed: convert the whole page rather than sending nothing to summarize
+        content = _markdown(html)
+    return content if content.strip() else ""
+
+
+def timed_html_to_markdown(html: str, fingerprint: bool = False) -> Tuple[str, Optional[int], float]:
+    """
+    Convert HTML to markdown, also returning the SimHash of the text when asked, so that it is
+    computed in the same worker, and the CPU time both took in the worker thread or process
+    """
+    start_cpu = time.thread_time()
+    content = html_to_markdown(html)
+    content_fingerprint = simhash(content) if fingerprint and content else None
+    return content, content_fingerprint, time.thread_time() - start_cpu
+
 
 class LinkFetcher:
-    def __init__(self, links: List[str]):
-        self.links = links   
+    def __init__(
+        self,
+        links: List[str],
+        cache: Optional[Cache] = None,
+        session: Optional[aiohttp.ClientSession] = None,
+        executor: Optional[Executor] = None,
+        offload_threshold: int = 50_000,
+        metrics: Optional[PipelineMetrics] = None,
+        dedupe: bool = True,
+        near_duplicate_distance: int = 3,
+        total_timeout: float = 30.0,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 15.0,
+        max_bytes: int = 5 * 1024 * 1024,
+        max_per_host: int = 4,
+        content_types: Tuple[str, ...] = TEXT_CONTENT_TYPES,
+        validator_store: Optional[Cache] = None,
+        single_flight: Optional[SingleFlight] = None
+    ):
+        """
+        Args:
+            links (List[str]): Links to fetch
+            cache (Cache): Cache of converted pages
+            session (aiohttp.ClientSession): Shared session used to fetch the pages
+            executor (Executor): Pool running the HTML conversion off the event loop
+            offload_threshold (int): HTML size in characters from which conversion is offloaded to the executor
+            metrics (PipelineMetrics): Metrics recording fetch latency per host and conversion CPU time
+            dedupe (bool): Collapse links pointing to the same or a near-identical article
+            near_duplicate_distance (int): Maximum SimHash Hamming distance between two near-duplicate pages
+            total_timeout (float): Maximum seconds for a whole page fetch
+            connect_timeout (float): Maximum seconds to connect to a host
+            read_timeout (float): Maximum seconds between two reads of the response body
+            max_bytes (int): Pages larger than this are aborted as soon as the limit is crossed
+            max_per_host (int): Concurrent fetches to a single host
+            content_types (Tuple[str, ...]): Content types that are fetched, other responses are skipped
+            validator_store (Cache): Long-lived store of ETag/Last-Modified validators and page contents,
+                used to send conditional requests once a page's cache entry has expired
+            single_flight (SingleFlight): Coalesces concurrent fetches of the same link, across workers
+                sharing its cache, so that a page is downloaded once
+        """
+        self.links = links
+        self.cache = cache
+        self.session = session
+        self.executor = executor
+        self.offload_threshold = offload_threshold
+        self.metrics = metrics
+        self.dedupe = dedupe
+        self.near_duplicate_distance = near_duplicate_distance
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout, sock_read=read_timeout)
+        self.max_bytes = max_bytes
+        self.max_per_host = max_per_host
+        self.content_types = content_types
+        self.validator_store = validator_store
+        self.single_flight = single_flight
+        self.logger = logging.getLogger(__name__)
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        # Canonical URL of each fetched link, after redirects and <link rel="canonical">
+        self.canonical_urls: Dict[str, str] = {}
+        # SimHash of the content of each fetched link
+        self.fingerprints: Dict[str, int] = {}
+        # Links skipped as duplicates, mapped to the link kept in their place
+        self.duplicates: Dict[str, str] = {}
+        # Links still being fetched or not started when the consumer stopped early
+        self.unfinished_links: List[str] = []
+
+        # Links actually fetched, as submitted: tracking-parameter variants of the same URL are
+        # fetched once, the canonical form only serving as the dedupe key
+        self.fetch_links: List[str] = []
+        kept: Dict[str, str] = {}
+        for link in links:
+            canonical = canonicalize_url(link) if dedupe else link
+            if canonical in kept:
+                if link != kept[canonical]:
+                    self.duplicates[link] = kept[canonical]
+            else:
+                kept[canonical] = link
+                self.fetch_links.append(link)
+
+    @asynccontextmanager
+    async def _session(self):
+        """Use the shared session if there is one, otherwise a short-lived one"""
+        if self.session is not None:
+            yield self.session
+        else:
+            async with aiohttp.ClientSession() as session:
+                yield session
+
+    def _host_semaphore(self, link: str) -> asyncio.Semaphore:
+        host = urlparse(link).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_semaphores[host]
+
+    def _count(self, event: str, **labels) -> None:
+        if self.metrics is not None:
+            self.metrics.count(event, **labels)
+
+    async def _read_body(self, response: aiohttp.ClientResponse) -> str:
+        """Read a text response body, aborting as soon as it goes over max_bytes"""
+        # aiohttp reports application/octet-stream when the header is missing; treat those pages as HTML
+        content_type = response.content_type if "Content-Type" in response.headers else "text/html"
+        if content_type not in self.content_types:
+            raise UnsupportedContentType(f"unsupported content type {content_type}")
+        if response.content_length is not None and response.content_length > self.max_bytes:
+            raise PageTooLarge(f"{response.content_length} bytes announced, limit is {self.max_bytes}")
+
+        chunks: List[bytes] = []
+        size = 0
+        async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise PageTooLarge(f"more than {self.max_bytes} bytes")
+            chunks.append(chunk)
+        body = b"".join(chunks)
+        return body.decode(detect_charset(body, response.charset), errors="replace")
 
     async def fetch_page(self, session, link):
       """Fetch a single page asynchronously"""
-      h2t = HTML2Text()
-      h2t.ignore_links = True
-      h2t.ignore_images = True
-      h2t.ignore_tables = True
+      cache_key = content_hash(link)
+      record = None
+      if self.cache is not None:
+          record = await self.cache.aget("page", cache_key)
+          self._count("cache", namespace="page", result="miss" if record is None else "hit")
+
+      if record is None:
+          if self.single_flight is not None:
+              record = await self.single_flight.run("page", cache_key, lambda: self.download_page(session, link, cache_key))
+          else:
+              record = await self.download_page(session, link, cache_key)
+              if self.cache is not None and record is not None:
+                  await self.cache.aset("page", cache_key, record)
+      if record is None:
+          return None
+
+      content, canonical, fingerprint = self._load_record(record)
+      if self.dedupe:
+          # Known however the page was obtained, so that redirect and rel=canonical dedupe
+          # also works for pages served by the cache or by another worker
+          self.canonical_urls[link] = canonical or canonicalize_url(link)
+          self.fingerprints[link] = fingerprint if fingerprint is not None else await self.fingerprint(content)
+      return content
+
+    @staticmethod
+    def _load_record(record: str) -> Tuple[str, Optional[str], Optional[int]]:
+      """Split a cached page record into its content, canonical URL and content fingerprint"""
+      try:
+          page = json.loads(record)
+      except ValueError:
+          page = None
+      if not isinstance(page, dict) or "content" not in page:
+          # Entry written before canonical URLs were cached with the content
+          return record, None, None
+      return page["content"], page.get("canonical"), page.get("fingerprint")
+
+    async def download_page(self, session, link, cache_key):
+      """Download and convert a page, returning its cache record: the content and canonical URL as JSON, None if it can't be fetched"""
+      # Validators of the last fetch, to only download the page again if it changed
+      validators = None
+      headers = {}
+      if self.validator_store is not None:
+          stored = await self.validator_store.aget("http", cache_key)
+          if stored is not None:
+              validators = json.loads(stored)
+              if validators.get("etag"):
+                  headers["If-None-Match"] = validators["etag"]
+              if validators.get("last_modified"):
+                  headers["If-Modified-Since"] = validators["last_modified"]
+
       try:
-          async with session.get(link, ssl=False) as response:
-              html = await response.text()
-              return h2t.handle(html)
+          start_time = time.time()
+          async with session.get(link, ssl=False, headers=headers, timeout=self.timeout) as response:
+              if response.status == 304 and validators is not None:
+                  html = None
+              else:
+                  response.raise_for_status()
+                  html = await self._read_body(response)
+              final_url = str(response.url)
+              etag = response.headers.get("ETag")
+              last_modified = response.headers.get("Last-Modified")
+          if self.metrics is not None:
+              self.metrics.observe_fetch(urlparse(link).netloc, time.time() - start_time)
+
+          if html is None:
+              # Not modified: reuse the stored conversion
+              self._count("conditional", result="not_modified")
+              content = validators["content"]
+              canonical = validators.get("canonical") or canonicalize_url(final_url)
+              fingerprint = validators.get("fingerprint")
+          else:
+              if validators is not None:
+                  self._count("conditional", result="modified")
+              content, fingerprint = await self.convert_html(html)
+              canonical = canonicalize_url(find_canonical_link(html, final_url) or final_url)
+              if self.validator_store is not None and content and (etag or last_modified):
+                  await self.validator_store.aset("http", cache_key, json.dumps({
+                      "etag": etag,
+                      "last_modified": last_modified,
+                      "canonical": canonical,
+                      "fingerprint": fingerprint,
+                      "content": content
+                  }))
+
+          if not content:
+              return None
+          return json.dumps({"content": content, "canonical": canonical, "fingerprint": fingerprint})
+      except (PageTooLarge, UnsupportedContentType) as e:
+          self.logger.warning(f"Skipping {link}: {str(e)}")
+          self._count("skipped", stage="fetch", reason="too_large" if isinstance(e, PageTooLarge) else "content_type")
+          return None
+      except asyncio.TimeoutError:
+          self.logger.warning(f"Timed out fetching {link}")
+          self._count("timeout", stage="fetch")
+          return None
       except Exception as e:
-          print(f"Error fetching {link}: {str(e)}")
+          self.logger.warning(f"Error fetching {link}: {str(e)}")
+          self._count("error", stage="fetch")
           return None
 
+    async def convert_html(self, html: str) -> Tuple[str, Optional[int]]:
+      """
+      Convert HTML to markdown, in the executor for large pages so the event loop stays responsive.
+      Also returns the SimHash of the text when deduplicating, None otherwise
+      """
+      if self.executor is None or len(html) < self.offload_threshold:
+          content, fingerprint, cpu_seconds = timed_html_to_markdown(html, self.dedupe)
+      else:
+          loop = asyncio.get_running_loop()
+          content, fingerprint, cpu_seconds = await loop.run_in_executor(self.executor, timed_html_to_markdown, html, self.dedupe)
+      if self.metrics is not None:
+          self.metrics.observe_html2text(cpu_seconds)
+      return content, fingerprint
+
+    async def fingerprint(self, content: str) -> int:
+      """SimHash of a page stored without one, in the executor for large pages like conversions"""
+      if self.executor is None or len(content) < self.offload_threshold:
+          return simhash(content)
+      return await asyncio.get_running_loop().run_in_executor(self.executor, simhash, content)
+
+    async def iter_pages(self, max_concurrent: int = 10, window: Optional[int] = None) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Fetch pages concurrently, yielding (link, content) pairs as soon as each one completes
+
+        Args:
+            max_concurrent (int): Maximum number of concurrent fetches
+            window (int): Maximum number of pages being fetched or fetched but not yet consumed,
+                all of them by default. Bounds the memory held by pages the consumer is not ready for
+        """
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def bounded_fetch(session, link):
+            # Wait for the host first, so that links of a busy host don't hold global slots
+            async with self._host_semaphore(link):
+                async with semaphore:
+                    return link, await self.fetch_page(session, link)
+
+        # Pages already yielded, by canonical URL and by content fingerprint
+        seen_urls: Dict[str, str] = {}
+        fingerprints: List[Tuple[int, str]] = []
+
+        async with self._session() as session:
+            remaining = iter(self.fetch_links)
+            tasks: Dict[asyncio.Task, str] = {}
+
+            def refill():
+                # New fetches only start once the consumer took the previous pages
+                for link in itertools.islice(remaining, (window or len(self.fetch_links)) - len(tasks)):
+                    tasks[asyncio.create_task(bounded_fetch(session, link))] = link
+
+            try:
+                refill()
+                while tasks:
+                    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        del tasks[task]
+                        link, content = task.result()
+                        if not content:  # Only yield if content was successfully fetched
+                            continue
+                        if self.dedupe and self._is_duplicate(link, content, seen_urls, fingerprints):
+                            continue
+                        yield link, content
+                    refill()
+            finally:
+                # Don't leave fetches running if the consumer stops early
+                self.unfinished_links = [link for task, link in tasks.items() if not task.done()] + list(remaining)
+                for task in tasks:
+                    task.cancel()
+
+    def _is_duplicate(self, link: str, content: str, seen_urls: Dict[str, str], fingerprints: List[Tuple[int, str]]) -> bool:
+        """Check a fetched page against the pages already kept, recording it if it is a duplicate"""
+        canonical = self.canonical_urls.get(link) or canonicalize_url(link)
+        if canonical in seen_urls:
+            self.duplicates[link] = seen_urls[canonical]
+            self.logger.info(f"Skipping {link}: same canonical URL as {seen_urls[canonical]}")
+            self._count("duplicate", kind="url")
+            return True
+
+        fingerprint = self.fingerprints[link] if link in self.fingerprints else simhash(content)
+        for other_fingerprint, other_link in fingerprints:
+            if hamming_distance(fingerprint, other_fingerprint) <= self.near_duplicate_distance:
+                self.duplicates[link] = other_link
+                self.logger.info(f"Skipping {link}: near-duplicate of {other_link}")
+                self._count("duplicate", kind="content")
+                return True
+
+        seen_urls[canonical] = link
+        fingerprints.append((fingerprint, link))
+        return False
+
     async def fetch_all_pages(self):
         """Fetch all pages concurrently"""
-        new_pages = {}
-        async with aiohttp.ClientSession() as session:
-            tasks = [self.fetch_page(session, link) for link in self.links]
-            results = await asyncio.gather(*tasks)
-            
-            # Create dictionary of results
-            for link, content in zip(self.links, results):
-                if content:  # Only add if content was successfully fetched
-                    new_pages[link] = content
-        
-        return new_pages
\ No newline at end of file
+        fetched = {link: content async for link, content in self.iter_pages()}
+
+        # Keep the dictionary in the order of the submitted links
+        return {link: fetched[link] for link in self.fetch_links if link in fetched}
\ No newline at end of file
@@ -0,0 +1,202 @@
+"""
+LLM call scheduler.
+Shares the OpenAI rate limits between all in-flight LLM calls: token buckets for requests
+and tokens per minute, an AIMD concurrency limit that backs off on 429s, and jittered
+retries of transient errors.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import openai
+
+from newsletter.utils.metrics import PipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Errors worth retrying; anything else is a bug or a bad request and fails immediately
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    asyncio.TimeoutError
+)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        """
+        Args:
+            per_minute (float): Refill rate of the bucket
+            capacity (float): Maximum burst, one minute worth of refill by default
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float) -> None:
+        """Wait until `amount` units are available and take them."""
+        # A request bigger than the whole bucket would wait forever; let it drain the bucket instead
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                await asyncio.sleep((amount - self.available) / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """Take (or give back, if negative) units once the real cost of a request is known."""
+        self._refill()
+        self.available = min(self.capacity, self.available - amount)
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 200_000,
+        initial_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: int = 64,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0
+    ):
+        """
+        Args:
+            requests_per_minute (float): Request rate limit of the OpenAI account
+            tokens_per_minute (float): Token rate limit of the OpenAI account
+            initial_concurrency (int): Number of concurrent calls allowed at start
+            min_concurrency (int): Lower bound of the adaptive concurrency limit
+            max_concurrency (int): Upper bound of the adaptive concurrency limit
+            max_retries (int): Retries of a call failing with a transient error
+            base_delay (float): First retry delay in seconds, doubled at each attempt
+            max_delay (float): Maximum retry delay in seconds
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+        # Set from Retry-After headers: no call starts before this time
+        self._paused_until = 0.0
+
+    async def call(
+        self,
+        func: Callable[[], Awaitable[T]],
+        estimated_tokens: int = 1000,
+        stage: str = "llm",
+        metrics: Optional[PipelineMetrics] = None
+    ) -> T:
+        """
+        Run an LLM call within the rate limits, retrying transient errors.
+
+        Args:
+            func (Callable): Function creating the call's coroutine, called again for each attempt
+            estimated_tokens (int): Expected prompt + completion tokens, charged to the token bucket
+            stage (str): Pipeline stage the call belongs to, used in logs and metrics
+            metrics (PipelineMetrics): Metrics where retries are counted
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_pause()
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimated_tokens)
+
+            await self._acquire_slot()
+            try:
+                result = await func()
+                error = None
+            except RETRYABLE_ERRORS as e:
+                error = e
+            finally:
+                await self._release_slot()
+
+            if error is None:
+                await self._on_success()
+                usage = getattr(result, "usage", None)
+                if usage is not None and getattr(usage, "total_tokens", None):
+                    self.tokens.adjust(usage.total_tokens - estimated_tokens)
+                return result
+
+            rate_limited = isinstance(error, openai.RateLimitError)
+            retry_after = self._retry_after(error)
+            await self._on_failure(rate_limited, retry_after)
+
+            if attempt == self.max_retries:
+                raise error
+            delay = retry_after if retry_after is not None else self._backoff(attempt)
+            logger.warning(f"{stage} call failed ({type(error).__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.1f} seconds")
+            if metrics is not None:
+                metrics.count("retry", stage=stage, reason="rate_limit" if rate_limited else "transient")
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """Read the delay requested by the API in the Retry-After headers, if any."""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            # Retry-After can also be an HTTP date; fall back to our own backoff
+            return None
+        return None
+
+    async def _wait_for_pause(self) -> None:
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _acquire_slot(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def _release_slot(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def _on_success(self) -> None:
+        """Additive increase: about one more concurrent call per limit's worth of successes."""
+        async with self._condition:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    async def _on_failure(self, rate_limited: bool, retry_after: Optional[float]) -> None:
+        """Multiplicative decrease on rate limiting, and pause every call for the Retry-After delay."""
+        if not rate_limited:
+            return
+        async with self._condition:
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        logger.warning(f"Rate limited, concurrency limit lowered to {int(self.limit)}")
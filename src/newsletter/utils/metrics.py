@@ -0,0 +1,166 @@
+"""
+Pipeline metrics.
+Process-wide counters and histograms exposed in the Prometheus text format, and the
+per-newsletter breakdown of where time and tokens went.
+"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Histogram buckets in seconds, from fast cache hits to slow image generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+def _label_set(labels: Dict[str, Any]) -> LabelSet:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: LabelSet, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._descriptions: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[LabelSet, float]] = {}
+        self._histograms: Dict[str, Dict[LabelSet, List[float]]] = {}
+
+    def describe(self, name: str, kind: str, description: str) -> None:
+        """Register the type ("counter" or "histogram") and help text of a metric."""
+        self._descriptions[name] = (kind, description)
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        """Increment a counter."""
+        key = _label_set(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Record a value in a histogram."""
+        key = _label_set(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            # One count per bucket, then the sum and the total count
+            state = series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                self._render_header(lines, name, "counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+
+            for name, series in sorted(self._histograms.items()):
+                self._render_header(lines, name, "histogram")
+                for labels, state in sorted(series.items()):
+                    for bound, count in zip(self.buckets, state):
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', str(bound)))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {state[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {state[-2]}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def _render_header(self, lines: List[str], name: str, default_kind: str) -> None:
+        kind, description = self._descriptions.get(name, (default_kind, ""))
+        if description:
+            lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+# Registry shared by the whole process and served on /metrics
+REGISTRY = MetricsRegistry()
+REGISTRY.describe("newsletter_stage_duration_seconds", "histogram", "Latency of each pipeline stage call")
+REGISTRY.describe("newsletter_fetch_duration_seconds", "histogram", "Latency of page fetches")
+REGISTRY.describe("newsletter_html2text_cpu_seconds", "histogram", "CPU time spent converting HTML to text")
+REGISTRY.describe("newsletter_llm_tokens_total", "counter", "LLM tokens used per stage and kind")
+REGISTRY.describe("newsletter_events_total", "counter", "Pipeline events such as cache lookups, retries and errors")
+
+
+class PipelineMetrics:
+    """Metrics of a single newsletter run, also recorded in the shared registry."""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or REGISTRY
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.fetch_hosts: Dict[str, Dict[str, float]] = {}
+        self.tokens: Dict[str, Dict[str, int]] = {}
+        self.events: Dict[str, int] = {}
+
+    @staticmethod
+    def _add_timing(timings: Dict[str, Dict[str, float]], key: str, seconds: float) -> None:
+        timing = timings.setdefault(key, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        timing["count"] += 1
+        timing["total_seconds"] += seconds
+        timing["max_seconds"] = max(timing["max_seconds"], seconds)
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        """Record the latency of one call of a stage (summarize, abstract, image, ...)."""
+        with self._lock:
+            self._add_timing(self.stages, stage, seconds)
+        self.registry.observe("newsletter_stage_duration_seconds", seconds, stage=stage)
+
+    def observe_fetch(self, host: str, seconds: float) -> None:
+        """
+        Record the latency of one page fetch. Hosts come from user-submitted links, so they are only
+        broken down in the run's metrics: as registry labels they would grow without bound.
+        """
+        with self._lock:
+            self._add_timing(self.fetch_hosts, host, seconds)
+        self.registry.observe("newsletter_fetch_duration_seconds", seconds)
+
+    def observe_html2text(self, cpu_seconds: float) -> None:
+        """Record the CPU time of one HTML conversion."""
+        with self._lock:
+            self._add_timing(self.stages, "html2text_cpu", cpu_seconds)
+        self.registry.observe("newsletter_html2text_cpu_seconds", cpu_seconds)
+
+    def add_tokens(self, stage: str, usage: Any) -> None:
+        """Record the token usage of an LLM completion, given as the usage object or its dict."""
+        if usage is None:
+            return
+        if isinstance(usage, dict):
+            # Raw usage of Batch API results
+            prompt_tokens = usage.get("prompt_tokens", 0) or 0
+            completion_tokens = usage.get("completion_tokens", 0) or 0
+        else:
+            prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        with self._lock:
+            tokens = self.tokens.setdefault(stage, {"prompt": 0, "completion": 0})
+            tokens["prompt"] += prompt_tokens
+            tokens["completion"] += completion_tokens
+        self.registry.inc("newsletter_llm_tokens_total", prompt_tokens, stage=stage, kind="prompt")
+        self.registry.inc("newsletter_llm_tokens_total", completion_tokens, stage=stage, kind="completion")
+
+    def count(self, event: str, **labels) -> None:
+        """Count an event, e.g. count("cache", namespace="page", result="hit")."""
+        key = ".".join([event] + [str(value) for _, value in sorted(labels.items())])
+        with self._lock:
+            self.events[key] = self.events.get(key, 0) + 1
+        self.registry.inc("newsletter_events_total", event=event, **labels)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the run's breakdown, to be attached to the newsletter result."""
+        with self._lock:
+            return {
+                "stages": {stage: dict(timing) for stage, timing in self.stages.items()},
+                "fetch_hosts": {host: dict(timing) for host, timing in self.fetch_hosts.items()},
+                "tokens": {stage: dict(tokens) for stage, tokens in self.tokens.items()},
+                "events": dict(self.events)
+            }
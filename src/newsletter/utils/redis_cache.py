@@ -0,0 +1,222 @@
+"""
+Redis cache.
+Redis-backed alternative to the SQLite cache, for workers spread over several machines.
+It speaks the RESP protocol over asyncio streams, so it works with Redis and compatible
+servers (Valkey, KeyDB, Dragonfly) without an extra client library, and a slow server
+only delays the requests waiting for it rather than the whole event loop.
+
+Like the SQLite cache, the async methods never fail because of the server: while it is
+unreachable, reads are misses, writes are skipped and leases are granted, so that requests
+compute their values themselves.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import unquote, urlparse
+
+logger = logging.getLogger(__name__)
+
+Reply = Union[None, int, bytes, List["Reply"]]
+Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+# Deletes a lease only if it still belongs to the owner given, atomically
+RELEASE_LEASE_SCRIPT = 'if redis.call("GET", KEYS[1]) == ARGV[1] then return redis.call("DEL", KEYS[1]) else return 0 end'
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisUnavailable(ConnectionError):
+    """Raised without contacting the server while it is considered unreachable."""
+
+
+class RedisCache:
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        ttl: float = 24 * 3600,
+        prefix: str = "newsletter",
+        timeout: float = 5.0,
+        max_connections: int = 8,
+        retry_interval: float = 30.0
+    ):
+        """
+        Args:
+            url (str): Server URL, redis://[:password@]host[:port][/db]
+            ttl (float): Seconds after which an entry expires
+            prefix (str): Prefix of every key, to share a server with other applications
+            timeout (float): Seconds to wait for a connection or a reply
+            max_connections (int): Connections opened to the server at most, one command at a time on each
+            retry_interval (float): Seconds during which the server isn't contacted again once it
+                was found unreachable, so that requests don't each wait for the timeout
+        """
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Unsupported Redis URL scheme: {parsed.scheme}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.retry_interval = retry_interval
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+        # Idle connections, and the slots bounding the open ones, of the event loop they belong to
+        self._idle: List[Connection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Monotonic time until which the server is considered unreachable
+        self._down_until = 0.0
+
+    async def _connect(self) -> Connection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        connection = (reader, writer)
+        try:
+            if self.password:
+                await self._send(connection, ("AUTH", self.password))
+            if self.db:
+                await self._send(connection, ("SELECT", str(self.db)))
+        except BaseException:
+            writer.close()
+            raise
+        return connection
+
+    @staticmethod
+    def _disconnect(connection: Optional[Connection]) -> None:
+        if connection is not None:
+            connection[1].close()
+
+    async def _send(self, connection: Connection, args: Tuple[str, ...]) -> Reply:
+        reader, writer = connection
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        writer.write(b"".join(parts))
+        await writer.drain()
+        return await self._read_reply(reader)
+
+    async def _read_reply(self, reader: asyncio.StreamReader) -> Reply:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            raise RedisError(payload.decode("utf-8", errors="replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply(reader) for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def _pool(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Connections can't move between event loops, e.g. from one asyncio.run() to the next
+            for connection in self._idle:
+                self._disconnect(connection)
+            self._idle = []
+            self._slots = asyncio.Semaphore(self.max_connections)
+            self._loop = loop
+        return self._slots
+
+    async def command(self, *args: str) -> Reply:
+        """Send a command and return its reply, reconnecting once if the connection dropped."""
+        async with self._pool():
+            if time.monotonic() < self._down_until:
+                raise RedisUnavailable("Redis unavailable, retrying later")
+            for attempt in range(2):
+                connection = self._idle.pop() if self._idle else None
+                try:
+                    if connection is None:
+                        connection = await asyncio.wait_for(self._connect(), self.timeout)
+                    reply = await asyncio.wait_for(self._send(connection, args), self.timeout)
+                except RedisError:
+                    # An error reply leaves the connection usable
+                    if connection is not None:
+                        self._idle.append(connection)
+                    raise
+                except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    self._disconnect(connection)
+                    if attempt == 1:
+                        self._down_until = time.monotonic() + self.retry_interval
+                        raise ConnectionError(f"Redis unavailable: {e!r}") from e
+                    logger.warning(f"Redis connection lost ({e!r}), reconnecting")
+                    continue
+                except BaseException:
+                    # Cancelled mid-command: its reply would be read by the next command
+                    self._disconnect(connection)
+                    raise
+                self._idle.append(connection)
+                return reply
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    async def _command_or(self, default: Reply, action: str, fallback: str, *args: str) -> Reply:
+        """Send a command, returning `default` instead if the server fails to answer it."""
+        try:
+            return await self.command(*args)
+        except RedisUnavailable:
+            # Already reported when the server was found unreachable
+            return default
+        except (ConnectionError, RedisError) as e:
+            logger.warning(f"Redis {action} failed, {fallback}: {e}")
+            return default
+
+    async def aget(self, namespace: str, key: str, record_stats: bool = True) -> Optional[str]:
+        """Return the cached value, or None if it is missing, expired or the server fails."""
+        value = await self._command_or(None, f"read of {namespace}", "treating it as a miss", "GET", self._key(namespace, key))
+        if record_stats:
+            counters = self.misses if value is None else self.hits
+            counters[namespace] = counters.get(namespace, 0) + 1
+        return None if value is None else value.decode("utf-8")
+
+    async def aset(self, namespace: str, key: str, value: str) -> None:
+        """Store a value, expiring after the TTL. Eviction is left to the server's maxmemory policy."""
+        await self._command_or(None, f"write of {namespace}", "skipping it", "SET", self._key(namespace, key), value, "PX", str(int(self.ttl * 1000)))
+
+    async def atry_lock(self, namespace: str, key: str, owner: str, ttl: float) -> bool:
+        """Take the lease of a key for `ttl` seconds, unless another owner holds it. Granted if the server fails."""
+        reply = await self._command_or(
+            b"OK", f"lease of {namespace}", "computing the value without it",
+            "SET", self._key(f"lease:{namespace}", key), owner, "NX", "PX", str(int(ttl * 1000))
+        )
+        return reply is not None
+
+    async def aunlock(self, namespace: str, key: str, owner: str) -> None:
+        """Release a lease taken with atry_lock, if it is still held by `owner`."""
+        await self._command_or(
+            None, f"lease release of {namespace}", "it will expire instead",
+            "EVAL", RELEASE_LEASE_SCRIPT, "1", self._key(f"lease:{namespace}", key), owner
+        )
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return the hit and miss counters per namespace."""
+        namespaces = set(self.hits) | set(self.misses)
+        return {
+            namespace: {"hits": self.hits.get(namespace, 0), "misses": self.misses.get(namespace, 0)}
+            for namespace in sorted(namespaces)
+        }
+
+    def close(self) -> None:
+        for connection in self._idle:
+            self._disconnect(connection)
+        self._idle = []
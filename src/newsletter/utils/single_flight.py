@@ -0,0 +1,107 @@
+"""
+Single-flight.
+Coalesces concurrent computations of the same cache key, within a worker and across the
+workers sharing a cache: one caller computes the value while the others wait for it to
+appear in the cache, so that a page is fetched and summarized once however many
+requests ask for it at the same time.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from newsletter.utils.cache import Cache
+from newsletter.utils.redis_cache import RedisCache
+
+
+class SingleFlight:
+    def __init__(
+        self,
+        cache: Union[Cache, RedisCache],
+        lease_seconds: float = 120.0,
+        poll_interval: float = 0.2
+    ):
+        """
+        Args:
+            cache (Cache | RedisCache): Cache shared by the workers, holding the values and the leases
+            lease_seconds (float): How long a worker owns a key it computes. Waiters take over
+                a key whose lease expired, e.g. because its worker crashed
+            poll_interval (float): Seconds between two checks of a key computed by another worker
+        """
+        self.cache = cache
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(__name__)
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        # Computations running in this worker, by namespace and key
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        # How each call got its value: computed, joined (same worker) or waited (other worker)
+        self.counts: Dict[str, int] = {}
+
+    async def run(self, namespace: str, key: str, compute: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        """
+        Return the value of a key, computing it unless another caller is already doing so.
+
+        Args:
+            namespace (str): Cache namespace of the value
+            key (str): Cache key of the value
+            compute (Callable): Computes the value. The value is cached unless it is None;
+                exceptions are raised to every caller waiting in this worker
+
+        Returns:
+            Optional[str]: The computed or cached value
+        """
+        inflight_key = (namespace, key)
+        task = self._inflight.get(inflight_key)
+        if task is not None:
+            self._count("joined")
+        else:
+            # A task of its own, so that a cancelled caller doesn't cancel the computation of the others
+            task = asyncio.create_task(self._run(namespace, key, compute))
+            self._inflight[inflight_key] = task
+            task.add_done_callback(lambda done: self._forget(inflight_key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, inflight_key: Tuple[str, str], task: asyncio.Task) -> None:
+        del self._inflight[inflight_key]
+        # Retrieved so that an exception whose callers were all cancelled isn't reported as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def _run(self, namespace: str, key: str, compute: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        owner = f"{self.worker}:{uuid.uuid4().hex}"
+        waited = False
+        while True:
+            if await self.cache.atry_lock(namespace, key, owner, self.lease_seconds):
+                try:
+                    # Another worker may have finished between our cache check and the lease
+                    value = await self.cache.aget(namespace, key, record_stats=False)
+                    if value is not None:
+                        self._count("waited")
+                        return value
+                    self._count("computed")
+                    value = await compute()
+                    if value is not None:
+                        await self.cache.aset(namespace, key, value)
+                    return value
+                finally:
+                    await self.cache.aunlock(namespace, key, owner)
+
+            if not waited:
+                self.logger.info(f"Waiting for another worker to compute {namespace} {key[:12]}")
+                waited = True
+            await asyncio.sleep(self.poll_interval)
+            value = await self.cache.aget(namespace, key, record_stats=False)
+            if value is not None:
+                self._count("waited")
+                return value
+            # The lease is retried at the next iteration: it is free again if the other worker
+            # failed without a value, or expired if it crashed
+
+    def _count(self, outcome: str) -> None:
+        self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counts)
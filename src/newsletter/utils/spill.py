@@ -0,0 +1,109 @@
+"""
+Spill to disk.
+Helpers of the memory-bounded mode: a scratch directory holding page contents and summaries
+that don't need to stay in memory, and a heap keeping only the best K items of a stream.
+"""
+import heapq
+import itertools
+import shutil
+import tempfile
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Callable, Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+from newsletter.utils.cache import content_hash
+
+T = TypeVar("T")
+
+
+class SpilledPages(MutableMapping):
+    """Page contents keyed by link, stored one file per page and read back on access."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Insertion-ordered like a dict, so that pages keep their fetch order
+        self._paths: Dict[str, Path] = {}
+
+    def __setitem__(self, link: str, content: str) -> None:
+        path = self.directory / f"{content_hash(link)[:32]}.md"
+        path.write_text(content, encoding="utf-8")
+        self._paths[link] = path
+
+    def __getitem__(self, link: str) -> str:
+        return self._paths[link].read_text(encoding="utf-8")
+
+    def __delitem__(self, link: str) -> None:
+        self._paths.pop(link).unlink(missing_ok=True)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+
+class SpillStore:
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Args:
+            directory (str): Parent of the scratch directory, the system temporary directory by default
+        """
+        if directory is not None:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+        self.directory = Path(tempfile.mkdtemp(prefix="newsletter_spill_", dir=directory))
+        self.pages = SpilledPages(self.directory / "pages")
+        self._records_path = self.directory / "records.jsonl"
+        self._records_file = None
+
+    def append(self, record: str) -> None:
+        """Append a single-line record, e.g. a model serialized with model_dump_json()."""
+        if self._records_file is None:
+            self._records_file = open(self._records_path, "a", encoding="utf-8")
+        self._records_file.write(record + "\n")
+
+    def records(self) -> Iterator[str]:
+        """Iterate over the appended records, oldest first."""
+        if self._records_file is None:
+            return
+        self._records_file.flush()
+        with open(self._records_path, encoding="utf-8") as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+    def close(self) -> None:
+        """Delete everything spilled."""
+        if self._records_file is not None:
+            self._records_file.close()
+            self._records_file = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class TopK(Generic[T]):
+    """Best `k` items of a stream by score, ties going to the earliest, like sorted(..., reverse=True)[:k]."""
+
+    def __init__(self, k: int, score: Callable[[T], float]):
+        self.k = k
+        self.score = score
+        # Min-heap whose root is the first item to drop: lowest score, then latest
+        self._heap: List[Tuple[float, int, T]] = []
+        self._counter = itertools.count()
+
+    def push(self, item: T) -> Optional[T]:
+        """Add an item, returning the one that fell out of the top, if any."""
+        if self.k <= 0:
+            return item
+        entry = (self.score(item), -next(self._counter), item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return None
+        if entry[:2] <= self._heap[0][:2]:
+            return item
+        return heapq.heapreplace(self._heap, entry)[2]
+
+    def items(self) -> List[T]:
+        """The kept items, best first."""
+        return [entry[2] for entry in sorted(self._heap, key=lambda entry: entry[:2], reverse=True)]
+
+    def __len__(self) -> int:
+        return len(self._heap)
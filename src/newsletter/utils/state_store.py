@@ -0,0 +1,50 @@
+"""
+Newsletter state store.
+Keeps the stage outputs of each newsletter (per-link summaries and images, the abstract and
+its inputs) on disk, so that a newsletter can be regenerated incrementally after its link
+list is edited.
+"""
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from newsletter.utils.cache import content_hash
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore:
+    def __init__(self, directory: str = "newsletters"):
+        """
+        Args:
+            directory (str): Directory holding one JSON file per newsletter, created if it doesn't exist
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, newsletter_id: str) -> Path:
+        # Ids come from API clients, so they are hashed rather than used as file names
+        return self.directory / f"{content_hash(newsletter_id)[:32]}.json"
+
+    def load(self, newsletter_id: str) -> Optional[str]:
+        """Return the saved state of a newsletter, or None if it was never saved."""
+        try:
+            return self.path(newsletter_id).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def save(self, newsletter_id: str, state: str) -> None:
+        """Save the state of a newsletter, replacing the previous one atomically."""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".state_", suffix=".part")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(state)
+            os.replace(temp_path, self.path(newsletter_id))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def delete(self, newsletter_id: str) -> None:
+        self.path(newsletter_id).unlink(missing_ok=True)
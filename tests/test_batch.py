@@ -0,0 +1,135 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from openai import AsyncOpenAI
+
+from newsletter.core.newsletter_agent import SUMMARY_ERROR_PREFIX, NewsletterAgent
+from newsletter.utils.batch import LocalBatchBackend, OpenAIBatchBackend, result_content, write_batch_file
+
+
+def summary_json(title: str, score: float) -> str:
+    return json.dumps({"link": "ignored", "title": title, "content_summary": f"About {title}", "interest_score": score})
+
+
+def run_batch(backend, path):
+    async def go():
+        batch_id = await backend.submit(path)
+        assert await backend.wait(batch_id, poll_interval=0) == "completed"
+        return await backend.results(batch_id)
+    return asyncio.run(go())
+
+
+def test_local_backend_answers_each_request_by_custom_id(tmp_path):
+    def responder(body):
+        prompt = body["messages"][0]["content"]
+        if prompt == "fail":
+            raise RuntimeError("model error")
+        return prompt.upper()
+
+    path = write_batch_file(tmp_path / "batch.jsonl", {
+        "page-0": {"messages": [{"role": "user", "content": "first"}]},
+        "page-1": {"messages": [{"role": "user", "content": "fail"}]},
+    })
+    lines = {line["custom_id"]: line for line in run_batch(LocalBatchBackend(responder, polls_until_complete=2), path)}
+
+    assert result_content(lines["page-0"]) == "FIRST"
+    with pytest.raises(ValueError, match="model error"):
+        result_content(lines["page-1"])
+
+
+def test_result_content_rejects_failed_responses():
+    with pytest.raises(ValueError, match="500"):
+        result_content({"custom_id": "page-0", "response": {"status_code": 500, "body": {}}, "error": None})
+
+
+class FakeOpenAI:
+    """Batches and files endpoints of the OpenAI client, serving fixed output and error files."""
+
+    def __init__(self, files):
+        self.files_content = files
+        self.batches = SimpleNamespace(retrieve=self.retrieve)
+        self.files = SimpleNamespace(content=self.content)
+
+    async def retrieve(self, batch_id):
+        return SimpleNamespace(id=batch_id, status="completed", output_file_id="output", error_file_id="errors")
+
+    async def content(self, file_id):
+        return SimpleNamespace(text="\n".join(json.dumps(line) for line in self.files_content[file_id]) + "\n")
+
+
+def test_openai_backend_collects_output_and_error_files():
+    ok = {"custom_id": "page-1", "response": {"status_code": 200, "body": {"choices": [{"message": {"content": "done"}}]}}, "error": None}
+    failed = {"custom_id": "page-0", "response": None, "error": {"message": "expired"}}
+    backend = OpenAIBatchBackend(FakeOpenAI({"output": [ok], "errors": [failed]}))
+
+    lines = asyncio.run(backend.results("batch_1"))
+
+    assert [line["custom_id"] for line in lines] == ["page-1", "page-0"]
+    assert result_content(lines[0]) == "done"
+
+
+def test_agent_maps_batch_results_back_to_their_pages(tmp_path):
+    pages = {
+        "https://example.com/a": "Article A " * 20,
+        "https://example.com/b": "Article B " * 20,
+        "https://example.com/c": "Article C " * 20,
+    }
+
+    def responder(body):
+        prompt = json.dumps(body["messages"])
+        if "Article B" in prompt:
+            raise RuntimeError("content filtered")
+        return summary_json("A" if "Article A" in prompt else "C", 8 if "Article A" in prompt else 6)
+
+    class ReversedBackend(LocalBatchBackend):
+        """Returns results in the opposite order of the requests, as the Batch API may."""
+        async def results(self, batch_id):
+            return list(reversed(await super().results(batch_id)))
+
+    agent = NewsletterAgent(
+        AsyncOpenAI(api_key="test"),
+        list(pages),
+        batch_backend=ReversedBackend(responder),
+        batch_dir=str(tmp_path),
+        batch_poll_interval=0
+    )
+
+    async def fetch_related_web_pages(links=None):
+        return dict(pages)
+    agent.fetch_related_web_pages = fetch_related_web_pages
+
+    summaries = asyncio.run(agent.summarize_and_score_all_pages_in_batch())
+
+    assert [summary.link for summary in summaries] == list(pages)
+    by_link = {summary.link: summary for summary in summaries}
+    assert by_link["https://example.com/a"].title == "A"
+    assert by_link["https://example.com/a"].interest_score == 8
+    assert by_link["https://example.com/c"].title == "C"
+    assert by_link["https://example.com/b"].content_summary.startswith(SUMMARY_ERROR_PREFIX)
+    assert "content filtered" in by_link["https://example.com/b"].content_summary
+
+
+def test_agent_marks_pages_of_an_unfinished_batch_as_failed(tmp_path):
+    class ExpiredBackend(LocalBatchBackend):
+        async def status(self, batch_id):
+            return "expired"
+
+    agent = NewsletterAgent(
+        AsyncOpenAI(api_key="test"),
+        ["https://example.com/a"],
+        batch_backend=ExpiredBackend(lambda body: summary_json("A", 8)),
+        batch_dir=str(tmp_path),
+        batch_poll_interval=0
+    )
+
+    async def fetch_related_web_pages(links=None):
+        return {"https://example.com/a": "Article A " * 20}
+    agent.fetch_related_web_pages = fetch_related_web_pages
+
+    [summary] = asyncio.run(agent.summarize_and_score_all_pages_in_batch())
+
+    assert summary.link == "https://example.com/a"
+    assert summary.content_summary.startswith(SUMMARY_ERROR_PREFIX)
+    assert "expired" in summary.content_summary
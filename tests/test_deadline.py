@@ -0,0 +1,65 @@
+import pytest
+
+from newsletter.core import deadline as deadline_module
+from newsletter.core.deadline import DEFAULT_SHARES, Deadline, parse_stage_shares
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Frozen time.time(), moved forward by assigning clock.now."""
+    class Clock:
+        now = 1000.0
+    monkeypatch.setattr(deadline_module.time, "time", lambda: Clock.now)
+    return Clock
+
+
+def test_budgets_follow_the_shares_at_the_start(clock):
+    deadline = Deadline(100)
+    assert deadline.budget("fetch") == pytest.approx(100 * DEFAULT_SHARES["fetch"])
+    assert deadline.budget("render") == pytest.approx(100)
+
+
+def test_last_stage_gets_all_the_time_left(clock):
+    deadline = Deadline(10)
+    clock.now += 4
+    assert deadline.budget("render") == pytest.approx(6)
+
+
+def test_unused_time_goes_to_the_later_stages(clock):
+    deadline = Deadline(100, {"fetch": 1, "summarize": 1, "abstract": 1, "images": 1, "render": 0})
+    # Fetching took 5 seconds instead of its 25: the 95 left are split between the 3 stages after it
+    clock.now += 5
+    assert deadline.budget("summarize") == pytest.approx(95 / 3)
+
+
+def test_overrun_leaves_no_budget(clock):
+    deadline = Deadline(10)
+    clock.now += 11
+    assert deadline.remaining() == 0
+    assert deadline.budget("fetch") == 0
+
+
+def test_stages_without_share_fall_back_to_the_time_left(clock):
+    deadline = Deadline(10, {"fetch": 1})
+    assert deadline.budget("abstract") == pytest.approx(10)
+
+
+def test_negative_shares_count_as_zero(clock):
+    deadline = Deadline(10, {"fetch": -1, "summarize": 1})
+    assert deadline.budget("fetch") == 0
+    assert deadline.budget("summarize") == pytest.approx(10)
+
+
+def test_rejects_non_positive_deadlines():
+    with pytest.raises(ValueError):
+        Deadline(0)
+
+
+def test_parse_stage_shares_overrides_defaults():
+    shares = parse_stage_shares("fetch:0.5, images:0")
+    assert shares == {**DEFAULT_SHARES, "fetch": 0.5, "images": 0.0}
+
+
+def test_parse_stage_shares_rejects_unknown_stages():
+    with pytest.raises(ValueError):
+        parse_stage_shares("download:0.5")
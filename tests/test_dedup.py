@@ -0,0 +1,54 @@
+from newsletter.utils.dedup import canonicalize_url, find_canonical_link, hamming_distance, simhash
+
+
+def test_lowercases_scheme_and_host_but_not_path():
+    assert canonicalize_url("HTTPS://Example.COM/Article") == "https://example.com/Article"
+
+
+def test_drops_default_ports_only():
+    assert canonicalize_url("https://example.com:443/a") == "https://example.com/a"
+    assert canonicalize_url("http://example.com:80/a") == "http://example.com/a"
+    assert canonicalize_url("http://example.com:8080/a") == "http://example.com:8080/a"
+
+
+def test_drops_fragment_and_trailing_slash():
+    assert canonicalize_url("https://example.com/a/#comments") == "https://example.com/a"
+    assert canonicalize_url("https://example.com") == "https://example.com/"
+
+
+def test_drops_tracking_parameters_and_sorts_the_others():
+    url = "https://example.com/a?utm_source=x&b=2&fbclid=y&a=1&UTM_Medium=z"
+    assert canonicalize_url(url) == "https://example.com/a?a=1&b=2"
+
+
+def test_keeps_blank_query_values():
+    assert canonicalize_url("https://example.com/a?flag=") == "https://example.com/a?flag="
+
+
+def test_variants_compare_equal():
+    variants = [
+        "https://example.com/news/story?id=3",
+        " https://EXAMPLE.com:443/news/story/?id=3&utm_campaign=mail#top ",
+    ]
+    assert len({canonicalize_url(url) for url in variants}) == 1
+
+
+def test_finds_the_canonical_link_in_the_head():
+    html = '<html><head><link href="/story" rel="canonical"></head><body><link rel="canonical" href="/other"></body></html>'
+    assert find_canonical_link(html, "https://example.com/amp/story") == "https://example.com/story"
+    assert find_canonical_link("<html><head></head></html>", "https://example.com/") is None
+
+
+ARTICLE = " ".join(f"word{index % 97} topic{index % 13}" for index in range(600))
+
+
+def test_simhash_is_stable_and_ignores_case():
+    assert simhash(ARTICLE) == simhash(ARTICLE.upper())
+    assert 0 <= simhash(ARTICLE) < 1 << 64
+
+
+def test_near_duplicates_have_close_fingerprints():
+    syndicated = "Republished from another site. " + ARTICLE + " Share this article."
+    unrelated = " ".join(f"other{index % 89} subject{index % 7}" for index in range(600))
+    assert hamming_distance(simhash(ARTICLE), simhash(syndicated)) <= 3
+    assert hamming_distance(simhash(ARTICLE), simhash(unrelated)) > 3
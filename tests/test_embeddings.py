@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from openai import AsyncOpenAI
+
+from newsletter.core.newsletter_agent import NewsletterAgent
+from newsletter.core.resources import AppResources
+from newsletter.utils.embeddings import HashingEmbeddingModel, PreRanker
+
+PROFILE = "database indexes and query planners"
+
+PAGES = {
+    "https://example.com/cooking": "A recipe for bread with flour, water and salt. " * 10,
+    "https://example.com/planner": "How the query planner of a database picks indexes for a query. " * 10,
+    "https://example.com/football": "The football match ended with a late goal. " * 10,
+    "https://example.com/indexes": "Database indexes speed up query lookups. " * 10,
+    "https://example.com/empty": "",
+}
+
+
+class CountingModel(HashingEmbeddingModel):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def embed(self, texts):
+        self.calls += 1
+        return await super().embed(texts)
+
+
+def test_keeps_the_pages_closest_to_the_profile():
+    candidates, tail, similarities = asyncio.run(PreRanker(HashingEmbeddingModel(), PROFILE, candidates=2).rank(PAGES))
+
+    assert set(candidates) == {"https://example.com/planner", "https://example.com/indexes"}
+    assert set(tail) == set(PAGES) - set(candidates)
+    # Both lists best first, pages without text last
+    ranked = candidates + tail
+    assert [similarities[link] for link in ranked] == sorted(similarities.values(), reverse=True)
+    assert tail[-1] == "https://example.com/empty"
+
+
+def test_keeps_every_page_when_there_are_few_enough():
+    model = CountingModel()
+    candidates, tail, similarities = asyncio.run(PreRanker(model, PROFILE, candidates=len(PAGES)).rank(PAGES))
+
+    assert candidates == list(PAGES)
+    assert tail == [] and similarities == {}
+    assert model.calls == 0
+
+
+def test_embeds_the_profile_once():
+    model = CountingModel()
+    ranker = PreRanker(model, PROFILE, candidates=1)
+
+    async def rank_twice():
+        await ranker.rank(PAGES)
+        await ranker.rank(PAGES)
+    asyncio.run(rank_twice())
+
+    # One call for the profile, one per ranking for the pages
+    assert model.calls == 3
+
+
+def test_agent_lists_ranked_out_pages_by_title_below_every_summary():
+    agent = NewsletterAgent(AsyncOpenAI(api_key="test"), list(PAGES), max_summaries=2, pre_ranker=PreRanker(HashingEmbeddingModel(), PROFILE, candidates=2))
+    pages = {link: f"# {link.rsplit('/', 1)[1].title()}\n\n{text}" for link, text in PAGES.items()}
+
+    kept, tail_summaries = asyncio.run(agent.pre_rank_pages(pages))
+
+    assert set(kept) == {"https://example.com/planner", "https://example.com/indexes"}
+    assert {summary.link for summary in tail_summaries} == set(PAGES) - set(kept)
+    assert all(not summary.content_summary and summary.interest_score < 1 for summary in tail_summaries)
+    assert {summary.title for summary in tail_summaries} == {"Cooking", "Football", "Empty"}
+
+
+def test_agent_rejects_fewer_candidates_than_featured_pages():
+    with pytest.raises(ValueError, match="at least max_summaries"):
+        NewsletterAgent(AsyncOpenAI(api_key="test"), [], max_summaries=8, pre_ranker=PreRanker(HashingEmbeddingModel(), PROFILE, candidates=4))
+
+
+@pytest.mark.parametrize("candidates, valid", [("0", True), ("3", False), ("8", True), ("64", True)])
+def test_pre_rank_candidates_setting_is_checked_at_startup(monkeypatch, candidates, valid):
+    monkeypatch.setenv("PRERANK_CANDIDATES", candidates)
+    if valid:
+        assert AppResources.pre_rank_candidates_from_env() == int(candidates)
+    else:
+        with pytest.raises(ValueError, match="PRERANK_CANDIDATES"):
+            AppResources.pre_rank_candidates_from_env()
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from newsletter.core.newsletter_agent import NewsletterAgent, PageSummary
+from newsletter.utils.link_fetcher import LinkFetcher
+from newsletter.utils.llm_scheduler import LLMScheduler
+
+PAGES = 60
+PAGE_BYTES = 1024 * 1024
+MB = 1024 * 1024
+
+pytestmark = pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="reads the RSS from /proc")
+
+
+def current_rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class SlowSummaries:
+    """Chat completions answering each summary after a delay, so that pages pile up unless bounded."""
+
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=self))
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def parse(self, model, messages, response_format, **kwargs):
+        await asyncio.sleep(self.delay)
+        parsed = PageSummary(link="", title="Page", content_summary="Summary", interest_score=5)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(parsed=parsed))], usage=None)
+
+
+async def fake_fetch_page(self, session, link):
+    # A distinct beginning so that pages aren't collapsed as near-duplicates, then filler
+    rng = random.Random(link)
+    words = " ".join(f"w{rng.randrange(100_000)}" for _ in range(3000))
+    return words + " filler" * ((PAGE_BYTES - len(words)) // 7)
+
+
+def peak_rss_growth(memory_bounded: bool, tmp_path) -> int:
+    """Peak RSS above the starting point while the agent summarizes every page."""
+    agent = NewsletterAgent(
+        SlowSummaries(),
+        [f"https://example.com/article/{index}" for index in range(PAGES)],
+        llm_scheduler=LLMScheduler(requests_per_minute=100_000, tokens_per_minute=100_000_000),
+        memory_bounded=memory_bounded,
+        memory_window=4,
+        spill_dir=str(tmp_path)
+    )
+
+    async def run() -> int:
+        baseline = peak = current_rss()
+        task = asyncio.create_task(agent.summarize_and_score_all_pages())
+        while not task.done():
+            peak = max(peak, current_rss())
+            await asyncio.sleep(0.002)
+        assert len(await task) == PAGES
+        agent.close_spill()
+        return peak - baseline
+    return asyncio.run(run())
+
+
+def test_memory_bounded_mode_keeps_rss_bounded(monkeypatch, tmp_path):
+    monkeypatch.setattr(LinkFetcher, "fetch_page", fake_fetch_page)
+
+    bounded = peak_rss_growth(True, tmp_path / "bounded")
+    unbounded = peak_rss_growth(False, tmp_path / "default")
+
+    # The window holds a few pages being summarized and a few being fetched, whatever the number of links
+    assert bounded < 32 * MB, f"memory-bounded mode grew the RSS by {bounded / MB:.0f} MB"
+    # Otherwise every page is held until it is summarized
+    assert unbounded > 2 * bounded, f"default mode grew the RSS by {unbounded / MB:.0f} MB, memory-bounded by {bounded / MB:.0f} MB"
@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+import pytest
+
+from newsletter.utils.cache import Cache
+from newsletter.utils.redis_cache import RedisCache
+from newsletter.utils.single_flight import SingleFlight
+from stand_ins import FakeRedisServer
+
+
+def run_with_redis(scenario):
+    """Run scenario(server, cache) against a fresh Redis stand-in."""
+    async def main():
+        server = FakeRedisServer()
+        await server.start()
+        cache = RedisCache(server.url, ttl=60)
+        try:
+            return await scenario(server, cache)
+        finally:
+            cache.close()
+            await server.stop()
+    return asyncio.run(main())
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def with_cache(request, tmp_path):
+    """Run scenario(cache) against each cache backend."""
+    def run(scenario):
+        if request.param == "redis":
+            return run_with_redis(lambda server, cache: scenario(cache))
+        cache = Cache(path=str(tmp_path / "cache.sqlite3"), ttl=60)
+        try:
+            return asyncio.run(scenario(cache))
+        finally:
+            cache.close()
+    return run
+
+
+def test_redis_cache_hits_and_misses():
+    async def scenario(server, cache):
+        assert await cache.aget("page", "a") is None
+        await cache.aset("page", "a", "content")
+        assert await cache.aget("page", "a") == "content"
+        return cache.stats()
+
+    assert run_with_redis(scenario) == {"page": {"hits": 1, "misses": 1}}
+
+
+def test_redis_entries_expire_after_the_ttl():
+    async def scenario(server, cache):
+        cache.ttl = 0.05
+        await cache.aset("page", "a", "content")
+        await asyncio.sleep(0.1)
+        return await cache.aget("page", "a")
+
+    assert run_with_redis(scenario) is None
+
+
+def test_redis_lease_is_released_by_its_owner_only():
+    async def scenario(server, cache):
+        assert await cache.atry_lock("page", "a", "first", ttl=10)
+        assert not await cache.atry_lock("page", "a", "second", ttl=10)
+        await cache.aunlock("page", "a", "second")
+        assert not await cache.atry_lock("page", "a", "second", ttl=10)
+        await cache.aunlock("page", "a", "first")
+        return await cache.atry_lock("page", "a", "second", ttl=10)
+
+    assert run_with_redis(scenario)
+
+
+def test_redis_lease_expires():
+    async def scenario(server, cache):
+        assert await cache.atry_lock("page", "a", "crashed", ttl=0.05)
+        await asyncio.sleep(0.1)
+        return await cache.atry_lock("page", "a", "next", ttl=10)
+
+    assert run_with_redis(scenario)
+
+
+def test_unreachable_redis_degrades_to_misses():
+    async def scenario():
+        server = FakeRedisServer()
+        await server.start()
+        url = server.url
+        await server.stop()
+        cache = RedisCache(url, timeout=1)
+        await cache.aset("page", "a", "content")
+        value = await cache.aget("page", "a")
+        leased = await cache.atry_lock("page", "a", "owner", ttl=10)
+        await cache.aunlock("page", "a", "owner")
+        computed = await SingleFlight(cache).run("page", "b", compute_value("fresh"))
+        return value, leased, computed
+
+    assert asyncio.run(scenario()) == (None, True, "fresh")
+
+
+def compute_value(value, delay=0.0, calls=None):
+    async def compute():
+        if calls is not None:
+            calls.append(value)
+        await asyncio.sleep(delay)
+        return value
+    return compute
+
+
+def test_single_flight_computes_once_for_concurrent_callers(with_cache):
+    calls = []
+
+    async def scenario(cache):
+        flight = SingleFlight(cache, poll_interval=0.01)
+        values = await asyncio.gather(*[flight.run("page", "a", compute_value("content", 0.05, calls)) for _ in range(5)])
+        return values, flight.stats(), await cache.aget("page", "a")
+
+    values, stats, cached = with_cache(scenario)
+    assert values == ["content"] * 5
+    assert calls == ["content"]
+    assert stats == {"computed": 1, "joined": 4}
+    assert cached == "content"
+
+
+def test_single_flight_waits_for_another_worker(with_cache):
+    calls = []
+
+    async def scenario(cache):
+        # Two instances stand for two worker processes sharing the cache
+        first, second = SingleFlight(cache, poll_interval=0.01), SingleFlight(cache, poll_interval=0.01)
+        values = await asyncio.gather(
+            first.run("page", "a", compute_value("content", 0.1, calls)),
+            second.run("page", "a", compute_value("content", 0.1, calls))
+        )
+        return values, sorted([*first.stats(), *second.stats()])
+
+    values, outcomes = with_cache(scenario)
+    assert values == ["content", "content"]
+    assert calls == ["content"]
+    assert outcomes == ["computed", "waited"]
+
+
+def test_single_flight_takes_over_an_expired_lease(with_cache):
+    async def scenario(cache):
+        # A worker that crashed while computing the value left its lease behind
+        assert await cache.atry_lock("page", "a", "crashed", ttl=0.1)
+        flight = SingleFlight(cache, lease_seconds=10, poll_interval=0.02)
+        start_time = time.monotonic()
+        value = await flight.run("page", "a", compute_value("content"))
+        return value, time.monotonic() - start_time, flight.stats()
+
+    value, elapsed, stats = with_cache(scenario)
+    assert value == "content"
+    assert elapsed >= 0.08
+    assert stats == {"computed": 1}
+
+
+def test_single_flight_doesnt_cache_missing_values(with_cache):
+    async def scenario(cache):
+        flight = SingleFlight(cache)
+        assert await flight.run("page", "a", compute_value(None)) is None
+        return await cache.aget("page", "a")
+
+    assert with_cache(scenario) is None
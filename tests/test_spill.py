@@ -0,0 +1,41 @@
+import random
+
+from newsletter.utils.spill import TopK
+
+
+def test_keeps_the_best_items_best_first():
+    top = TopK(3, lambda x: x)
+    for value in [5, 1, 9, 3, 7, 2]:
+        top.push(value)
+    assert top.items() == [9, 7, 5]
+    assert len(top) == 3
+
+
+def test_push_returns_the_item_that_fell_out():
+    top = TopK(2, lambda x: x)
+    assert top.push(1) is None
+    assert top.push(3) is None
+    assert top.push(2) == 1
+    assert top.push(0) == 0
+
+
+def test_ties_go_to_the_earliest_item():
+    top = TopK(2, lambda item: item[0])
+    for item in [(1, "a"), (1, "b"), (1, "c")]:
+        top.push(item)
+    assert top.items() == [(1, "a"), (1, "b")]
+
+
+def test_matches_a_stable_sort():
+    rng = random.Random(0)
+    items = [(rng.randint(0, 10), index) for index in range(200)]
+    top = TopK(15, lambda item: item[0])
+    for item in items:
+        top.push(item)
+    assert top.items() == sorted(items, key=lambda item: item[0], reverse=True)[:15]
+
+
+def test_zero_size_keeps_nothing():
+    top = TopK(0, lambda x: x)
+    assert top.push(1) == 1
+    assert top.items() == []